@@ -0,0 +1,613 @@
+"""In-process stand-in for the maya.cmds, maya.mel and maya.OpenMaya calls of functionsCore.
+
+Only the commands and flags the core modules use are modelled, on a small in-memory scene:
+meshes with their points, blendShape nodes with aliases, weights, user attributes and the
+inputTarget point data, anim curves and plain connections. Every command and API entry point
+is counted so benchmarks can report how many Maya calls an operation makes.
+"""
+import collections
+import os
+import random
+import sys
+import types
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+TARGET_ITEM_INDEX = 6000
+
+_scene = None
+
+
+class StandInScene(object):
+    """nodes, connections, selection and call counts of one stand-in Maya session"""
+
+    def __init__(self, scenePath):
+        self.scenePath = scenePath
+        self.nodes = {}
+        self.connections = {}
+        self.selection = []
+        self.calls = collections.Counter()
+        self.warnings = []
+        self.currentTime = 1.0
+        self.playbackRange = (1.0, 120.0)
+        self.scriptJobs = 0
+        self.undoState = True
+
+    def createNode(self, nodeType, name, **data):
+        if name in self.nodes:
+            index = 1
+            while "{}{}".format(name, index) in self.nodes:
+                index += 1
+            name = "{}{}".format(name, index)
+        node = {'type': nodeType, 'attrs': {}, 'userAttrs': [], 'aliases': {}}
+        node.update(data)
+        self.nodes[name] = node
+        return name
+
+    def renameNode(self, name, newName):
+        node = self.nodes.pop(name)
+        self.nodes[newName] = node
+        for other in self.nodes.values():
+            if other.get('shape') == name:
+                other['shape'] = newName
+            if name in other.get('deformers', []):
+                other['deformers'] = [newName if deformer == name else deformer for deformer in other['deformers']]
+        prefix = name + "."
+        self.connections = dict(
+            (newName + destination[len(name):] if destination.startswith(prefix) else destination,
+             newName + source[len(name):] if source.startswith(prefix) else source)
+            for destination, source in self.connections.items())
+        self.selection = [newName if selected == name else selected for selected in self.selection]
+        return newName
+
+    def resetCalls(self):
+        self.calls.clear()
+
+    def resolvePlug(self, plug):
+        """get (node name, canonical attribute) of node.attribute, aliases resolved to weight[i]"""
+        nodeName, attribute = plug.split(".", 1)
+        node = self.nodes[nodeName]
+        return nodeName, node['aliases'].get(attribute, attribute)
+
+    def getMeshNode(self, name):
+        node = self.nodes[name]
+        if node['type'] == 'transform':
+            return self.nodes[node['shape']]
+        return node
+
+
+def setScene(scene):
+    """make scene the one the stand-in commands read and write"""
+    global _scene
+    _scene = scene
+    return scene
+
+
+def getScene():
+    return _scene
+
+
+def _counted(name, function):
+    def wrapper(*args, **kwargs):
+        _scene.calls[name] += 1
+        return function(*args, **kwargs)
+    wrapper.__name__ = function.__name__
+    return wrapper
+
+
+def _flag(kwargs, *names):
+    for name in names:
+        if name in kwargs:
+            return kwargs[name]
+    return None
+
+
+# maya.cmds ------------------------------------------------------------------------------------
+
+def _ls(*args, **kwargs):
+    if _flag(kwargs, 'selection', 'sl'):
+        names = list(_scene.selection)
+    elif not args:
+        names = list(_scene.nodes)
+    else:
+        names = []
+        for arg in args:
+            names.extend(arg if isinstance(arg, (list, tuple)) else [arg])
+    nodeType = _flag(kwargs, 'type')
+    if nodeType:
+        names = [name for name in names if name in _scene.nodes and _scene.nodes[name]['type'] == nodeType]
+    return names
+
+
+def _select(*args, **kwargs):
+    names = []
+    for arg in args:
+        names.extend(arg if isinstance(arg, (list, tuple)) else [arg])
+    _scene.selection = names
+
+
+def _listHistory(*args, **kwargs):
+    history = []
+    for arg in args:
+        for name in (arg if isinstance(arg, (list, tuple)) else [arg]):
+            node = _scene.nodes[name]
+            history.append(name)
+            if node['type'] == 'transform':
+                history.append(node['shape'])
+            history.extend(node.get('deformers', []))
+    return history
+
+
+def _rename(name, newName, **kwargs):
+    return _scene.renameNode(name, newName)
+
+
+def _listRelatives(name, **kwargs):
+    if _flag(kwargs, 'parent', 'p'):
+        parents = [transform for transform, node in _scene.nodes.items() if node.get('shape') == name]
+        return parents or None
+    shape = _scene.nodes[name].get('shape')
+    return [shape] if shape else None
+
+
+def _objExists(name):
+    return name in _scene.nodes
+
+
+def _nodeType(name):
+    return _scene.nodes[name]['type']
+
+
+def _polyEvaluate(mesh, **kwargs):
+    return len(_scene.getMeshNode(mesh)['points']) // 3
+
+
+def _file(*args, **kwargs):
+    if _flag(kwargs, 'query', 'q') and _flag(kwargs, 'sceneName', 'sn'):
+        return _scene.scenePath
+    return None
+
+
+def _warning(message):
+    _scene.warnings.append(message)
+
+
+def _undoInfo(*args, **kwargs):
+    if _flag(kwargs, 'query', 'q'):
+        return _scene.undoState
+    for name in ('stateWithoutFlush', 'swf', 'state', 'st'):
+        if name in kwargs:
+            _scene.undoState = bool(kwargs[name])
+    return None
+
+
+def _currentUnit(**kwargs):
+    return 'film'
+
+
+def _currentTime(*args, **kwargs):
+    if _flag(kwargs, 'query', 'q'):
+        return _scene.currentTime
+    if args:
+        _scene.currentTime = float(args[0])
+    return _scene.currentTime
+
+
+def _playbackOptions(**kwargs):
+    if _flag(kwargs, 'minTime', 'min'):
+        return _scene.playbackRange[0]
+    return _scene.playbackRange[1]
+
+
+def _aliasAttr(*args, **kwargs):
+    if _flag(kwargs, 'query', 'q'):
+        aliases = _scene.nodes[args[0]]['aliases']
+        if not aliases:
+            return None
+        flat = []
+        for alias, attribute in aliases.items():
+            flat.extend([alias, attribute])
+        return flat
+    alias, plug = args
+    nodeName, attribute = _scene.resolvePlug(plug)
+    aliases = _scene.nodes[nodeName]['aliases']
+    # an attribute has one alias, setting another renames it
+    for previousAlias in [name for name, target in aliases.items() if target == attribute]:
+        del aliases[previousAlias]
+    aliases[alias] = attribute
+
+
+def _attributeQuery(attribute, node=None, exists=False, **kwargs):
+    node = _scene.nodes[node]
+    return attribute in node['aliases'] or attribute in node['userAttrs'] or attribute in node['attrs']
+
+
+def _listAttr(name, **kwargs):
+    node = _scene.nodes[name]
+    if _flag(kwargs, 'userDefined', 'ud'):
+        return list(node['userAttrs'])
+    return list(node['attrs']) + list(node['userAttrs'])
+
+
+def _addAttr(name, longName=None, attributeType=None, dataType=None, defaultValue=None, **kwargs):
+    node = _scene.nodes[name]
+    if longName in node['userAttrs']:
+        raise RuntimeError("Found a conflicting attribute name {}".format(longName))
+    node['userAttrs'].append(longName)
+    node['attrs'][longName] = defaultValue if defaultValue is not None else (None if dataType else 0)
+
+
+def _getAttr(plug, **kwargs):
+    nodeName, attribute = _scene.resolvePlug(plug)
+    node = _scene.nodes[nodeName]
+    if _flag(kwargs, 'multiIndices', 'mi'):
+        prefix = attribute + "["
+        return sorted(int(key[len(prefix):key.index("]", len(prefix))]) for key in node['attrs']
+                      if key.startswith(prefix) and "." not in key[len(prefix):])
+    value = node['attrs'].get(attribute)
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+def _setAttr(plug, *values, **kwargs):
+    nodeName, attribute = _scene.resolvePlug(plug)
+    node = _scene.nodes[nodeName]
+    dataType = _flag(kwargs, 'type', 'typ')
+    if dataType in ('pointArray', 'componentList'):
+        node['attrs'][attribute] = list(values[1:])
+    elif attribute.startswith("ktv["):
+        node['times'] = list(values[0::2])
+        node['values'] = list(values[1::2])
+        count = len(node['times'])
+        for key, default in (('inTangentTypes', 'auto'), ('outTangentTypes', 'auto'), ('inX', 1.0), ('inY', 0.0),
+                             ('outX', 1.0), ('outY', 0.0), ('tangentLocks', True)):
+            node[key] = [default] * count
+    else:
+        node['attrs'][attribute] = values[0] if len(values) == 1 else list(values)
+
+
+def _connectAttr(source, destination, **kwargs):
+    destinationNode, destinationAttribute = _scene.resolvePlug(destination)
+    sourceNode, sourceAttribute = _scene.resolvePlug(source)
+    _scene.connections["{}.{}".format(destinationNode, destinationAttribute)] = "{}.{}".format(sourceNode, sourceAttribute)
+
+
+def _listConnections(plug, plugs=False, **kwargs):
+    nodeName, attribute = _scene.resolvePlug(plug)
+    source = _scene.connections.get("{}.{}".format(nodeName, attribute))
+    if source is None:
+        return None
+    return [source if plugs else source.split(".")[0]]
+
+
+def _createNode(nodeType, name=None, **kwargs):
+    data = {}
+    if nodeType.startswith('animCurve'):
+        data = {'times': [], 'values': [], 'inTangentTypes': [], 'outTangentTypes': [], 'inX': [], 'inY': [],
+                'outX': [], 'outY': [], 'tangentLocks': [], 'weighted': False,
+                'preInfinity': 'constant', 'postInfinity': 'constant'}
+    return _scene.createNode(nodeType, name or nodeType + "1", **data)
+
+
+def _duplicate(name, **kwargs):
+    source = _scene.nodes[name]
+    copy = dict((key, list(value) if isinstance(value, list) else value) for key, value in source.items())
+    return [_scene.createNode(source['type'], kwargs.get('n', kwargs.get('name', name)), **copy)]
+
+
+def _keyframe(curve, **kwargs):
+    node = _scene.nodes[curve]
+    if _flag(kwargs, 'timeChange', 'tc'):
+        return list(node['times'])
+    if _flag(kwargs, 'valueChange', 'vc'):
+        return list(node['values'])
+    return len(node['times'])
+
+
+_TANGENT_FLAGS = {'inTangentType': 'inTangentTypes', 'itt': 'inTangentTypes', 'outTangentType': 'outTangentTypes',
+                  'ott': 'outTangentTypes', 'ix': 'inX', 'iy': 'inY', 'ox': 'outX', 'oy': 'outY',
+                  'lock': 'tangentLocks', 'l': 'tangentLocks'}
+
+
+def _keyTangent(curve, **kwargs):
+    node = _scene.nodes[curve]
+    if _flag(kwargs, 'query', 'q'):
+        if _flag(kwargs, 'weightedTangents', 'wt'):
+            return [node['weighted']]
+        for flag, key in _TANGENT_FLAGS.items():
+            if kwargs.get(flag):
+                return list(node[key])
+        return None
+
+    if _flag(kwargs, 'weightedTangents', 'wt') is not None:
+        node['weighted'] = bool(_flag(kwargs, 'weightedTangents', 'wt'))
+    indices = kwargs.get('index')
+    if indices is None:
+        indices = [(0, len(node['times']) - 1)]
+    elif isinstance(indices, tuple):
+        indices = [indices]
+    for flag, key in _TANGENT_FLAGS.items():
+        if flag not in kwargs:
+            continue
+        for start, end in indices:
+            for index in range(start, end + 1):
+                node[key][index] = kwargs[flag]
+
+
+def _setInfinity(curve, **kwargs):
+    node = _scene.nodes[curve]
+    if _flag(kwargs, 'query', 'q'):
+        if _flag(kwargs, 'preInfinite', 'pri'):
+            return [node['preInfinity']]
+        return [node['postInfinity']]
+    if _flag(kwargs, 'preInfinite', 'pri'):
+        node['preInfinity'] = _flag(kwargs, 'preInfinite', 'pri')
+    if _flag(kwargs, 'postInfinite', 'poi'):
+        node['postInfinity'] = _flag(kwargs, 'postInfinite', 'poi')
+
+
+def _setKeyframe(*args, **kwargs):
+    return len(args[0]) if args and isinstance(args[0], list) else 1
+
+
+def _blendShape(*args, **kwargs):
+    mesh = args[-1]
+    name = _scene.createNode('blendShape', kwargs.get('name', kwargs.get('n', 'blendShape1')))
+    _scene.nodes[name]['attrs']['envelope'] = 1.0
+    _scene.nodes[mesh].setdefault('deformers', []).append(name)
+    return [name]
+
+
+def _xform(*args, **kwargs):
+    if not _flag(kwargs, 'query', 'q') or not _flag(kwargs, 'translation', 't'):
+        return None
+    # vertex positions of mesh.vtx[*], mesh.vtx[i] or mesh.vtx[a:b], the stand-in has no transforms
+    meshName, component = args[0].split(".", 1)
+    points = _scene.getMeshNode(meshName)['points']
+    indexRange = component[component.index("[") + 1:component.index("]")]
+    if indexRange == "*":
+        return list(points)
+    start, _, end = indexRange.partition(":")
+    return list(points[int(start) * 3:(int(end or start) + 1) * 3])
+
+
+def _scriptJob(*args, **kwargs):
+    # jobs never fire headless, the benchmarks call the callbacks themselves
+    if _flag(kwargs, 'kill', 'k') is not None:
+        return None
+    _scene.scriptJobs += 1
+    return _scene.scriptJobs
+
+
+_COMMANDS = {
+    'ls': _ls, 'select': _select, 'listHistory': _listHistory, 'objExists': _objExists, 'nodeType': _nodeType,
+    'polyEvaluate': _polyEvaluate, 'file': _file, 'warning': _warning, 'undoInfo': _undoInfo,
+    'currentUnit': _currentUnit, 'currentTime': _currentTime, 'playbackOptions': _playbackOptions,
+    'aliasAttr': _aliasAttr, 'attributeQuery': _attributeQuery, 'listAttr': _listAttr, 'addAttr': _addAttr,
+    'getAttr': _getAttr, 'setAttr': _setAttr, 'connectAttr': _connectAttr, 'listConnections': _listConnections,
+    'createNode': _createNode, 'duplicate': _duplicate, 'keyframe': _keyframe, 'keyTangent': _keyTangent,
+    'setInfinity': _setInfinity, 'setKeyframe': _setKeyframe, 'blendShape': _blendShape, 'xform': _xform,
+    'scriptJob': _scriptJob, 'listRelatives': _listRelatives, 'rename': _rename,
+}
+
+
+# maya.mel -------------------------------------------------------------------------------------
+
+def _melEval(command):
+    return None
+
+
+# maya.OpenMaya --------------------------------------------------------------------------------
+
+class MPoint(object):
+    __slots__ = ('x', 'y', 'z', 'w')
+
+    def __init__(self, x=0.0, y=0.0, z=0.0, w=1.0):
+        self.x, self.y, self.z, self.w = x, y, z, w
+
+
+class MPointArray(object):
+
+    def __init__(self):
+        self._values = []
+
+    def length(self):
+        return len(self._values) // 3
+
+    def __getitem__(self, index):
+        values = self._values
+        return MPoint(values[index * 3], values[index * 3 + 1], values[index * 3 + 2])
+
+
+class MIntArray(object):
+
+    def __init__(self):
+        self._values = []
+
+    def length(self):
+        return len(self._values)
+
+    def __getitem__(self, index):
+        return self._values[index]
+
+
+class MObject(object):
+
+    def __init__(self):
+        self.name = None
+
+    def hasFn(self, function):
+        return self.name is not None and _scene.nodes[self.name]['type'] == function
+
+
+class MDagPath(MObject):
+    pass
+
+
+class MSelectionList(object):
+
+    def __init__(self):
+        self._names = []
+
+    def add(self, name):
+        _scene.calls['OpenMaya.MSelectionList.add'] += 1
+        self._names.append(name)
+
+    def getDagPath(self, index, dagPath):
+        dagPath.name = self._names[index]
+
+    def getDependNode(self, index, node):
+        node.name = self._names[index]
+
+
+class MFnMesh(object):
+
+    def __init__(self, dagPath):
+        self.name = dagPath.name
+
+    def getPoints(self, points, space=None):
+        _scene.calls['OpenMaya.MFnMesh.getPoints'] += 1
+        points._values = _scene.getMeshNode(self.name)['points']
+
+    def getTriangles(self, triangleCounts, triangleVertices):
+        _scene.calls['OpenMaya.MFnMesh.getTriangles'] += 1
+        node = _scene.getMeshNode(self.name)
+        if 'triangles' not in node:
+            # synthetic meshes are a triangle strip over their points
+            vertexCount = len(node['points']) // 3
+            node['triangles'] = [index + corner for index in range(vertexCount - 2) for corner in range(3)]
+        triangleVertices._values = node['triangles']
+
+
+class MSpace(object):
+    kObject = 'object'
+    kWorld = 'world'
+
+
+class MFn(object):
+    kBlendShape = 'blendShape'
+    kMesh = 'mesh'
+
+
+_callbackIds = [0]
+
+
+def _addCallback(*args, **kwargs):
+    _scene.calls['OpenMaya.addCallback'] += 1
+    _callbackIds[0] += 1
+    return _callbackIds[0]
+
+
+def _removeCallback(callbackId):
+    return None
+
+
+def _buildOpenMaya():
+    module = types.ModuleType('maya.OpenMaya')
+    for cls in (MPoint, MPointArray, MIntArray, MObject, MDagPath, MSelectionList, MFnMesh, MSpace, MFn):
+        setattr(module, cls.__name__, cls)
+    module.MMessage = type('MMessage', (object,), {'removeCallback': staticmethod(_removeCallback)})
+    module.MDGMessage = type('MDGMessage', (object,), {
+        'addNodeAddedCallback': staticmethod(_addCallback), 'addNodeRemovedCallback': staticmethod(_addCallback),
+        'addConnectionCallback': staticmethod(_addCallback)})
+    module.MSceneMessage = type('MSceneMessage', (object,), {
+        'addCallback': staticmethod(_addCallback), 'kAfterOpen': 1, 'kAfterNew': 2})
+    module.MNodeMessage = type('MNodeMessage', (object,), {
+        'addAttributeChangedCallback': staticmethod(_addCallback),
+        'addAttributeAddedOrRemovedCallback': staticmethod(_addCallback),
+        'addNameChangedCallback': staticmethod(_addCallback), 'addNodePreRemovalCallback': staticmethod(_addCallback),
+        'kAttributeSet': 1, 'kAttributeArrayAdded': 2, 'kAttributeArrayRemoved': 4,
+        'kAttributeRenamed': 8})
+    return module
+
+
+def install():
+    """register the stand-in as the maya, maya.cmds, maya.mel and maya.OpenMaya modules
+
+    Returns:
+        modules (dict): the installed modules by name
+    """
+    maya = types.ModuleType('maya')
+    cmds = types.ModuleType('maya.cmds')
+    for name, function in _COMMANDS.items():
+        setattr(cmds, name, _counted(name, function))
+    mel = types.ModuleType('maya.mel')
+    mel.eval = _counted('mel.eval', _melEval)
+    openMaya = _buildOpenMaya()
+
+    maya.cmds, maya.mel, maya.OpenMaya = cmds, mel, openMaya
+    modules = {'maya': maya, 'maya.cmds': cmds, 'maya.mel': mel, 'maya.OpenMaya': openMaya}
+    sys.modules.update(modules)
+
+    if not hasattr(builtins, 'reload'):
+        # the core modules reload their imports like Maya 2020 and earlier
+        import importlib
+        builtins.reload = importlib.reload
+    return modules
+
+
+def buildMeshScene(scenePath, vertexCount, meshName="bodyMesh", seed=0):
+    """build a scene holding one mesh of vertexCount points, selected
+
+    Returns:
+        scene (StandInScene): the new current scene
+    """
+    scene = setScene(StandInScene(scenePath))
+    generator = random.Random(seed)
+    points = [generator.uniform(-10.0, 10.0) for _ in range(vertexCount * 3)]
+    shape = scene.createNode('mesh', meshName + "Shape", points=points)
+    scene.createNode('transform', meshName, shape=shape)
+    scene.selection = [meshName]
+    return scene
+
+
+def buildBlendshapeScene(scenePath, vertexCount, targetCount, sculptedFraction=0.02, meshName="bodyMesh", seed=0):
+    """build a mesh with a blendShape of targetCount animated sculpt layers like ani_sculpt creates them
+
+    Each layer stores a contiguous region of sculptedFraction of the vertices as a vtx[a:b] component
+    range, has index{N}TargetEdit/TargetFrame attributes and a three key weight curve around its frame.
+
+    Returns:
+        scene (StandInScene): the new current scene
+    """
+    scene = buildMeshScene(scenePath, vertexCount, meshName, seed)
+    generator = random.Random(seed + 1)
+    blendshape = scene.createNode('blendShape', meshName + "_blendShape")
+    node = scene.nodes[blendshape]
+    node['attrs']['envelope'] = 1.0
+    scene.nodes[meshName]['deformers'] = [blendshape]
+
+    regionSize = max(1, int(vertexCount * sculptedFraction))
+    for index in range(targetCount):
+        frame = 1 + index * 2
+        alias = "{}_f{}_target_{}".format(blendshape, frame, index)
+        node['aliases'][alias] = "weight[{}]".format(index)
+        node['attrs']["weight[{}]".format(index)] = 0.0
+
+        start = generator.randrange(0, max(1, vertexCount - regionSize))
+        item = "inputTarget[0].inputTargetGroup[{}].inputTargetItem[{}]".format(index, TARGET_ITEM_INDEX)
+        node['attrs'][item + ".inputPointsTarget"] = [
+            (generator.uniform(-0.5, 0.5), generator.uniform(-0.5, 0.5), generator.uniform(-0.5, 0.5), 1.0)
+            for _ in range(regionSize)]
+        node['attrs'][item + ".inputComponentsTarget"] = ["vtx[{}:{}]".format(start, start + regionSize - 1)]
+
+        for attribute, value in (("index{}TargetEdit".format(index), 0), ("index{}TargetFrame".format(index), float(frame))):
+            node['userAttrs'].append(attribute)
+            node['attrs'][attribute] = value
+
+        curve = _createNode('animCurveTU', "{}_weight_{}".format(blendshape, index))
+        curveNode = scene.nodes[curve]
+        curveNode.update(times=[frame - 5.0, float(frame), frame + 5.0], values=[0.0, 1.0, 0.0],
+                         inTangentTypes=['auto'] * 3, outTangentTypes=['auto'] * 3, inX=[1.0] * 3, inY=[0.0] * 3,
+                         outX=[1.0] * 3, outY=[0.0] * 3, tangentLocks=[True] * 3)
+        scene.connections["{}.weight[{}]".format(blendshape, index)] = curve + ".output"
+    return scene
+
+
+def getScenePath(folder, sceneName="benchmark_v001"):
+    """get a scene file path inside folder, the cacheSculpt folder is created next to it"""
+    return os.path.join(folder, sceneName + ".ma").replace("\\", "/")
@@ -0,0 +1,227 @@
+"""Headless benchmarks of the functionsCore hot paths on synthetic scenes.
+
+Run from the ani_sculpt folder, Maya is replaced by benchmarks.mayaStandIn:
+
+    python -m benchmarks.runBenchmarks --cases quick --report report.json
+    python -m benchmarks.runBenchmarks --cases quick --report report.json --baseline baseline.json
+
+Every operation is timed end to end on a fresh synthetic scene per run, the stand-in counts the
+Maya commands it makes. The report can be compared against a stored baseline, the exit code is 1
+when an operation got slower than the tolerance or makes more Maya calls.
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks import mayaStandIn
+
+REPORT_VERSION = 1
+DEFAULT_TOLERANCE = 0.25
+MINIMUM_DELTA = 0.005
+CASES = {
+    'quick': [(1000, 1), (1000, 50), (10000, 50), (100000, 10)],
+    'full': [(vertices, targets) for vertices in (1000, 10000, 100000, 1000000) for targets in (1, 50, 500)],
+}
+OPERATIONS = ('getVertexPositions', 'getDifVectorPos', 'getBlendshapeAnimationData',
+              'saveAnimation.json', 'saveAnimation.binary', 'loadAnimation.json', 'loadAnimation.binary',
+              'loadAnimation.lazy')
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+MESH = "bodyMesh"
+BLENDSHAPE = MESH + "_blendShape"
+
+
+def _importCore():
+    mayaStandIn.install()
+    import functionsCore.deltaBuffers
+    import functionsCore.coreCmds
+    import functionsCore.coreProcs
+    import functionsCore.blendshapeIndex
+    import functionsCore.layerPager
+    return functionsCore
+
+
+def _resetFolder(folder):
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def _setupOperation(functionsCore, operation, folder, vertices, targets):
+    """build the scene of one run, returns the callable timed for it"""
+    coreCmds = functionsCore.coreCmds
+    coreProcs = functionsCore.coreProcs
+    scenePath = mayaStandIn.getScenePath(folder)
+    functionsCore.blendshapeIndex.clearTargetIndexes()
+    functionsCore.layerPager.clearPagers()
+    _resetFolder(folder)
+
+    if operation == 'getVertexPositions':
+        mayaStandIn.buildMeshScene(scenePath, vertices)
+        return lambda: coreCmds.getVertexPositions(MESH)
+
+    if operation == 'getDifVectorPos':
+        mayaStandIn.buildMeshScene(scenePath, vertices)
+        first = coreCmds.getVertexPositions(MESH)
+        second = functionsCore.deltaBuffers.toPointBuffer([value + 0.01 for value in first])
+        return lambda: coreCmds.getDifVectorPos(first, second)
+
+    mayaStandIn.buildBlendshapeScene(scenePath, vertices, targets)
+    if operation == 'getBlendshapeAnimationData':
+        return lambda: coreProcs.getBlendshapeAnimationData(BLENDSHAPE)
+    if operation == 'saveAnimation.json':
+        return lambda: coreProcs.saveAnimation(BLENDSHAPE)
+    if operation == 'saveAnimation.binary':
+        return lambda: coreProcs.saveAnimation(BLENDSHAPE, binary=True)
+
+    binary = operation != 'loadAnimation.json'
+    lazy = operation == 'loadAnimation.lazy'
+    coreProcs.saveAnimation(BLENDSHAPE, binary=binary)
+    functionsCore.blendshapeIndex.clearTargetIndexes()
+    mayaStandIn.buildMeshScene(scenePath, vertices)
+    return lambda: coreProcs.loadAnimation(BLENDSHAPE, binary=binary, lazy=lazy)
+
+
+def runOperation(functionsCore, operation, vertices, targets, repeat=3):
+    """time one operation on fresh scenes
+
+    Returns:
+        result (dict): operation, vertices, targets, seconds (best run), runs, mayaCalls, calls
+    """
+    folder = tempfile.mkdtemp(prefix="aniSculptBenchmark")
+    runs = []
+    calls = {}
+    try:
+        for _ in range(repeat):
+            run = _setupOperation(functionsCore, operation, folder, vertices, targets)
+            scene = mayaStandIn.getScene()
+            scene.resetCalls()
+            start = _timer()
+            run()
+            runs.append(_timer() - start)
+            calls = dict(scene.calls)
+    finally:
+        functionsCore.blendshapeIndex.clearTargetIndexes()
+        functionsCore.layerPager.clearPagers()
+        shutil.rmtree(folder, ignore_errors=True)
+    return {'operation': operation, 'vertices': vertices, 'targets': targets, 'seconds': min(runs), 'runs': runs,
+            'mayaCalls': sum(count for name, count in calls.items() if not name.startswith('OpenMaya.')),
+            'apiCalls': sum(count for name, count in calls.items() if name.startswith('OpenMaya.')),
+            'calls': calls}
+
+
+def runBenchmarks(cases, operations=OPERATIONS, repeat=3, log=None):
+    """run every operation on every (vertices, targets) case
+
+    Returns:
+        report (dict): JSON serializable report
+    """
+    functionsCore = _importCore()
+    numpy = functionsCore.coreCmds.numpy
+    report = {'version': REPORT_VERSION, 'created': datetime.datetime.now().isoformat(),
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'numpy': numpy.__version__ if numpy is not None else None, 'results': []}
+
+    for vertices, targets in cases:
+        for operation in operations:
+            if operation in ('getVertexPositions', 'getDifVectorPos') and targets != min(t for v, t in cases if v == vertices):
+                # mesh only operations do not depend on the target count
+                continue
+            result = runOperation(functionsCore, operation, vertices, targets, repeat)
+            report['results'].append(result)
+            if log is not None:
+                log("{:<28} {:>8} vtx {:>4} targets {:>10.4f}s {:>7} maya calls".format(
+                    operation, vertices, targets, result['seconds'], result['mayaCalls']))
+    return report
+
+
+def _resultKey(result):
+    return result['operation'], result['vertices'], result['targets']
+
+
+def compareReports(baseline, report, tolerance=DEFAULT_TOLERANCE, minimumDelta=MINIMUM_DELTA):
+    """compare a report with a baseline report
+
+    Args:
+        baseline (dict): stored report
+        report (dict): new report
+        tolerance (float): relative slowdown allowed before an operation is a regression
+        minimumDelta (float): slowdowns under this many seconds are ignored as noise
+
+    Returns:
+        comparison (list): one dict per result found in both, with operation, vertices, targets,
+            baseline and current seconds, ratio, baseline and current mayaCalls and regression
+    """
+    baselineResults = dict((_resultKey(result), result) for result in baseline.get('results', []))
+    comparison = []
+    for result in report['results']:
+        previous = baselineResults.get(_resultKey(result))
+        if previous is None:
+            continue
+        slower = (result['seconds'] > previous['seconds'] * (1.0 + tolerance)
+                  and result['seconds'] - previous['seconds'] > minimumDelta)
+        moreCalls = result['mayaCalls'] > previous['mayaCalls']
+        comparison.append({'operation': result['operation'], 'vertices': result['vertices'], 'targets': result['targets'],
+                           'baselineSeconds': previous['seconds'], 'seconds': result['seconds'],
+                           'ratio': result['seconds'] / previous['seconds'] if previous['seconds'] else 1.0,
+                           'baselineMayaCalls': previous['mayaCalls'], 'mayaCalls': result['mayaCalls'],
+                           'regression': slower or moreCalls})
+    return comparison
+
+
+def formatComparison(comparison):
+    lines = ["{:<28} {:>8} {:>7} {:>10} {:>10} {:>7} {:>14}".format(
+        "operation", "vertices", "targets", "baseline", "current", "ratio", "maya calls")]
+    for row in comparison:
+        lines.append("{:<28} {:>8} {:>7} {:>9.4f}s {:>9.4f}s {:>6.2f}x {:>6} -> {:<6}{}".format(
+            row['operation'], row['vertices'], row['targets'], row['baselineSeconds'], row['seconds'], row['ratio'],
+            row['baselineMayaCalls'], row['mayaCalls'], "  REGRESSION" if row['regression'] else ""))
+    return "\n".join(lines)
+
+
+def _parseCase(text):
+    vertices, targets = text.lower().split("x")
+    return int(vertices), int(targets)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ani_sculpt core without Maya.")
+    parser.add_argument("--cases", choices=sorted(CASES), default='quick', help="predefined case matrix")
+    parser.add_argument("--case", action='append', type=_parseCase, default=[],
+                        help="VERTICESxTARGETS case, replaces --cases, can be repeated")
+    parser.add_argument("--operation", action='append', choices=OPERATIONS, default=[],
+                        help="operation to run, every operation by default, can be repeated")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per operation, the best one is reported")
+    parser.add_argument("--report", help="JSON report to write")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="relative slowdown allowed")
+    arguments = parser.parse_args(argv)
+
+    cases = arguments.case or CASES[arguments.cases]
+    report = runBenchmarks(cases, arguments.operation or OPERATIONS, arguments.repeat, log=print)
+    if arguments.report:
+        with open(arguments.report, 'w') as reportFile:
+            json.dump(report, reportFile, indent=2, sort_keys=True)
+
+    if not arguments.baseline:
+        return 0
+    with open(arguments.baseline, 'r') as baselineFile:
+        comparison = compareReports(json.load(baselineFile), report, arguments.tolerance)
+    print(formatComparison(comparison))
+    return 1 if any(row['regression'] for row in comparison) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,2 +1,19 @@
-import coreCmds
-import coreProcs
\ No newline at end of file
+from . import instrumentation
+from . import deltaBuffers
+from . import animCurves
+from . import sculptCache
+from . import blockStore
+from . import pointCache
+from . import retarget
+from . import batch
+
+try:
+    import maya.cmds
+except ImportError:
+    # outside Maya only the pure modules above are available, e.g. for an offline bake
+    pass
+else:
+    from . import coreCmds
+    from . import coreProcs
+    from . import blendshapeIndex
+    from . import layerPager
@@ -0,0 +1,220 @@
+import math
+
+from functionsCore.deltaBuffers import numpy
+
+DEFAULT_FRAMES_PER_SECOND = 24.0
+
+_TIME_UNITS = {'game': 15.0, 'film': 24.0, 'pal': 25.0, 'ntsc': 30.0, 'show': 48.0, 'palf': 50.0, 'ntscf': 60.0}
+_BISECTION_STEPS = 40
+
+
+def getFramesPerSecond(timeUnit):
+    """get the frame rate of a Maya time unit name such as film, ntsc or 23.976fps"""
+    if timeUnit in _TIME_UNITS:
+        return _TIME_UNITS[timeUnit]
+    if timeUnit.endswith('fps'):
+        return float(timeUnit[:-3])
+    return DEFAULT_FRAMES_PER_SECOND
+
+
+def _getSegmentControls(curveData, segment):
+    """get the bezier control points of the segment between key segment and key segment + 1, in frames"""
+    times = curveData['times']
+    values = curveData['values']
+    framesPerSecond = curveData.get('framesPerSecond', DEFAULT_FRAMES_PER_SECOND)
+    t0, t1 = times[segment], times[segment + 1]
+    v0, v1 = values[segment], values[segment + 1]
+    span = t1 - t0
+    outX = curveData['outX'][segment] * framesPerSecond
+    outY = curveData['outY'][segment]
+    inX = curveData['inX'][segment + 1] * framesPerSecond
+    inY = curveData['inY'][segment + 1]
+
+    if curveData.get('weighted'):
+        x1 = min(max(t0 + outX / 3.0, t0), t1)
+        x2 = min(max(t1 - inX / 3.0, t0), t1)
+        return t0, x1, x2, t1, v0, v0 + outY / 3.0, v1 - inY / 3.0, v1
+
+    outSlope = outY / outX if outX else 0.0
+    inSlope = inY / inX if inX else 0.0
+    return t0, t0 + span / 3.0, t1 - span / 3.0, t1, v0, v0 + outSlope * span / 3.0, v1 - inSlope * span / 3.0, v1
+
+
+def _bezier(p0, p1, p2, p3, s):
+    r = 1.0 - s
+    return r * r * r * p0 + 3.0 * r * r * s * p1 + 3.0 * r * s * s * p2 + s * s * s * p3
+
+
+def _getEndSlope(curveData, last):
+    framesPerSecond = curveData.get('framesPerSecond', DEFAULT_FRAMES_PER_SECOND)
+    if last:
+        x, y = curveData['outX'][-1], curveData['outY'][-1]
+    else:
+        x, y = curveData['inX'][0], curveData['inY'][0]
+    if not x:
+        return 0.0
+    return y / (x * framesPerSecond)
+
+
+def _wrapFrame(curveData, frame):
+    """map a frame outside the keyed range back inside it, returns (frame, value offset, extrapolation slope)"""
+    times = curveData['times']
+    values = curveData['values']
+    first, last = times[0], times[-1]
+    if first <= frame <= last:
+        return frame, 0.0, None
+
+    before = frame < first
+    infinity = curveData.get('preInfinity' if before else 'postInfinity', 'constant')
+    span = last - first
+    if infinity == 'linear':
+        return (first if before else last), 0.0, _getEndSlope(curveData, not before)
+    if infinity not in ('cycle', 'cycleRelative', 'oscillate') or span <= 0.0:
+        return (first if before else last), 0.0, None
+
+    cycles = math.floor((frame - first) / span)
+    local = frame - first - cycles * span
+    if infinity == 'oscillate' and int(cycles) % 2:
+        local = span - local
+    offset = cycles * (values[-1] - values[0]) if infinity == 'cycleRelative' else 0.0
+    return first + local, offset, None
+
+
+def evaluateCurveAt(curveData, frame):
+    """evaluate a saved anim curve at one frame without Maya
+
+    Args:
+        curveData (dict): keyframe data as returned by coreCmds.getAnimationCurveData
+        frame (float): frame to sample
+
+    Returns:
+        value (float): value of the curve
+    """
+    times = curveData['times']
+    values = curveData['values']
+    if not times:
+        return 0.0
+    if len(times) == 1:
+        return values[0]
+
+    wrapped, offset, slope = _wrapFrame(curveData, frame)
+    if slope is not None:
+        return values[0 if frame < times[0] else -1] + slope * (frame - wrapped)
+
+    segment = 0
+    while segment < len(times) - 2 and wrapped >= times[segment + 1]:
+        segment += 1
+    if wrapped >= times[-1]:
+        return values[-1] + offset
+
+    outType = curveData['outTangentTypes'][segment]
+    if outType == 'step':
+        return values[segment] + offset
+    if outType == 'stepnext':
+        return values[segment + 1 if wrapped > times[segment] else segment] + offset
+
+    t0, x1, x2, t1, v0, y1, y2, v1 = _getSegmentControls(curveData, segment)
+    if curveData.get('weighted'):
+        low, high = 0.0, 1.0
+        for _ in range(_BISECTION_STEPS):
+            middle = (low + high) * 0.5
+            if _bezier(t0, x1, x2, t1, middle) < wrapped:
+                low = middle
+            else:
+                high = middle
+        s = (low + high) * 0.5
+    else:
+        s = (wrapped - t0) / (t1 - t0)
+    return _bezier(v0, y1, y2, v1, s) + offset
+
+
+def _evaluateCurveNumpy(curveData, frames):
+    times = numpy.asarray(curveData['times'], dtype=numpy.float64)
+    values = numpy.asarray(curveData['values'], dtype=numpy.float64)
+    frames = numpy.asarray(frames, dtype=numpy.float64).reshape(-1)
+    first, last = times[0], times[-1]
+    span = last - first
+
+    wrapped = frames.copy()
+    offsets = numpy.zeros_like(frames)
+    result = numpy.empty_like(frames)
+    extrapolated = numpy.zeros(frames.shape, dtype=bool)
+
+    for before, mask, key in ((True, frames < first, 'preInfinity'), (False, frames > last, 'postInfinity')):
+        if not mask.any():
+            continue
+        infinity = curveData.get(key, 'constant')
+        end = first if before else last
+        if infinity == 'linear':
+            result[mask] = values[0 if before else -1] + _getEndSlope(curveData, not before) * (frames[mask] - end)
+            extrapolated |= mask
+        elif infinity in ('cycle', 'cycleRelative', 'oscillate') and span > 0.0:
+            cycles = numpy.floor((frames[mask] - first) / span)
+            local = frames[mask] - first - cycles * span
+            if infinity == 'oscillate':
+                local = numpy.where(numpy.mod(cycles, 2) == 1, span - local, local)
+            wrapped[mask] = first + local
+            if infinity == 'cycleRelative':
+                offsets[mask] = cycles * (values[-1] - values[0])
+        else:
+            wrapped[mask] = end
+
+    segments = numpy.clip(numpy.searchsorted(times, wrapped, side='right') - 1, 0, len(times) - 2)
+    controls = numpy.array([_getSegmentControls(curveData, segment) for segment in range(len(times) - 1)],
+                           dtype=numpy.float64)[segments]
+    t0, x1, x2, t1, v0, y1, y2, v1 = controls.T
+
+    if curveData.get('weighted'):
+        low = numpy.zeros_like(wrapped)
+        high = numpy.ones_like(wrapped)
+        for _ in range(_BISECTION_STEPS):
+            middle = (low + high) * 0.5
+            below = _bezier(t0, x1, x2, t1, middle) < wrapped
+            low = numpy.where(below, middle, low)
+            high = numpy.where(below, high, middle)
+        s = (low + high) * 0.5
+    else:
+        s = (wrapped - t0) / (t1 - t0)
+    s = numpy.clip(s, 0.0, 1.0)
+    sampled = _bezier(v0, y1, y2, v1, s)
+
+    outTypes = numpy.asarray(curveData['outTangentTypes'])[segments]
+    sampled = numpy.where(outTypes == 'step', v0, sampled)
+    sampled = numpy.where((outTypes == 'stepnext') & (wrapped > t0), v1, sampled)
+    sampled = numpy.where(wrapped >= last, values[-1], sampled)
+
+    return numpy.where(extrapolated, result, sampled + offsets)
+
+
+def evaluateCurve(curveData, frames):
+    """evaluate a saved anim curve at many frames without Maya, vectorized when numpy is available
+
+    Args:
+        curveData (dict): keyframe data as returned by coreCmds.getAnimationCurveData
+        frames (iterable): frames to sample
+
+    Returns:
+        values (numpy.ndarray or list): value of the curve at each frame
+    """
+    if numpy is None or len(curveData['times']) < 2:
+        return [evaluateCurveAt(curveData, frame) for frame in frames]
+    return _evaluateCurveNumpy(curveData, frames)
+
+
+def sampleAnimationCurves(animationData, frames):
+    """sample the saved weight curve of every layer
+
+    Args:
+        animationData (dict): {keyNode: layer data} as saved by coreProcs.getBlendshapeAnimationData
+        frames (iterable): frames to sample
+
+    Returns:
+        weights (dict): {keyNode: weights at each frame}, layers saved without animCurve are skipped
+    """
+    frames = list(frames)
+    weights = {}
+    for name, entry in animationData.items():
+        curveData = entry.get('animCurve')
+        if curveData:
+            weights[name] = evaluateCurve(curveData, frames)
+    return weights
@@ -0,0 +1,375 @@
+"""Headless batch processing of ani_sculpt scenes across a process pool.
+
+Run from the ani_sculpt folder, with mayapy for the operations that open scenes:
+
+    mayapy -m functionsCore.batch save shots/*.ma --state batch/state.json --processes 4
+    python -m functionsCore.batch convert shots/*.ma --mesh bodyMesh --state batch/state.json
+    python -m functionsCore.batch bake shots/*.ma --state batch/state.json --start 1001 --end 1100
+
+Every scene is one job. Each job writes its own log next to the state file, the state file is
+rewritten after every finished job, so running the same command again resumes the batch and only
+runs the jobs that are not done yet. A summary is printed at the end and can be written as JSON.
+
+Operations:
+    save      open the scene in Maya and save the layers of its sculpted meshes to their manifest
+    convert   convert the <scene>_animation_data.json file of a mesh to its manifest, without Maya
+    bake      bake the saved layers of the scene to point caches from the rest mesh saved in the
+              manifest, without Maya
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+import functionsCore.blockStore
+import functionsCore.pointCache
+import functionsCore.sculptCache
+
+STATE_VERSION = 1
+OPERATIONS = ('save', 'convert', 'bake')
+MAYA_OPERATIONS = ('save',)
+CACHE_FOLDER = "cacheSculpt"
+DONE = 'done'
+FAILED = 'failed'
+PENDING = 'pending'
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+def getSceneName(scenePath):
+    return os.path.splitext(os.path.basename(scenePath))[0]
+
+
+def getMeshCacheFolder(scenePath, mesh):
+    """get the cacheSculpt/<mesh> folder of a scene without Maya, as coreCmds.createCacheFolder names it"""
+    return os.path.join(os.path.dirname(os.path.abspath(scenePath)), CACHE_FOLDER, mesh.split("|")[-1].replace(":", "_"))
+
+
+def getAnimationJsonPath(scenePath):
+    """get the <scene>_animation_data.json file next to a scene without Maya"""
+    return os.path.join(os.path.dirname(os.path.abspath(scenePath)), "{}_animation_data.json".format(getSceneName(scenePath)))
+
+
+def findSceneCaches(scenePath, meshes=None):
+    """find the saved caches of a scene, the manifest of each mesh first then a binary cache written before manifests
+
+    Args:
+        scenePath (str): path of the Maya scene
+        meshes (list): meshes to look for, every mesh folder of cacheSculpt by default
+
+    Returns:
+        caches (dict): {mesh folder: cache path}, meshes without a cache are left out
+    """
+    cacheRoot = os.path.join(os.path.dirname(os.path.abspath(scenePath)), CACHE_FOLDER)
+    if meshes:
+        folders = [os.path.basename(getMeshCacheFolder(scenePath, mesh)) for mesh in meshes]
+    elif os.path.isdir(cacheRoot):
+        folders = sorted(name for name in os.listdir(cacheRoot) if os.path.isdir(os.path.join(cacheRoot, name)))
+    else:
+        folders = []
+
+    caches = {}
+    sceneName = getSceneName(scenePath)
+    for folder in folders:
+        cacheFolder = os.path.join(cacheRoot, folder)
+        for cachePath in (functionsCore.blockStore.getManifestPath(cacheFolder, sceneName),
+                          functionsCore.sculptCache.getCachePath(cacheFolder, sceneName)):
+            if os.path.exists(cachePath):
+                caches[folder] = cachePath
+                break
+    return caches
+
+
+def getKeyedFrames(sculptCache):
+    """get every frame from the first to the last weight key saved in the cache"""
+    times = [keyTime for name in sculptCache.targets() for keyTime in (sculptCache.targetInfo(name).get('animCurve') or {}).get('times', [])]
+    if not times:
+        return []
+    start = int(min(times))
+    return [float(frame) for frame in range(start, int(max(times)) + 1)]
+
+
+def _initMaya():
+    import maya.cmds
+    if not hasattr(maya.cmds, 'file'):
+        # mayapy only registers the commands once the standalone session is initialized
+        import maya.standalone
+        maya.standalone.initialize(name='python')
+
+
+def _saveScene(job):
+    """open the scene and save the layers of its sculpted meshes, or of job meshes, to their manifest"""
+    _initMaya()
+    import maya.cmds as cmds
+    import functionsCore.coreProcs
+    options = job['options']
+
+    cmds.file(job['scene'], open=True, force=True)
+    sculptedMeshes = functionsCore.coreProcs.getSculptedMeshes()
+    meshes = job['meshes'] or sorted(sculptedMeshes)
+    written = []
+    for mesh in meshes:
+        if mesh not in sculptedMeshes:
+            raise ValueError("{} has no sculpt layers in {}".format(mesh, job['scene']))
+        for blendshape in sculptedMeshes[mesh]:
+            print("Saving {} of {}".format(blendshape, mesh))
+            written.append(functionsCore.coreProcs.saveAnimation(blendshape, binary=True, incremental=options.get('incremental', True),
+                                                                 max_error=options.get('maxError'), mesh=mesh))
+    return written
+
+
+def _convertScene(job):
+    """convert the JSON file of the scene to the manifest of its mesh"""
+    if not job['meshes'] or len(job['meshes']) != 1:
+        raise ValueError("convert needs the one mesh the JSON file was saved from")
+    mesh = job['meshes'][0]
+    jsonPath = getAnimationJsonPath(job['scene'])
+    cacheFolder = getMeshCacheFolder(job['scene'], mesh)
+    if not os.path.isdir(cacheFolder):
+        os.makedirs(cacheFolder)
+    manifestPath = functionsCore.blockStore.getManifestPath(cacheFolder, getSceneName(job['scene']))
+    print("Converting {} to {}".format(jsonPath, manifestPath))
+    with open(jsonPath, 'r') as jsonFile:
+        animationData = json.load(jsonFile)
+    return [functionsCore.blockStore.writeManifest(manifestPath, mesh, animationData)]
+
+
+def _bakeScene(job):
+    """bake the saved layers of every cache of the scene to a point cache next to it"""
+    options = job['options']
+    caches = findSceneCaches(job['scene'], job['meshes'])
+    if not caches:
+        raise ValueError("no saved layers found for {}".format(job['scene']))
+
+    written = []
+    for folder, cachePath in sorted(caches.items()):
+        with functionsCore.blockStore.openCache(cachePath) as sculptCache:
+            restMesh = sculptCache.readRestMesh()
+            frames = getKeyedFrames(sculptCache)
+        if restMesh is None:
+            raise ValueError("{} was saved without its rest mesh, save it again to bake it headless".format(cachePath))
+        if options.get('start') is not None or options.get('end') is not None:
+            start = options['start'] if options.get('start') is not None else frames[0]
+            end = options['end'] if options.get('end') is not None else frames[-1]
+            frames = [start + offset * options.get('step', 1.0) for offset in range(int((end - start) / options.get('step', 1.0)) + 1)]
+        if not frames:
+            raise ValueError("{} has no keyed layers, give the frames to bake".format(cachePath))
+
+        pointCachePath = os.path.splitext(cachePath)[0] + functionsCore.pointCache.POINT_CACHE_EXTENSION
+        print("Baking {} frames of {} to {}".format(len(frames), cachePath, pointCachePath))
+        functionsCore.pointCache.bakePointCache(cachePath, restMesh[0].reshape(-1), pointCachePath, frames)
+        written.append(pointCachePath)
+    return written
+
+
+_OPERATION_FUNCTIONS = {'save': _saveScene, 'convert': _convertScene, 'bake': _bakeScene}
+
+
+def getJobId(operation, scenePath, meshes=None):
+    """readable and stable id of a job, the same command line resumes the same jobs"""
+    key = "{}|{}|{}".format(operation, os.path.abspath(scenePath), ",".join(meshes or []))
+    return "{}_{}_{}".format(operation, getSceneName(scenePath), hashlib.sha1(key.encode('utf-8')).hexdigest()[:8])
+
+
+def createJobs(operation, scenePaths, meshes=None, options=None):
+    """one job per scene
+
+    Args:
+        operation (str): one of OPERATIONS
+        scenePaths (list): Maya scenes
+        meshes (list): meshes to process in every scene, the sculpted meshes by default
+        options (dict): operation options, maxError and incremental for save, start, end and step for bake
+
+    Returns:
+        jobs (list): {id, operation, scene, meshes, options}
+    """
+    if operation not in OPERATIONS:
+        raise ValueError("unknown operation {}, expected one of {}".format(operation, ", ".join(OPERATIONS)))
+    return [{'id': getJobId(operation, scenePath, meshes), 'operation': operation, 'scene': os.path.abspath(scenePath),
+             'meshes': list(meshes or []), 'options': dict(options or {})} for scenePath in scenePaths]
+
+
+def runJob(job, logFolder):
+    """run one job with its prints and errors written to <logFolder>/<job id>.log
+
+    Returns:
+        result (dict): id, status, seconds, result, error and log of the job, never raises
+    """
+    logPath = os.path.join(logFolder, job['id'] + ".log")
+    result = {'id': job['id'], 'status': FAILED, 'seconds': 0.0, 'result': None, 'error': None, 'log': logPath,
+              'finished': None}
+    start = _timer()
+    with open(logPath, 'w') as logFile:
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = logFile
+        try:
+            print("{} {} {}".format(datetime.datetime.now().isoformat(), job['operation'], job['scene']))
+            result['result'] = _OPERATION_FUNCTIONS[job['operation']](job)
+            result['status'] = DONE
+        except Exception as error:
+            traceback.print_exc()
+            result['error'] = "{}: {}".format(type(error).__name__, error)
+        finally:
+            result['seconds'] = _timer() - start
+            result['finished'] = datetime.datetime.now().isoformat()
+            print("{} in {:.2f}s".format(result['status'], result['seconds']))
+            sys.stdout, sys.stderr = stdout, stderr
+    return result
+
+
+def _initWorker(useMaya):
+    if useMaya:
+        _initMaya()
+
+
+def _runJobEntry(arguments):
+    return runJob(*arguments)
+
+
+def readState(statePath):
+    """read the job state of a batch, an empty state when the batch never ran"""
+    if not os.path.exists(statePath):
+        return {'version': STATE_VERSION, 'jobs': {}}
+    with open(statePath, 'r') as stateFile:
+        state = json.load(stateFile)
+    if state.get('version') != STATE_VERSION:
+        raise ValueError("unsupported batch state version {} in {}".format(state.get('version'), statePath))
+    return state
+
+
+def writeState(statePath, state):
+    state['updated'] = datetime.datetime.now().isoformat()
+    return functionsCore.sculptCache.writeAtomic(
+        statePath, lambda stateFile: json.dump(state, stateFile, indent=1, sort_keys=True), mode='w')
+
+
+def runBatch(jobs, statePath, processes=None, retryFailed=True, log=None):
+    """run the jobs across a process pool, the jobs already done in the state file are skipped
+
+    Args:
+        jobs (list): jobs returned by createJobs
+        statePath (str): JSON job state, the logs are written in a <state>_logs folder next to it
+        processes (int): worker processes, None uses every core, 1 runs the jobs in this process
+        retryFailed (bool): run the jobs that failed in a previous run again
+        log (callable): called with a line of text after each job
+
+    Returns:
+        state (dict): {version, updated, jobs: {id: job with status, attempts, seconds, result, error, log, finished}}
+    """
+    statePath = os.path.abspath(statePath)
+    logFolder = os.path.splitext(statePath)[0] + "_logs"
+    if not os.path.isdir(logFolder):
+        os.makedirs(logFolder)
+
+    state = readState(statePath)
+    pending = []
+    for job in jobs:
+        entry = state['jobs'].setdefault(job['id'], dict(job, status=PENDING, attempts=0))
+        entry['options'] = job['options']
+        if entry['status'] == DONE or (entry['status'] == FAILED and not retryFailed):
+            continue
+        entry['status'] = PENDING
+        pending.append(job)
+    writeState(statePath, state)
+
+    if log is not None:
+        log("{} jobs, {} to run".format(len(jobs), len(pending)))
+    if not pending:
+        return state
+
+    useMaya = any(job['operation'] in MAYA_OPERATIONS for job in pending)
+    processes = min(processes or multiprocessing.cpu_count(), len(pending))
+    if processes == 1:
+        _initWorker(useMaya)
+        results = (runJob(job, logFolder) for job in pending)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, _initWorker, (useMaya,))
+        results = pool.imap_unordered(_runJobEntry, [(job, logFolder) for job in pending])
+
+    try:
+        for done, result in enumerate(results, 1):
+            entry = state['jobs'][result['id']]
+            entry.update(result)
+            entry['attempts'] += 1
+            writeState(statePath, state)
+            if log is not None:
+                log("[{}/{}] {:<7} {:>8.2f}s {}{}".format(done, len(pending), entry['status'], entry['seconds'], entry['scene'],
+                                                         "  " + entry['error'] if entry['error'] else ""))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return state
+
+
+def summarize(state, jobIds=None):
+    """count the jobs of a batch by status
+
+    Args:
+        state (dict): state returned by runBatch
+        jobIds (list): jobs to summarize, every job of the state by default
+
+    Returns:
+        summary (dict): {jobs, done, failed, pending, seconds, outputs, failures: [{id, scene, error, log}]}
+    """
+    entries = [state['jobs'][jobId] for jobId in (state['jobs'] if jobIds is None else jobIds)]
+    summary = {'jobs': len(entries), 'seconds': sum(entry.get('seconds', 0.0) for entry in entries),
+               'outputs': sum(len(entry.get('result') or []) for entry in entries if entry['status'] == DONE),
+               'failures': [{'id': entry['id'], 'scene': entry['scene'], 'error': entry.get('error'), 'log': entry.get('log')}
+                            for entry in entries if entry['status'] == FAILED]}
+    for status in (DONE, FAILED, PENDING):
+        summary[status] = sum(1 for entry in entries if entry['status'] == status)
+    return summary
+
+
+def formatSummary(summary):
+    lines = ["{} jobs: {} done, {} failed, {} pending, {} files written, {:.2f}s of job time".format(
+        summary['jobs'], summary[DONE], summary[FAILED], summary[PENDING], summary['outputs'], summary['seconds'])]
+    for failure in summary['failures']:
+        lines.append("  failed {}: {} (log {})".format(failure['scene'], failure['error'], failure['log']))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Save, convert or bake the ani_sculpt layers of many scenes.")
+    parser.add_argument("operation", choices=OPERATIONS)
+    parser.add_argument("scenes", nargs='+', help="Maya scenes to process, one job per scene")
+    parser.add_argument("--state", required=True, help="JSON job state, running the same command again resumes the batch")
+    parser.add_argument("--mesh", action='append', default=[],
+                        help="mesh to process, the sculpted meshes by default, required once for convert, can be repeated")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, every core by default")
+    parser.add_argument("--skip-failed", action='store_true', help="do not run the jobs that failed before again")
+    parser.add_argument("--report", help="JSON summary to write")
+    parser.add_argument("--max-error", type=float, default=None, help="save: quantize the deltas within this error")
+    parser.add_argument("--full", action='store_true', help="save: rewrite every target instead of the changed ones")
+    parser.add_argument("--start", type=float, default=None, help="bake: first frame, the first weight key by default")
+    parser.add_argument("--end", type=float, default=None, help="bake: last frame, the last weight key by default")
+    parser.add_argument("--step", type=float, default=1.0, help="bake: frame step")
+    arguments = parser.parse_args(argv)
+
+    if arguments.operation == 'convert' and len(arguments.mesh) != 1:
+        parser.error("convert needs exactly one --mesh")
+    options = {'save': {'maxError': arguments.max_error, 'incremental': not arguments.full},
+               'convert': {},
+               'bake': {'start': arguments.start, 'end': arguments.end, 'step': arguments.step}}[arguments.operation]
+
+    jobs = createJobs(arguments.operation, arguments.scenes, arguments.mesh, options)
+    state = runBatch(jobs, arguments.state, arguments.processes, not arguments.skip_failed, log=print)
+    summary = summarize(state, [job['id'] for job in jobs])
+    print(formatSummary(summary))
+    if arguments.report:
+        functionsCore.sculptCache.writeAtomic(
+            arguments.report, lambda reportFile: json.dump(summary, reportFile, indent=2, sort_keys=True), mode='w')
+    return 1 if summary[FAILED] or summary[PENDING] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,279 @@
+import re
+import bisect
+import maya.cmds as cmds
+import maya.OpenMaya as OpenMaya
+
+import functionsCore.coreCmds
+
+
+class BlendshapeLookupCache(object):
+    """mesh -> blendShape nodes lookup, cleared by DG callbacks when blendShapes or mesh inputs change
+    and when a blendShape or a cached mesh is renamed"""
+
+    def __init__(self):
+        self._blendshapes = {}
+        self._callbackIds = []
+        self.hits = 0
+        self.misses = 0
+
+    def getBlendshapes(self, mesh):
+        """get the blendShape nodes in the history of the mesh
+
+        Args:
+            mesh (str): name of the mesh
+
+        Returns:
+            blendshapes (list): blendShape nodes in listHistory order
+        """
+        blendshapes = self._blendshapes.get(mesh)
+        if blendshapes is not None:
+            self.hits += 1
+            return list(blendshapes)
+
+        self.misses += 1
+        blendshapes = cmds.ls(cmds.listHistory(mesh) or [], type="blendShape") or []
+        self._blendshapes[mesh] = blendshapes
+        return list(blendshapes)
+
+    def getBlendshape(self, mesh):
+        """get the last blendShape node in the history of the mesh, None when there is none"""
+        blendshapes = self.getBlendshapes(mesh)
+        if not blendshapes:
+            return None
+        return blendshapes[-1]
+
+    def invalidate(self, *args):
+        self._blendshapes.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._blendshapes)}
+
+    def startMonitoring(self):
+        if self._callbackIds:
+            return
+        self._callbackIds.append(OpenMaya.MDGMessage.addNodeAddedCallback(self.invalidate, "blendShape"))
+        self._callbackIds.append(OpenMaya.MDGMessage.addNodeRemovedCallback(self.invalidate, "blendShape"))
+        self._callbackIds.append(OpenMaya.MDGMessage.addConnectionCallback(self._onConnectionChanged))
+        # a null node watches the renames of every node
+        self._callbackIds.append(OpenMaya.MNodeMessage.addNameChangedCallback(OpenMaya.MObject(), self._onNodeRenamed))
+        self._callbackIds.append(OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kAfterOpen, self.invalidate))
+        self._callbackIds.append(OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kAfterNew, self.invalidate))
+
+    def stopMonitoring(self):
+        for callbackId in self._callbackIds:
+            try:
+                OpenMaya.MMessage.removeCallback(callbackId)
+            except RuntimeError:
+                pass
+        self._callbackIds = []
+        self.invalidate()
+
+    def _onConnectionChanged(self, sourcePlug, destinationPlug, made, clientData=None):
+        if not self._blendshapes:
+            return
+        if sourcePlug.node().hasFn(OpenMaya.MFn.kBlendShape) or destinationPlug.node().hasFn(OpenMaya.MFn.kBlendShape):
+            self.invalidate()
+        elif destinationPlug.node().hasFn(OpenMaya.MFn.kMesh):
+            self.invalidate()
+
+    def _onNodeRenamed(self, node, previousName, clientData=None):
+        if not self._blendshapes:
+            return
+        if node.hasFn(OpenMaya.MFn.kBlendShape) or previousName in self._blendshapes:
+            self.invalidate()
+
+
+class BlendshapeTargetIndex(object):
+    """name/index/frame index of the targets of one blendShape, kept current by node callbacks
+
+    Lookups and the next free index are O(1). Alias and frame tables are rebuilt lazily, once,
+    after the callbacks report an alias or index{N}TargetFrame change. Alias renames do not always
+    report a change of aal, so a name that is not found also rebuilds the aliases once before giving up.
+    """
+
+    _framePattern = re.compile(r"^index(\d+)TargetFrame$")
+
+    def __init__(self, blendshape):
+        self.blendshape = blendshape
+        self._nameToIndex = {}
+        self._indexToName = {}
+        self._indexToFrame = {}
+        self._sortedFrames = []
+        self._sortedIndices = []
+        self._nextIndex = 1
+        self._aliasesDirty = True
+        self._framesDirty = True
+        self._callbackIds = []
+
+    def _rebuildAliases(self):
+        self._nameToIndex = functionsCore.coreCmds.get_alias_weight_dict(self.blendshape)
+        self._indexToName = dict((index, name) for name, index in self._nameToIndex.items())
+        weightIndices = cmds.getAttr("{}.weight".format(self.blendshape), multiIndices=True) or []
+        self._nextIndex = max(list(self._indexToName) + list(weightIndices) + [0]) + 1
+        self._aliasesDirty = False
+
+    def _rebuildFrames(self):
+        self._indexToFrame = {}
+        for attribute in cmds.listAttr(self.blendshape, userDefined=True) or []:
+            match = self._framePattern.match(attribute)
+            if match:
+                self._indexToFrame[int(match.group(1))] = cmds.getAttr("{}.{}".format(self.blendshape, attribute))
+        framesByIndex = sorted((frame, index) for index, frame in self._indexToFrame.items())
+        self._sortedFrames = [frame for frame, index in framesByIndex]
+        self._sortedIndices = [index for frame, index in framesByIndex]
+        self._framesDirty = False
+
+    def aliasDict(self, reverse=False):
+        """same layout as coreCmds.get_alias_weight_dict, without querying the node again"""
+        if self._aliasesDirty:
+            self._rebuildAliases()
+        if reverse:
+            return dict(self._indexToName)
+        return dict(self._nameToIndex)
+
+    def getIndex(self, name):
+        if self._aliasesDirty:
+            self._rebuildAliases()
+        elif name not in self._nameToIndex:
+            # the name may come from a rename the callbacks did not report
+            self._rebuildAliases()
+        return self._nameToIndex.get(name)
+
+    def getName(self, index):
+        if self._aliasesDirty:
+            self._rebuildAliases()
+        return self._indexToName.get(index)
+
+    def getFrame(self, index):
+        if self._framesDirty:
+            self._rebuildFrames()
+        return self._indexToFrame.get(index)
+
+    def frames(self):
+        """get {target_index: frame} of every target with an index{N}TargetFrame attribute"""
+        if self._framesDirty:
+            self._rebuildFrames()
+        return dict(self._indexToFrame)
+
+    def sortedFrames(self):
+        """get the distinct sculpt frames in ascending order"""
+        if self._framesDirty:
+            self._rebuildFrames()
+        return sorted(set(self._sortedFrames))
+
+    def targetsInRange(self, start, end):
+        """get the target indices whose frame is within [start, end], in frame order"""
+        if self._framesDirty:
+            self._rebuildFrames()
+        first = bisect.bisect_left(self._sortedFrames, start)
+        last = bisect.bisect_right(self._sortedFrames, end)
+        return self._sortedIndices[first:last]
+
+    def targetsAtFrame(self, frame):
+        return self.targetsInRange(frame, frame)
+
+    def previousFrame(self, frame):
+        """get the closest sculpt frame strictly before frame, None when there is none"""
+        if self._framesDirty:
+            self._rebuildFrames()
+        position = bisect.bisect_left(self._sortedFrames, frame)
+        if position == 0:
+            return None
+        return self._sortedFrames[position - 1]
+
+    def nextFrame(self, frame):
+        """get the closest sculpt frame strictly after frame, None when there is none"""
+        if self._framesDirty:
+            self._rebuildFrames()
+        position = bisect.bisect_right(self._sortedFrames, frame)
+        if position == len(self._sortedFrames):
+            return None
+        return self._sortedFrames[position]
+
+    def nextIndex(self):
+        """get the weight index a new target should use"""
+        if self._aliasesDirty:
+            self._rebuildAliases()
+        return self._nextIndex
+
+    def invalidate(self):
+        self._aliasesDirty = True
+        self._framesDirty = True
+
+    def startMonitoring(self):
+        if self._callbackIds:
+            return
+        selectionList = OpenMaya.MSelectionList()
+        selectionList.add(self.blendshape)
+        node = OpenMaya.MObject()
+        selectionList.getDependNode(0, node)
+        self._callbackIds.append(OpenMaya.MNodeMessage.addAttributeChangedCallback(node, self._onAttributeChanged))
+        self._callbackIds.append(OpenMaya.MNodeMessage.addAttributeAddedOrRemovedCallback(node, self._onAttributeAddedOrRemoved))
+        self._callbackIds.append(OpenMaya.MNodeMessage.addNameChangedCallback(node, self._onNodeRenamed))
+        self._callbackIds.append(OpenMaya.MNodeMessage.addNodePreRemovalCallback(node, self._onNodeRemoved))
+
+    def stopMonitoring(self):
+        for callbackId in self._callbackIds:
+            try:
+                OpenMaya.MMessage.removeCallback(callbackId)
+            except RuntimeError:
+                pass
+        self._callbackIds = []
+
+    def _onAttributeChanged(self, message, plug, otherPlug, clientData=None):
+        attributeName = plug.partialName()
+        if message & OpenMaya.MNodeMessage.kAttributeRenamed:
+            # aliasAttr renames report the weight plug itself rather than a change of aal
+            self.invalidate()
+        elif message & OpenMaya.MNodeMessage.kAttributeArrayAdded and attributeName.startswith("w["):
+            self._nextIndex = max(self._nextIndex, plug.logicalIndex() + 1)
+        elif message & OpenMaya.MNodeMessage.kAttributeArrayRemoved and attributeName.startswith("w["):
+            self._aliasesDirty = True
+        elif message & OpenMaya.MNodeMessage.kAttributeSet:
+            if attributeName == "aal":
+                self._aliasesDirty = True
+            elif self._framePattern.match(attributeName):
+                self._framesDirty = True
+
+    def _onAttributeAddedOrRemoved(self, message, plug, clientData=None):
+        if self._framePattern.match(plug.partialName(False, False, False, False, False, True)):
+            self._framesDirty = True
+
+    def _onNodeRenamed(self, node, previousName, clientData=None):
+        dropTargetIndex(self.blendshape)
+
+    def _onNodeRemoved(self, node, clientData=None):
+        dropTargetIndex(self.blendshape)
+
+
+_targetIndexes = {}
+
+
+def getTargetIndex(blendshape):
+    """get the monitored target index of a blendShape, created on first use
+
+    Args:
+        blendshape (str): name of blendshape node
+
+    Returns:
+        targetIndex (BlendshapeTargetIndex): index kept current by node callbacks
+    """
+    targetIndex = _targetIndexes.get(blendshape)
+    if targetIndex is None:
+        targetIndex = BlendshapeTargetIndex(blendshape)
+        targetIndex.startMonitoring()
+        _targetIndexes[blendshape] = targetIndex
+    return targetIndex
+
+
+def dropTargetIndex(blendshape):
+    targetIndex = _targetIndexes.pop(blendshape, None)
+    if targetIndex is not None:
+        targetIndex.stopMonitoring()
+    return None
+
+
+def clearTargetIndexes():
+    for blendshape in list(_targetIndexes):
+        dropTargetIndex(blendshape)
+    return None
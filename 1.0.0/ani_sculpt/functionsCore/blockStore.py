@@ -0,0 +1,517 @@
+import errno
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+
+import functionsCore.deltaBuffers
+import functionsCore.retarget
+import functionsCore.sculptCache
+from functionsCore.deltaBuffers import numpy
+
+BLOCK_MAGIC = b"ASBLOCK\0"
+BLOCK_VERSION = 1
+BLOCK_EXTENSION = ".asblock"
+MANIFEST_VERSION = 1
+MANIFEST_EXTENSION = ".asmanifest"
+BLOCKS_FOLDER = "blocks"
+INDEX_FILE = "index.json"
+PENDING_FOLDER = "pending"
+CACHE_SIZE_LIMIT = 20 * 1024 * 1024 * 1024
+LOCK_TIMEOUT = 30.0
+STALE_LOCK_AGE = 120.0
+STALE_PENDING_AGE = 3600.0
+
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def _align(offset):
+    alignment = functionsCore.sculptCache.CACHE_ALIGNMENT
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def getManifestPath(cacheFolder, sceneName):
+    """get the manifest of a scene inside a cacheSculpt/<mesh> folder
+
+    Args:
+        cacheFolder (str): folder returned by coreCmds.createCacheFolder
+        sceneName (str): scene name without extension
+
+    Returns:
+        manifestPath (str): path of the manifest file
+    """
+    return os.path.join(cacheFolder, sceneName + MANIFEST_EXTENSION)
+
+
+def getCacheRoot(manifestPath):
+    """get the cacheSculpt folder holding a cacheSculpt/<mesh>/<scene> manifest"""
+    return os.path.dirname(os.path.dirname(os.path.abspath(manifestPath)))
+
+
+def getBlockPath(cacheRoot, blockHash):
+    return os.path.join(cacheRoot, BLOCKS_FOLDER, blockHash[:2], blockHash + BLOCK_EXTENSION)
+
+
+class _StoreLock(object):
+    """exclusive lock file of a cache root, held while blocks, manifests and the index change"""
+
+    def __init__(self, cacheRoot):
+        self.lockPath = os.path.join(cacheRoot, BLOCKS_FOLDER, ".lock")
+
+    def __enter__(self):
+        folder = os.path.dirname(self.lockPath)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        deadline = time.time() + LOCK_TIMEOUT
+        while True:
+            try:
+                os.close(os.open(self.lockPath, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+            try:
+                if time.time() - os.path.getmtime(self.lockPath) > STALE_LOCK_AGE:
+                    os.remove(self.lockPath)
+                    continue
+            except OSError:
+                continue
+            if time.time() > deadline:
+                raise RuntimeError("{} is locked by another save".format(os.path.dirname(folder)))
+            time.sleep(0.05)
+
+    def __exit__(self, *args):
+        try:
+            os.remove(self.lockPath)
+        except OSError:
+            pass
+
+
+class _PendingBlocks(object):
+    """blocks a save in progress uses before its manifest references them
+
+    Every block is added under the store lock in the same step that finds or writes it, so a
+    concurrent removeManifest, eviction or collectGarbage keeps it until the manifest is written
+    and counts it. The list is one file per save under blocks/pending, appended to as the save goes.
+    """
+
+    def __init__(self, cacheRoot):
+        folder = os.path.join(cacheRoot, BLOCKS_FOLDER, PENDING_FOLDER)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.pendingPath = os.path.join(folder, "{}_{}.txt".format(os.getpid(), id(self)))
+
+    def add(self, blockHash):
+        """record a block, must be called under the store lock"""
+        with open(self.pendingPath, 'a') as pendingFile:
+            pendingFile.write(blockHash + "\n")
+
+    def release(self):
+        try:
+            os.remove(self.pendingPath)
+        except OSError:
+            pass
+
+
+def _readPendingBlocks(cacheRoot):
+    """get the blocks used by the saves in progress, the lists of saves idle for STALE_PENDING_AGE are
+    the leftovers of a crash and are removed"""
+    folder = os.path.join(cacheRoot, BLOCKS_FOLDER, PENDING_FOLDER)
+    if not os.path.exists(folder):
+        return set()
+    pending = set()
+    for name in os.listdir(folder):
+        pendingPath = os.path.join(folder, name)
+        try:
+            if time.time() - os.path.getmtime(pendingPath) > STALE_PENDING_AGE:
+                os.remove(pendingPath)
+                continue
+            with open(pendingPath, 'r') as pendingFile:
+                pending.update(line.strip() for line in pendingFile if line.strip())
+        except (IOError, OSError):
+            continue
+    return pending
+
+
+def _readIndex(cacheRoot):
+    indexPath = os.path.join(cacheRoot, BLOCKS_FOLDER, INDEX_FILE)
+    if not os.path.exists(indexPath):
+        return {'blocks': {}}
+    with open(indexPath, 'r') as indexFile:
+        return json.load(indexFile)
+
+
+def _writeIndex(cacheRoot, index):
+    indexPath = os.path.join(cacheRoot, BLOCKS_FOLDER, INDEX_FILE)
+    functionsCore.sculptCache.writeAtomic(indexPath, lambda indexFile: json.dump(index, indexFile, separators=(',', ':')), mode='w')
+
+
+def _readManifest(manifestPath):
+    with open(manifestPath, 'r') as manifestFile:
+        return json.load(manifestFile)
+
+
+def _getManifestBlocks(manifest):
+    blocks = [target['block'] for target in manifest['targets'].values()]
+    if 'restMesh' in manifest:
+        blocks.append(manifest['restMesh']['block'])
+    return blocks
+
+
+def _addReferences(index, blocks, increment):
+    for blockHash in blocks:
+        entry = index['blocks'].setdefault(blockHash, {'refs': 0, 'size': 0})
+        entry['refs'] += increment
+
+
+def _removeUnreferenced(cacheRoot, index):
+    pending = _readPendingBlocks(cacheRoot)
+    removed = 0
+    for blockHash, entry in list(index['blocks'].items()):
+        if entry['refs'] > 0 or blockHash in pending:
+            continue
+        blockPath = getBlockPath(cacheRoot, blockHash)
+        try:
+            if os.path.exists(blockPath):
+                os.remove(blockPath)
+        except OSError:
+            # still mapped by a reader on Windows, collectGarbage removes it once it is released
+            pass
+        removed += entry['size']
+        del index['blocks'][blockHash]
+    return removed
+
+
+def writeBlock(cacheRoot, indicesBytes, deltasBytes, target, pending=None):
+    """store the encoded blocks of one target under their content hash, existing blocks are not rewritten
+
+    Args:
+        cacheRoot (str): cacheSculpt folder
+        indicesBytes (bytes): index block returned by sculptCache.encodeTarget
+        deltasBytes (bytes): delta block returned by sculptCache.encodeTarget
+        target (dict): count and encoding keys of the target
+        pending (_PendingBlocks): save the block is recorded to, in the same lock as the write
+
+    Returns:
+        blockHash (str): sha1 of the blocks and their encoding
+        size (int): size of the block file
+    """
+    blockHeader = dict((key, value) for key, value in target.items() if key != 'measuredError')
+    blockHeader['indicesSize'] = len(indicesBytes)
+    blockHeader['deltasSize'] = len(deltasBytes)
+    headerBytes = json.dumps(blockHeader, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+    digest = hashlib.sha1(headerBytes)
+    digest.update(indicesBytes)
+    digest.update(deltasBytes)
+    blockHash = digest.hexdigest()
+
+    blockPath = getBlockPath(cacheRoot, blockHash)
+    indicesOffset = _align(_PREAMBLE.size + len(headerBytes))
+    deltasOffset = _align(indicesOffset + len(indicesBytes))
+
+    def writeBlockFile(blockFile):
+        blockFile.write(_PREAMBLE.pack(BLOCK_MAGIC, BLOCK_VERSION, len(headerBytes)))
+        blockFile.write(headerBytes)
+        blockFile.seek(indicesOffset)
+        blockFile.write(indicesBytes)
+        blockFile.seek(deltasOffset)
+        blockFile.write(deltasBytes)
+        # empty blocks write nothing after the header, the file still has to reach the offsets readers map
+        blockFile.truncate(deltasOffset + len(deltasBytes))
+
+    with _StoreLock(cacheRoot):
+        if pending is not None:
+            pending.add(blockHash)
+        if not os.path.exists(blockPath):
+            folder = os.path.dirname(blockPath)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            functionsCore.sculptCache.writeAtomic(blockPath, writeBlockFile)
+        return blockHash, os.path.getsize(blockPath)
+
+
+def mapBlock(cacheRoot, blockHash):
+    """memory-map a stored block, the mapping is released once nothing references it anymore
+
+    Returns:
+        blockMap (mmap.mmap): read only mapping of the block file
+        blockHeader (dict): count, encoding keys and block sizes
+        indicesOffset (int): offset of the index block in blockMap
+        deltasOffset (int): offset of the delta block in blockMap
+    """
+    with open(getBlockPath(cacheRoot, blockHash), 'rb') as blockFile:
+        blockMap = mmap.mmap(blockFile.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, headerSize = _PREAMBLE.unpack_from(blockMap, 0)
+    if magic != BLOCK_MAGIC or version > BLOCK_VERSION:
+        blockMap.close()
+        raise ValueError("{} is not a readable ani_sculpt block".format(blockHash))
+    blockHeader = json.loads(blockMap[_PREAMBLE.size:_PREAMBLE.size + headerSize].decode('utf-8'))
+    indicesOffset = _align(_PREAMBLE.size + headerSize)
+    deltasOffset = _align(indicesOffset + blockHeader['indicesSize'])
+    return blockMap, blockHeader, indicesOffset, deltasOffset
+
+
+def readBlock(cacheRoot, blockHash):
+    """read a stored block, only the header and the two blocks are read from the mapped file
+
+    Returns:
+        blockHeader (dict): count, encoding keys and block sizes
+        indicesBytes (bytes): index block
+        deltasBytes (bytes): delta block
+    """
+    blockMap, blockHeader, indicesOffset, deltasOffset = mapBlock(cacheRoot, blockHash)
+    try:
+        return (blockHeader, blockMap[indicesOffset:indicesOffset + blockHeader['indicesSize']],
+                blockMap[deltasOffset:deltasOffset + blockHeader['deltasSize']])
+    finally:
+        blockMap.close()
+
+
+def writeManifest(manifestPath, mesh, animationData, previousManifest=None, reusedTargets=(),
+                  epsilon=functionsCore.deltaBuffers.SPARSE_EPSILON, progressCallback=None, isCancelled=None,
+                  maxError=None, quantization='int16', compression=None, sizeLimit=CACHE_SIZE_LIMIT, restMesh=None):
+    """write the saved layers as content addressed blocks shared by every manifest of the cache root
+
+    Targets are encoded by sculptCache.encodeEntry and stored once per distinct content under
+    cacheSculpt/blocks, the manifest only keeps the layer metadata and the hash of its block. The
+    reference counts of the index are updated for the new manifest and the one it replaces, blocks
+    nobody references anymore are deleted, then the least recently used manifests are evicted while
+    the cache root is above sizeLimit. Nothing here calls Maya, so it can run on a worker thread.
+
+    Args:
+        manifestPath (str): path of the manifest file
+        mesh (str): name of the base mesh
+        animationData (dict): {keyNode: layer data} as saved by coreProcs.getBlendshapeAnimationData
+        previousManifest (ManifestCache): manifest to take the blocks of reusedTargets from
+        reusedTargets (iterable): keys of animationData holding only layer metadata, their block is kept
+        epsilon (float): deltas with every axis at or below this value are dropped from dense layers
+        progressCallback (callable): called with (done, total) after each target is stored
+        isCancelled (callable): polled between targets, raises sculptCache.CacheWriteCancelled when it returns True
+        maxError (float): quantize the deltas within this error in scene units, None keeps float32
+        quantization (str): int16 or float16, used with maxError
+        compression (str): zlib to compress the blocks
+        sizeLimit (int): size in bytes the cache root is evicted down to, None disables eviction
+        restMesh (tuple): (points, triangles) flat rest points and triangle vertex indices of the mesh,
+            stored as one more block so the layers can be retargeted to another topology
+
+    Returns:
+        manifestPath (str): path of the manifest file
+    """
+    cacheRoot = getCacheRoot(manifestPath)
+    manifest = {'version': MANIFEST_VERSION, 'mesh': mesh, 'vertexCount': 0, 'targets': {}}
+    reusedTargets = set(reusedTargets)
+    names = sorted(animationData)
+    blockSizes = {}
+    pending = _PendingBlocks(cacheRoot)
+    try:
+        if reusedTargets:
+            with _StoreLock(cacheRoot):
+                for name in reusedTargets:
+                    blockHash = previousManifest.targetInfo(name)['block']
+                    if not os.path.exists(getBlockPath(cacheRoot, blockHash)):
+                        raise ValueError("block {} of {} was removed from the cache".format(blockHash, name))
+                    pending.add(blockHash)
+
+        for done, name in enumerate(names):
+            if isCancelled is not None and isCancelled():
+                raise functionsCore.sculptCache.CacheWriteCancelled(manifestPath)
+
+            entry = animationData[name]
+            if name in reusedTargets:
+                target = dict((key, value) for key, value in entry.items()
+                              if key not in ('vertexIndices', 'positionsDeltas', 'positionsValues'))
+                previousTarget = previousManifest.targetInfo(name)
+                target.update((key, value) for key, value in previousTarget.items()
+                              if key in functionsCore.sculptCache.STORAGE_KEYS or key == 'block')
+            else:
+                indicesBytes, deltasBytes, target = functionsCore.sculptCache.encodeEntry(
+                    entry, epsilon, maxError, quantization, compression)
+                blockInfo = dict((key, value) for key, value in target.items() if key in functionsCore.sculptCache.STORAGE_KEYS)
+                blockHash, blockSize = writeBlock(cacheRoot, indicesBytes, deltasBytes, blockInfo, pending)
+                target['block'] = blockHash
+                blockSizes[blockHash] = blockSize
+
+            manifest['targets'][name] = target
+            manifest['vertexCount'] = max(manifest['vertexCount'], functionsCore.sculptCache.getEntryVertexCount(entry))
+            if progressCallback is not None:
+                progressCallback(done + 1, len(names))
+
+        if restMesh is not None:
+            points = numpy.ascontiguousarray(restMesh[0], dtype=numpy.float32).reshape(-1)
+            triangles = numpy.ascontiguousarray(restMesh[1], dtype=numpy.uint32).reshape(-1)
+            restInfo = {'kind': 'restMesh', 'count': len(points) // 3, 'triangleCount': len(triangles) // 3}
+            blockHash, blockSize = writeBlock(cacheRoot, triangles.tobytes(), points.tobytes(), restInfo, pending)
+            blockSizes[blockHash] = blockSize
+            manifest['restMesh'] = dict(restInfo, block=blockHash,
+                                        topologyHash=functionsCore.retarget.getTopologyHash(len(points) // 3, triangles))
+
+        with _StoreLock(cacheRoot):
+            index = _readIndex(cacheRoot)
+            if os.path.exists(manifestPath):
+                _addReferences(index, _getManifestBlocks(_readManifest(manifestPath)), -1)
+            _addReferences(index, _getManifestBlocks(manifest), 1)
+            for blockHash, size in blockSizes.items():
+                index['blocks'][blockHash]['size'] = size
+
+            functionsCore.sculptCache.writeAtomic(
+                manifestPath, lambda manifestFile: json.dump(manifest, manifestFile, separators=(',', ':')), mode='w')
+            _removeUnreferenced(cacheRoot, index)
+            _writeIndex(cacheRoot, index)
+    finally:
+        pending.release()
+
+    if sizeLimit is not None:
+        evictLeastRecentlyUsed(cacheRoot, sizeLimit, keep=[manifestPath])
+    return manifestPath
+
+
+def removeManifest(manifestPath):
+    """delete a manifest and every block only it referenced
+
+    Returns:
+        freed (int): bytes of blocks deleted
+    """
+    cacheRoot = getCacheRoot(manifestPath)
+    with _StoreLock(cacheRoot):
+        index = _readIndex(cacheRoot)
+        _addReferences(index, _getManifestBlocks(_readManifest(manifestPath)), -1)
+        os.remove(manifestPath)
+        freed = _removeUnreferenced(cacheRoot, index)
+        _writeIndex(cacheRoot, index)
+    return freed
+
+
+def touchManifest(manifestPath):
+    """mark a manifest as used now, eviction removes the manifests used least recently first"""
+    os.utime(manifestPath, None)
+
+
+def listManifests(cacheRoot):
+    """get every manifest path under a cacheSculpt folder"""
+    manifests = []
+    for folder, folders, files in os.walk(cacheRoot):
+        if os.path.basename(folder) == BLOCKS_FOLDER:
+            folders[:] = []
+            continue
+        manifests.extend(os.path.join(folder, name) for name in files if name.endswith(MANIFEST_EXTENSION))
+    return manifests
+
+
+def getCacheSize(cacheRoot):
+    """get the bytes used by the blocks and manifests of a cacheSculpt folder"""
+    index = _readIndex(cacheRoot)
+    return (sum(entry['size'] for entry in index['blocks'].values())
+            + sum(os.path.getsize(manifestPath) for manifestPath in listManifests(cacheRoot)))
+
+
+def evictLeastRecentlyUsed(cacheRoot, sizeLimit, keep=()):
+    """remove the least recently used manifests, and the blocks only they referenced, until the
+    cache root fits in sizeLimit
+
+    Args:
+        cacheRoot (str): cacheSculpt folder
+        sizeLimit (int): size in bytes to evict down to
+        keep (iterable): manifest paths never evicted
+
+    Returns:
+        evicted (list): paths of the removed manifests
+    """
+    keep = set(os.path.abspath(path) for path in keep)
+    size = getCacheSize(cacheRoot)
+    evicted = []
+    if size <= sizeLimit:
+        return evicted
+
+    manifests = sorted((os.path.getmtime(path), path) for path in listManifests(cacheRoot)
+                       if os.path.abspath(path) not in keep)
+    for modified, manifestPath in manifests:
+        if size <= sizeLimit:
+            break
+        size -= os.path.getsize(manifestPath) + removeManifest(manifestPath)
+        evicted.append(manifestPath)
+    return evicted
+
+
+def collectGarbage(cacheRoot):
+    """rebuild the reference counts from the manifests on disk and delete every unreferenced block,
+    including block files left by an interrupted save
+
+    Returns:
+        freed (int): bytes of blocks deleted
+    """
+    with _StoreLock(cacheRoot):
+        index = {'blocks': {}}
+        for manifestPath in listManifests(cacheRoot):
+            _addReferences(index, _getManifestBlocks(_readManifest(manifestPath)), 1)
+        pending = _readPendingBlocks(cacheRoot)
+
+        freed = 0
+        blocksFolder = os.path.join(cacheRoot, BLOCKS_FOLDER)
+        for folder, folders, files in os.walk(blocksFolder):
+            for name in files:
+                if not name.endswith(BLOCK_EXTENSION):
+                    continue
+                blockPath = os.path.join(folder, name)
+                blockHash = name[:-len(BLOCK_EXTENSION)]
+                if blockHash in index['blocks']:
+                    index['blocks'][blockHash]['size'] = os.path.getsize(blockPath)
+                elif blockHash not in pending:
+                    freed += os.path.getsize(blockPath)
+                    os.remove(blockPath)
+        _writeIndex(cacheRoot, index)
+    return freed
+
+
+class ManifestCache(functionsCore.sculptCache.SculptCache):
+    """reader of a manifest with the SculptCache interface, each block is mapped when its target is read"""
+
+    def __init__(self, manifestPath):
+        self.cachePath = manifestPath
+        self.cacheRoot = getCacheRoot(manifestPath)
+        self.header = _readManifest(manifestPath)
+        if self.header.get('version', 0) > MANIFEST_VERSION:
+            raise ValueError("{} uses manifest version {}, newer than {}".format(
+                manifestPath, self.header['version'], MANIFEST_VERSION))
+
+    def close(self):
+        return None
+
+    def readTarget(self, name):
+        """read and decode the block of one target, numpy arrays of float32 blocks are views over the mapped block
+
+        Args:
+            name (str): key of the target
+
+        Returns:
+            indices (numpy.ndarray or array.array): uint32 vertex indices
+            deltas (numpy.ndarray or array.array): float32 flat x y z offsets
+        """
+        blockMap, blockHeader, indicesOffset, deltasOffset = mapBlock(self.cacheRoot, self.header['targets'][name]['block'])
+        count = blockHeader['count']
+        if 'encoding' not in blockHeader and numpy is not None and count:
+            # the views keep the mapping alive, it is unmapped with the last of them
+            return (numpy.frombuffer(blockMap, dtype=numpy.uint32, count=count, offset=indicesOffset),
+                    numpy.frombuffer(blockMap, dtype=numpy.float32, count=count * 3, offset=deltasOffset))
+        try:
+            return functionsCore.sculptCache.decodeTarget(
+                blockHeader, blockMap[indicesOffset:indicesOffset + blockHeader['indicesSize']],
+                blockMap[deltasOffset:deltasOffset + blockHeader['deltasSize']])
+        finally:
+            blockMap.close()
+
+    def readRestMesh(self):
+        if 'restMesh' not in self.header:
+            return None
+        blockHeader, trianglesBytes, pointsBytes = readBlock(self.cacheRoot, self.header['restMesh']['block'])
+        return (numpy.frombuffer(pointsBytes, dtype=numpy.float32).reshape(-1, 3),
+                numpy.frombuffer(trianglesBytes, dtype=numpy.uint32).reshape(-1, 3))
+
+
+def openCache(cachePath):
+    """open a manifest or a binary sculpt cache with the SculptCache interface"""
+    if cachePath.endswith(MANIFEST_EXTENSION):
+        return ManifestCache(cachePath)
+    return functionsCore.sculptCache.SculptCache(cachePath)
@@ -1,10 +1,17 @@
 import os
+import hashlib
+from array import array
 import maya.cmds as cmds
 import maya.OpenMaya as OpenMaya
 
+from functionsCore.deltaBuffers import numpy, SPARSE_EPSILON, flattenPointValues, encodeSparseDeltas
+from functionsCore.animCurves import getFramesPerSecond
+
 global _old_positions
 _old_positions = None
 
+TARGET_ITEM_INDEX = 6000
+
 
 def get_alias_weight_dict(blendshape, reverse=False):
     """ get alias weight names as dict
@@ -45,6 +52,43 @@ def uncheckBlendshapeAttributes(blendshape_node):
     return None
 
 
+def getActiveEditTarget(blendshape_node):
+    """ get the index of the target in edit mode stored on the blendshape node
+        Args:
+            :param str blendshape_node: name of the blendshape node
+        Return:
+            :return int target_index: index of the active edit target, None when it was never recorded
+    """
+    if not cmds.attributeQuery("activeEditTarget", node=blendshape_node, exists=True):
+        return None
+    target_index = cmds.getAttr("{}.activeEditTarget".format(blendshape_node))
+    if target_index < 0:
+        return None
+    return target_index
+
+
+def setActiveEditTarget(blendshape_node, target_index):
+    """ switch the index*TargetEdit flag to the target, only the previous and the new flags are touched
+        Args:
+            :param str blendshape_node: name of the blendshape node
+            :param int target_index: index of the new edit target
+        Return:
+            :return None
+    """
+    if not cmds.attributeQuery("activeEditTarget", node=blendshape_node, exists=True):
+        cmds.addAttr(blendshape_node, longName="activeEditTarget", attributeType="long", defaultValue=-1)
+        uncheckBlendshapeAttributes(blendshape_node)
+    else:
+        previous_index = getActiveEditTarget(blendshape_node)
+        previous_attribute = "index{}TargetEdit".format(previous_index)
+        if previous_index is not None and previous_index != target_index and cmds.attributeQuery(previous_attribute, node=blendshape_node, exists=True):
+            cmds.setAttr("{}.{}".format(blendshape_node, previous_attribute), 0)
+
+    cmds.setAttr("{}.index{}TargetEdit".format(blendshape_node, target_index), 1)
+    cmds.setAttr("{}.activeEditTarget".format(blendshape_node), target_index)
+    return None
+
+
 def createCacheFolder(sel):
     """ create the cache folder based on the maya scene
         Args:
@@ -84,11 +128,134 @@ def getAnimationCurve(objectName, attributeName):
     return animKey
 
 
-def getVertexPositions(mesh):
-    """get the position of the vertex
+def getAnimationCurveData(animCurve):
+    """get the keyframes of an anim curve as compact arrays, read with one query per attribute
+
+    Args:
+        animCurve (str): name of the anim curve node
+
+    Returns:
+        curveData (dict): curveType, framesPerSecond, weighted, preInfinity, postInfinity, then per key
+            times, values, inTangentTypes, outTangentTypes, inX, inY, outX, outY, tangentLocks.
+            Tangent x values are in seconds as returned by keyTangent.
+    """
+    if not animCurve or not cmds.objExists(animCurve):
+        return None
+
+    curveData = {'curveType': cmds.nodeType(animCurve),
+                 'framesPerSecond': getFramesPerSecond(cmds.currentUnit(query=True, time=True)),
+                 'weighted': bool((cmds.keyTangent(animCurve, query=True, weightedTangents=True) or [False])[0]),
+                 'preInfinity': (cmds.setInfinity(animCurve, query=True, preInfinite=True) or ['constant'])[0],
+                 'postInfinity': (cmds.setInfinity(animCurve, query=True, postInfinite=True) or ['constant'])[0],
+                 'times': cmds.keyframe(animCurve, query=True, timeChange=True) or [],
+                 'values': cmds.keyframe(animCurve, query=True, valueChange=True) or []}
+    for key, flag in (('inTangentTypes', 'inTangentType'), ('outTangentTypes', 'outTangentType'),
+                      ('inX', 'ix'), ('inY', 'iy'), ('outX', 'ox'), ('outY', 'oy'), ('tangentLocks', 'lock')):
+        curveData[key] = cmds.keyTangent(animCurve, query=True, **{flag: True}) or []
+    return curveData
+
+
+def createAnimationCurve(name, curveData, destination=None):
+    """rebuild an anim curve from getAnimationCurveData, every key is created by a single setAttr
+
+    Tangent types are set with one keyTangent call per distinct type, explicit tangents are
+    only written on fixed keys since Maya recomputes the others from their neighbours.
+
+    Args:
+        name (str): name of the new anim curve
+        curveData (dict): keyframe data as returned by getAnimationCurveData
+        destination (str): attribute to connect the curve output to
+
+    Returns:
+        animCurve (str): name of the new anim curve
+    """
+    animCurve = cmds.createNode(curveData.get('curveType', 'animCurveTU'), name=name, skipSelect=True)
+    times = curveData['times']
+    if times:
+        timeValues = [item for key in zip(times, curveData['values']) for item in key]
+        cmds.setAttr("{}.ktv[0:{}]".format(animCurve, len(times) - 1), *timeValues)
+        cmds.keyTangent(animCurve, edit=True, weightedTangents=curveData.get('weighted', False))
+
+        for flag, key in (('lock', 'tangentLocks'), ('inTangentType', 'inTangentTypes'), ('outTangentType', 'outTangentTypes')):
+            groups = {}
+            for index, value in enumerate(curveData.get(key, [])):
+                groups.setdefault(value, []).append((index, index))
+            for value, indices in groups.items():
+                cmds.keyTangent(animCurve, edit=True, index=indices, **{flag: value})
+
+        for index, (inType, outType) in enumerate(zip(curveData['inTangentTypes'], curveData['outTangentTypes'])):
+            tangents = {}
+            if inType == 'fixed':
+                tangents.update(ix=curveData['inX'][index], iy=curveData['inY'][index])
+            if outType == 'fixed':
+                tangents.update(ox=curveData['outX'][index], oy=curveData['outY'][index])
+            if tangents:
+                cmds.keyTangent(animCurve, edit=True, index=(index, index), absolute=True, **tangents)
+
+    cmds.setInfinity(animCurve, preInfinite=curveData.get('preInfinity', 'constant'),
+                     postInfinite=curveData.get('postInfinity', 'constant'))
+    if destination:
+        cmds.connectAttr("{}.output".format(animCurve), destination, force=True)
+    return animCurve
+
+
+def getMeshFn(mesh):
+    """get the MFnMesh function set of the mesh
+
+    Args:
+        mesh (str): name of the mesh (transform or shape)
+
+    Returns:
+        meshFn (OpenMaya.MFnMesh): mesh function set bound to the dag path
+    """
+    selectionList = OpenMaya.MSelectionList()
+    selectionList.add(mesh)
+    dagPath = OpenMaya.MDagPath()
+    selectionList.getDagPath(0, dagPath)
+    return OpenMaya.MFnMesh(dagPath)
+
+
+def getVertexPositions(mesh, worldSpace=False):
+    """get the position of all the vertices in a single xform query
 
     Args:
         mesh (str): name of the mesh
+        worldSpace (bool): read the points in world space instead of object space
+
+    Returns:
+        vertexPos (numpy.ndarray or array.array): flat pos x y z of every vertex
+    """
+    vertexPos = cmds.xform("{}.vtx[*]".format(mesh), query=True, translation=True, worldSpace=worldSpace) or []
+    if numpy is not None:
+        return numpy.array(vertexPos, dtype=numpy.float64)
+    return array('d', vertexPos)
+
+
+def getMeshTriangles(mesh):
+    """get the vertex indices of the triangles of the mesh in a single MFnMesh read
+
+    Args:
+        mesh (str): name of the mesh
+
+    Returns:
+        triangles (numpy.ndarray or array.array): flat uint32 vertex indices, three per triangle
+    """
+    triangleCounts = OpenMaya.MIntArray()
+    triangleVertices = OpenMaya.MIntArray()
+    getMeshFn(mesh).getTriangles(triangleCounts, triangleVertices)
+
+    # both copy through the sequence protocol of MIntArray in C, no python loop per index
+    if numpy is not None:
+        return numpy.fromiter(triangleVertices, dtype=numpy.uint32, count=triangleVertices.length())
+    return array('I', triangleVertices)
+
+
+def getVertexPositionsPerVertex(mesh, worldSpace=False):
+    """get the position of the vertex one xform query at a time, slow reference path
+
+    Args:
+        mesh (str): name of the mesh
+        worldSpace (bool): query the points in world space instead of object space
 
     Returns:
         vertexPosList (list): pos x y z
@@ -97,7 +264,7 @@ def getVertexPositions(mesh):
     vertexPosList = []
     for i in range(vertex_count):
         vertex_name = "{}.vtx[{}]".format(mesh, i)
-        vertex_position = cmds.xform(vertex_name, query=True, translation=True, worldSpace=False)
+        vertex_position = cmds.xform(vertex_name, query=True, translation=True, worldSpace=worldSpace)
         vertexPosList.append(vertex_position)
     return vertexPosList
 
@@ -106,30 +273,207 @@ def getDifVectorPos(vertex_pos1, vertex_pos2):
     """calculate pos bettween tow list of pos
 
     Args:
-        vertex_pos1 (list): pos x y z
-        vertex_pos2 (list): pos x y z
+        vertex_pos1 (list or buffer): pos x y z, or flat buffer from getVertexPositions
+        vertex_pos2 (list or buffer): pos x y z, or flat buffer from getVertexPositions
 
     Returns:
-        vertex_diff (list): pos x y z
+        vertex_diff (list or buffer): same layout as the inputs
     """
+    if numpy is not None and isinstance(vertex_pos1, numpy.ndarray):
+        return numpy.subtract(vertex_pos2, vertex_pos1)
+
+    if isinstance(vertex_pos1, array):
+        return array('d', [pos2 - pos1 for pos1, pos2 in zip(vertex_pos1, vertex_pos2)])
+
     vertex_diff = [[pos2[0] - pos1[0], pos2[1] - pos1[1], pos2[2] - pos1[2]] for pos1, pos2 in zip(vertex_pos1, vertex_pos2)]
     return vertex_diff
 
 
-def addPositionValueToVertices(vertex_list, position_values):
-    """Add position values to the vertices in the specified list.
+def getIndexRanges(indices):
+    """compact sorted indices into (start, end) inclusive ranges
+
+    Args:
+        indices (list): sorted vertex indices
+
+    Returns:
+        ranges (list): (start, end) tuples covering the indices in order
+    """
+    ranges = []
+    start = None
+    previous = None
+    for index in indices:
+        index = int(index)
+        if start is None:
+            start = previous = index
+        elif index == previous + 1:
+            previous = index
+        else:
+            ranges.append((start, previous))
+            start = previous = index
+    if start is not None:
+        ranges.append((start, previous))
+    return ranges
+
+
+def getComponentRanges(mesh, indices):
+    """compact sorted vertex indices into vtx[start:end] component strings
+
+    Args:
+        mesh (str): name of the mesh, None for the bare vtx[start:end] form of a componentList
+        indices (list): sorted vertex indices
+
+    Returns:
+        components (list): component names covering the indices in order
+    """
+    if mesh is None:
+        return ["vtx[{}:{}]".format(start, end) for start, end in getIndexRanges(indices)]
+    return ["{}.vtx[{}:{}]".format(mesh, start, end) for start, end in getIndexRanges(indices)]
+
+
+def parseComponentList(components):
+    """get the vertex indices of a componentList value like ["vtx[0:4]", "vtx[9]"]
+
+    Args:
+        components (list): component strings stored on the blendshape target
+
+    Returns:
+        indices (list): vertex indices in storage order
+    """
+    indices = []
+    for component in components or []:
+        indexRange = component.split("[")[-1].split("]")[0]
+        if indexRange == "*":
+            return None
+        if ":" in indexRange:
+            start, end = indexRange.split(":")
+            indices.extend(range(int(start), int(end) + 1))
+        else:
+            indices.append(int(indexRange))
+    return indices
+
+
+def getTargetDeltas(blendshape, target_index, vertex_count):
+    """read the delta points stored on a blendshape target without evaluating the mesh
+
+    Args:
+        blendshape (str): name of blendshape node
+        target_index (int): weight index of the target
+        vertex_count (int): number of vertices of the base mesh
+
+    Returns:
+        deltas (numpy.ndarray or array.array): flat x y z offset per vertex, None when the points of the target
+            come from a connected mesh and have to be evaluated
+    """
+    targetItem = "{}.inputTarget[0].inputTargetGroup[{}].inputTargetItem[{}]".format(blendshape, target_index, TARGET_ITEM_INDEX)
+    points = cmds.getAttr(targetItem + ".inputPointsTarget")
+    if not points:
+        if cmds.listConnections(targetItem + ".inputGeomTarget", source=True, destination=False):
+            return None
+        # targets created empty, like the layers of createBlendshapeTargetsAtFrames, do not move any vertex
+        if numpy is not None:
+            return numpy.zeros(vertex_count * 3, dtype=numpy.float64)
+        return array('d', [0.0]) * (vertex_count * 3)
+
+    indices = parseComponentList(cmds.getAttr(targetItem + ".inputComponentsTarget"))
+    if indices is None:
+        indices = range(len(points))
+    if len(indices) != len(points):
+        return None
+
+    deltas = array('d', [0.0]) * (vertex_count * 3)
+    for index, point in zip(indices, points):
+        deltas[index * 3] = point[0]
+        deltas[index * 3 + 1] = point[1]
+        deltas[index * 3 + 2] = point[2]
+
+    if numpy is not None:
+        return numpy.frombuffer(deltas, dtype=numpy.float64)
+    return deltas
+
+
+def getTargetContentHash(blendshape, target_index):
+    """hash the point data stored on a blendshape target, used to detect edited targets
+
+    Args:
+        blendshape (str): name of blendshape node
+        target_index (int): weight index of the target
+
+    Returns:
+        contentHash (str): sha1 of the stored points and components, None when the target has no stored points
+    """
+    targetItem = "{}.inputTarget[0].inputTargetGroup[{}].inputTargetItem[{}]".format(blendshape, target_index, TARGET_ITEM_INDEX)
+    points = cmds.getAttr(targetItem + ".inputPointsTarget")
+    if not points:
+        return None
+    components = cmds.getAttr(targetItem + ".inputComponentsTarget")
+    return hashlib.sha1(repr((points, components)).encode("utf-8")).hexdigest()
+
+
+def keyTargetWeights(blendshape, targets, weight=None):
+    """key the weight of several targets with one setKeyframe call in a single undo chunk
 
     Args:
-        vertex_list (list): List of vertex names.
-        position_values (list): List of position values.
+        blendshape (str): name of blendshape node
+        targets (list): alias names of the targets
+        weight (float): weight set on every target before keying, None keys the current weights
 
     Returns:
         None
     """
-    for i, vertex in enumerate(vertex_list):
-        cmds.move(position_values[i][0], position_values[i][1], position_values[i][2], vertex, relative=True)
+    if not targets:
+        return None
+    attributes = ["{}.{}".format(blendshape, target) for target in targets]
+    cmds.undoInfo(openChunk=True, chunkName="aniSculptKeyWeights")
+    try:
+        if weight is not None:
+            for attribute in attributes:
+                cmds.setAttr(attribute, weight)
+        cmds.setKeyframe(attributes)
+    finally:
+        cmds.undoInfo(closeChunk=True)
     return None
 
 
+def setTargetDeltas(blendshape, target_index, indices, deltas):
+    """write sparse deltas straight into the inputPointsTarget/inputComponentsTarget of a target
+
+    Args:
+        blendshape (str): name of blendshape node
+        target_index (int): weight index of the target
+        indices (list): sorted vertex indices
+        deltas (list or buffer): flat x y z offsets, three per index
 
+    Returns:
+        None
+    """
+    targetItem = "{}.inputTarget[0].inputTargetGroup[{}].inputTargetItem[{}]".format(blendshape, target_index, TARGET_ITEM_INDEX)
+    values = flattenPointValues(deltas).tolist()
+    points = [(values[i * 3], values[i * 3 + 1], values[i * 3 + 2], 1.0) for i in range(len(values) // 3)]
+    components = getComponentRanges(None, indices)
+    cmds.setAttr(targetItem + ".inputPointsTarget", len(points), *points, type="pointArray")
+    cmds.setAttr(targetItem + ".inputComponentsTarget", len(components), *components, type="componentList")
+    return None
 
+
+def addTargetsFromDeltas(blendshape, targets):
+    """add targets to a blendshape without target meshes, in a single undo chunk
+
+    Args:
+        blendshape (str): name of blendshape node
+        targets (list): (target_index, alias_name, vertex_indices, flat_deltas) tuples, vertex indices sorted
+
+    Returns:
+        aliases (list): alias names of the created targets
+    """
+    aliases = []
+    cmds.undoInfo(openChunk=True, chunkName="aniSculptAddTargets")
+    try:
+        for target_index, name, indices, deltas in targets:
+            weightAttribute = "{}.weight[{}]".format(blendshape, target_index)
+            cmds.setAttr(weightAttribute, 0.0)
+            cmds.aliasAttr(name, weightAttribute)
+            setTargetDeltas(blendshape, target_index, indices, deltas)
+            aliases.append(name)
+    finally:
+        cmds.undoInfo(closeChunk=True)
+    return aliases
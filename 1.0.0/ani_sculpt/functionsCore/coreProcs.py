@@ -5,10 +5,46 @@ import re
 import json
 import os
 
+import functionsCore.instrumentation
+import functionsCore.animCurves
 import functionsCore.coreCmds
+import functionsCore.sculptCache
+import functionsCore.blockStore
+import functionsCore.pointCache
+import functionsCore.retarget
+import functionsCore.blendshapeIndex
+import functionsCore.layerPager
+reload(functionsCore.instrumentation)
+reload(functionsCore.animCurves)
 reload(functionsCore.coreCmds)
+reload(functionsCore.sculptCache)
+reload(functionsCore.blockStore)
+reload(functionsCore.retarget)
+reload(functionsCore.pointCache)
+reload(functionsCore.blendshapeIndex)
+reload(functionsCore.layerPager)
 
 
+def getMesh(mesh=None, selectedMeshes=None):
+    """Get the mesh to work on, the first selected object when none is given.
+
+    Args:
+        mesh (str): explicit mesh, used as is
+        selectedMeshes (list): selection the caller already read, queried when None
+
+    Returns:
+        str: mesh name.
+    """
+    if mesh is not None:
+        return mesh
+    if selectedMeshes is None:
+        selectedMeshes = cmds.ls(selection=True)
+    if not selectedMeshes:
+        raise ValueError("no mesh given and nothing selected")
+    return selectedMeshes[0]
+
+
+@functionsCore.instrumentation.profiled()
 def delete_blendshape_target(blendshape_name, targetName):
     """ delete target of the blendshape
         Args:
@@ -17,14 +53,29 @@ def delete_blendshape_target(blendshape_name, targetName):
         Return:
             None
     """
-    dictTarget = functionsCore.coreCmds.get_alias_weight_dict(blendshape_name)
-    targetIdx = 0
-    if dictTarget:
-        targetIdx = targetIdx+1
     mel.eval('blendShapeDeleteTargetGroup {} {};'.format(blendshape_name, targetName))
     return None
 
 
+def getTargetFrame(blendshape_node, target_index, target_name):
+    """ get the frame a layer was sculpted at from its index{N}TargetFrame attribute, layers without it fall back to the f<frame> part of the name
+        Args:
+            :param str blendshape_node: name of blendshape node
+            :param int target_index: index of the target
+            :param str target_name: alias name of the target
+        Return:
+            :return float frame: sculpt frame, None when it cannot be found
+    """
+    frame = functionsCore.blendshapeIndex.getTargetIndex(blendshape_node).getFrame(target_index)
+    if frame is not None:
+        return frame
+    match = re.search(r"(?:^|_)f(\d+)(?:_|$)", target_name)
+    if not match:
+        return None
+    return float(match.group(1))
+
+
+@functionsCore.instrumentation.profiled()
 def editSelectedTarget(blendshape_node, selectedLayer):
     """ put the mesh at the created key frame and put the target in edit mode 
         Args:
@@ -33,25 +84,19 @@ def editSelectedTarget(blendshape_node, selectedLayer):
         Return:
             None
     """
-    dictTarget = functionsCore.coreCmds.get_alias_weight_dict(blendshape_node)
-    selectedLayerList = selectedLayer.split("_")
-
-    pattern = r"^f\d+$"
-    frame = [element for element in selectedLayerList if re.match(pattern, element)]
-    frame = float(frame[0].replace("f",""))
-    cmds.currentTime(frame)
-
-    dictTarget = functionsCore.coreCmds.get_alias_weight_dict(blendshape_node)
-    target_index = dictTarget[selectedLayer]
+    target_index = functionsCore.blendshapeIndex.getTargetIndex(blendshape_node).getIndex(selectedLayer)
+    frame = getTargetFrame(blendshape_node, target_index, selectedLayer)
+    if frame is not None:
+        cmds.currentTime(frame)
 
     if not cmds.getAttr("{}.index{}TargetEdit".format(blendshape_node, target_index)):
         cmds.warning("{}.index{}TargetEdit".format(blendshape_node, target_index))
         mel.eval('sculptTarget -e -target {} {};'.format(target_index, blendshape_node))
-        functionsCore.coreCmds.uncheckBlendshapeAttributes(blendshape_node)
-        mel.eval('setAttr "{}.index{}TargetEdit" 1;'.format(blendshape_node, target_index))
+        functionsCore.coreCmds.setActiveEditTarget(blendshape_node, target_index)
     return "{}.index{}TargetEdit".format(blendshape_node, target_index)
 
 
+@functionsCore.instrumentation.profiled()
 def createBlendshapeWithTarget(blendshape_name):
     """ create a blendshape node with the first target and add new target in edit mode when the blendshape node is already existing
         Args:
@@ -59,12 +104,43 @@ def createBlendshapeWithTarget(blendshape_name):
         Return:
             None
     """
-    selection = cmds.ls(selection=True)
-    if not selection:
+    currentFrame = cmds.currentTime(query=True)
+    createBlendshapeTargetsAtFrames(blendshape_name, [currentFrame])
+    return None
+
+
+def getKeyedFrames(nodes):
+    """ get the sorted frames keyed on the nodes, used to add a layer on every key of a controller
+        Args:
+            :param list nodes: animated nodes
+        Return:
+            :return list frames: sorted unique key times
+    """
+    if not nodes:
+        return []
+    frames = cmds.keyframe(nodes, query=True, timeChange=True) or []
+    return sorted(set(frames))
+
+
+@functionsCore.instrumentation.profiled()
+def createBlendshapeTargetsAtFrames(blendshape_name, frames, mesh=None):
+    """ create one sculpt layer per frame on the blendshape of the mesh, the last one is put in edit mode
+        Args:
+            :param str blendshape_name: name of blendshape node
+            :param list frames: frames to create the layers at
+            :param str mesh: base object of the blendshape, the selected one by default
+        Return:
+            :return list targets: alias names of the created layers
+    """
+    # the selection is only read, and restored, when the mesh comes from it
+    selection = cmds.ls(selection=True) if mesh is None else None
+    if selection is not None and not selection:
         cmds.warning("Please select the base object for the blendShape.")
-        return
+        return []
+    if not frames:
+        return []
 
-    base_object = selection[0]
+    base_object = getMesh(mesh, selection)
 
     if cmds.objExists(blendshape_name) and cmds.listAttr("{}.weight".format(blendshape_name), multi=True) is None:
         cmds.delete(blendshape_name)
@@ -75,88 +151,180 @@ def createBlendshapeWithTarget(blendshape_name):
     else:
         blendshape_node = blendshape_name
 
-    cmds.setAttr("{}.envelope".format(blendshape_node), 0)
-
-    currentFrame = cmds.currentTime(query=True)
-    target_name = "{}_f{}_target_0".format(blendshape_node, int(currentFrame))
-    dictTarget = functionsCore.coreCmds.get_alias_weight_dict(blendshape_name)
-
-    if not dictTarget:
-        target_index = 0
-    else:
-        target_index = max(dictTarget.values())
-
-    target_index = target_index+1
-    target_object = cmds.duplicate(base_object, name=target_name.split(':')[-1])[0]
+    targetIndex = functionsCore.blendshapeIndex.getTargetIndex(blendshape_node)
+    existingNames = set(targetIndex.aliasDict())
+    target_index = targetIndex.nextIndex()
+    targets = []
+    for frame in frames:
+        variation = 0
+        target_alias = "{}_f{}_target_{}".format(blendshape_node, int(frame), variation).split(':')[-1]
+        while target_alias in existingNames:
+            variation = variation+1
+            target_alias = "{}_f{}_target_{}".format(blendshape_node, int(frame), variation).split(':')[-1]
+        existingNames.add(target_alias)
+        targets.append((target_index, target_alias, [], []))
+        target_index = target_index+1
 
-    cmds.blendShape(blendshape_node, edit=True, target=(base_object, target_index, target_object, 1.0))
+    cmds.undoInfo(openChunk=True, chunkName="aniSculptCreateLayers")
+    try:
+        cmds.setAttr("{}.envelope".format(blendshape_node), 0)
+        functionsCore.coreCmds.addTargetsFromDeltas(blendshape_node, targets)
 
-    all_weight_alias = cmds.aliasAttr(blendshape_node, query=True)
-    mel.eval('setAttr "{}.{}" {};'.format(blendshape_node,all_weight_alias[-2],1.0))
-    mel.eval('sculptTarget -e -target {} {};'.format(target_index, blendshape_node))
-    mel.eval('setKeyframe "{}.w[{}]";'.format(blendshape_node, target_index))
-    mel.eval('addAttr -ln "index{}TargetEdit" -at bool {};'.format(target_index,blendshape_node))
+        for (target_index, target_alias, indices, deltas), frame in zip(targets, frames):
+            cmds.setKeyframe("{}.{}".format(blendshape_node, target_alias), time=frame, value=1.0)
+            cmds.addAttr(blendshape_node, longName="index{}TargetEdit".format(target_index), attributeType="bool")
+            cmds.addAttr(blendshape_node, longName="index{}TargetFrame".format(target_index), attributeType="double", defaultValue=frame)
 
-    functionsCore.coreCmds.uncheckBlendshapeAttributes(blendshape_node)
+        edit_index = targets[-1][0]
+        mel.eval('sculptTarget -e -target {} {};'.format(edit_index, blendshape_node))
+        functionsCore.coreCmds.setActiveEditTarget(blendshape_node, edit_index)
 
-    mel.eval('setAttr "{}.index{}TargetEdit" 1;'.format(blendshape_node, target_index))
-    mel.eval('addAttr -ln"index{}TargetFrame" -at double -dv {} {};'.format(target_index, currentFrame, blendshape_node))
-    
-    cmds.delete(target_object)
-    cmds.select(selection)
-    cmds.setAttr("{}.envelope".format(blendshape_node), 1)
-    return None
+        if selection is not None:
+            cmds.select(selection)
+        cmds.setAttr("{}.envelope".format(blendshape_node), 1)
+    finally:
+        cmds.undoInfo(closeChunk=True)
+    return [target[1] for target in targets]
 
 
-def renameTarget(current_name, new_name):
+@functionsCore.instrumentation.profiled()
+def renameTarget(current_name, new_name, mesh=None):
     """ rename the target of the blendshape
         Args:
             :param str current_name: current target you want to rename
             :param str new_name: new name the the current target
+            :param str mesh: mesh deformed by the blendshape, the selected one by default
         Return:
             None
     """
-    selectedMeshes = cmds.ls(selection=True)
-    myHistory = cmds.listHistory(selectedMeshes)
+    selectedMeshes = cmds.ls(selection=True) if mesh is None else None
+    myHistory = cmds.listHistory(getMesh(mesh, selectedMeshes))
     myBlendShapeNodes = cmds.ls(myHistory, type='blendShape')
     for blendShapeNode in myBlendShapeNodes:
         if cmds.attributeQuery(current_name, node=blendShapeNode, exists=True):
             cmds.aliasAttr(new_name, '{}.{}'.format(blendShapeNode, current_name))
+            functionsCore.blendshapeIndex.getTargetIndex(blendShapeNode).invalidate()
             break
-    cmds.select(selectedMeshes)
+    if selectedMeshes is not None:
+        cmds.select(selectedMeshes)
     return None
 
 
-def getBlendshapeAnimationData(blendshape):
+def getSculptedMeshes():
+    """ get the meshes of the scene holding sculpt layers, for the batch processing of scenes nobody selected in
+        Return:
+            :return dict sculptedMeshes: {mesh: [blendShape nodes with index{N}TargetFrame layers]}
+    """
+    sculptedMeshes = {}
+    for shape in cmds.ls(type='mesh') or []:
+        for mesh in cmds.listRelatives(shape, parent=True) or []:
+            blendshapes = [blendshape for blendshape in cmds.ls(cmds.listHistory(mesh) or [], type='blendShape') or []
+                           if any(re.match(r"index\d+TargetFrame$", attribute) for attribute in cmds.listAttr(blendshape, userDefined=True) or [])]
+            if blendshapes:
+                sculptedMeshes[mesh] = blendshapes
+    return sculptedMeshes
+
+
+@functionsCore.instrumentation.profiled()
+def getTargetDeltasByEvaluation(blendshape, mesh, targets):
+    """ get the target deltas by evaluating the mesh with each target alone at full weight, fallback for targets without stored points
+        Args:
+            :param str blendshape: blendshape node
+            :param str mesh: base mesh of the blendshape
+            :param list targets: alias names of the targets to evaluate
+        Return:
+            :return dict deltas: {target_alias: flat x y z offsets}
+    """
+    allTargets = functionsCore.coreCmds.get_alias_weight_dict(blendshape).keys()
+    weights = dict((targ, cmds.getAttr("{}.{}".format(blendshape, targ))) for targ in allTargets)
+    deltas = {}
+
+    for targ in allTargets:
+        cmds.setAttr("{}.{}".format(blendshape, targ), 0)
+    meshPosOrigin = functionsCore.coreCmds.getVertexPositions(mesh)
+
+    for target in targets:
+        cmds.setAttr("{}.{}".format(blendshape, target), 1)
+        meshPosTarget = functionsCore.coreCmds.getVertexPositions(mesh)
+        cmds.setAttr("{}.{}".format(blendshape, target), 0)
+        deltas[target] = functionsCore.coreCmds.getDifVectorPos(meshPosOrigin, meshPosTarget)
+
+    for targ, weight in weights.items():
+        cmds.setAttr("{}.{}".format(blendshape, targ), weight)
+    return deltas
+
+
+@functionsCore.instrumentation.profiled()
+def getBlendshapeAnimationData(blendshape, epsilon=functionsCore.coreCmds.SPARSE_EPSILON, previousHashes=None, encode=True, mesh=None):
     """ save the blendshapes targets of the mesh with their key animations
         Args:
             :param str blendshape: blendshape node
+            :param float epsilon: deltas with every axis at or below this value are not saved
+            :param dict previousHashes: {keyNode: contentHash} already saved, matching targets are returned without deltas
+            :param bool encode: sparse encode the deltas, otherwise the dense buffers are returned as positionsValues
+            :param str mesh: base mesh of the blendshape, the selected one by default
         Return:
-            None
+            :return dict animationData: {keyNode: {originFrame, keyNode, animCurve, vertexCount, contentHash, vertexIndices, positionsDeltas}}
     """
-    selectedMeshes = cmds.ls(selection=True)
+    mesh = getMesh(mesh)
     targets = functionsCore.coreCmds.get_alias_weight_dict(blendshape)
-    targets = targets.keys()
+    vertex_count = cmds.polyEvaluate(mesh, vertex=True)
+    pager = functionsCore.layerPager.getPager(blendshape)
+    detachedPager = None
+    if pager is None:
+        # the layers of a reopened scene stay empty until their pager is restored, they are read from the cache
+        # through a pager that is not started, saving must not add scriptJobs to the scene
+        pager = detachedPager = openLayerPager(blendshape)
+    previousHashes = previousHashes or {}
     animationData = {}
+    targetNames = {}
+    deltas = {}
 
-    for target in targets:
-        for targ in targets:
-            cmds.setAttr("{}.{}".format(blendshape, targ),0)
-    
-        cmds.setAttr("{}.{}".format(blendshape, target),1)
-        meshPosTarget = functionsCore.coreCmds.getVertexPositions(selectedMeshes[0])
-        cmds.setAttr("{}.{}".format(blendshape, target),0)
-        meshPosOrigin = functionsCore.coreCmds.getVertexPositions(selectedMeshes[0])
-        keyName = functionsCore.coreCmds.getAnimationCurve(blendshape, target)
-        cmds.warning(keyName)
-        vectorDiff = functionsCore.coreCmds.getDifVectorPos(meshPosOrigin, meshPosTarget)
-        match = re.search(r"_f(\d+)_", target)
+    for target, target_index in targets.items():
+        frame = getTargetFrame(blendshape, target_index, target)
 
-        if not match:
+        if frame is None:
             continue
-        frame = int(match.group(1))
+        frame = int(frame)
 
-        animationData[keyName] = {'originFrame':frame, 'keyNode':keyName, 'positionsValues':vectorDiff}
+        keyName = functionsCore.coreCmds.getAnimationCurve(blendshape, target)
+        targetNames[keyName] = target
+        # lazily loaded layers that are paged out are read from their cache, their targets are empty
+        pagedOut = pager is not None and pager.isPagedOut(target_index)
+        contentHash = None
+        if pagedOut and pager is detachedPager:
+            # a layer of a reopened scene is only filled once it was sculpted again
+            contentHash = functionsCore.coreCmds.getTargetContentHash(blendshape, target_index)
+            pagedOut = contentHash is None
+        if pager is not None and target_index in pager.layers and contentHash is None:
+            contentHash = pager.getContentHash(target_index)
+        elif contentHash is None:
+            contentHash = functionsCore.coreCmds.getTargetContentHash(blendshape, target_index)
+        animationData[keyName] = {'originFrame':frame, 'keyNode':keyName, 'vertexCount':vertex_count, 'contentHash':contentHash,
+                                  'animCurve':functionsCore.coreCmds.getAnimationCurveData(keyName)}
+
+        if pagedOut and (contentHash is None or previousHashes.get(keyName) != contentHash):
+            deltas[keyName] = pager.readDenseDeltas(target_index, vertex_count)
+        elif contentHash is None or previousHashes.get(keyName) != contentHash:
+            deltas[keyName] = functionsCore.coreCmds.getTargetDeltas(blendshape, target_index, vertex_count)
+
+    missingTargets = [keyName for keyName, delta in deltas.items() if delta is None]
+    if missingTargets:
+        evaluated = getTargetDeltasByEvaluation(blendshape, mesh, [targetNames[keyName] for keyName in missingTargets])
+        for keyName in missingTargets:
+            deltas[keyName] = evaluated[targetNames[keyName]]
+
+    if detachedPager is not None:
+        detachedPager.close()
+
+    for keyName, delta in deltas.items():
+        if not encode:
+            animationData[keyName]['positionsValues'] = delta
+            continue
+        vertexIndices, positionsDeltas = functionsCore.coreCmds.encodeSparseDeltas(delta, epsilon)
+        animationData[keyName]['vertexIndices'] = vertexIndices
+        animationData[keyName]['positionsDeltas'] = positionsDeltas
+    functionsCore.instrumentation.annotate(vertices=vertex_count, targets=len(animationData), extractedTargets=len(deltas))
     return animationData
 
 
@@ -174,67 +342,433 @@ def load_data_from_json(file_path):
     return data
 
 
-def saveAnimation(blendshape):
-    """Load data from a JSON file.
+def getAnimationJsonPath():
+    """Get the <scene>_animation_data.json path next to the current scene.
+
+    Returns:
+        str: Path to the JSON file.
+    """
+    scene_path = cmds.file(query=True, sceneName=True)
+    scene_directory = os.path.dirname(scene_path)
+    scene_name = os.path.splitext(os.path.basename(scene_path))[0]
+    return "{}/{}_animation_data.json".format(scene_directory, scene_name)
+
+
+def getAnimationCachePath(mesh):
+    """Get the binary cache path of the mesh in the cacheSculpt folder of the current scene.
 
     Args:
-        file_path (str): Path to the JSON file.
+        mesh (str): base mesh of the blendshape
 
     Returns:
-        dict: Loaded data.
+        str: Path to the cache file.
     """
-    animationData = getBlendshapeAnimationData(blendshape)
     scene_path = cmds.file(query=True, sceneName=True)
-    scene_directory = os.path.dirname(scene_path)
     scene_name = os.path.splitext(os.path.basename(scene_path))[0]
-    json_file_path = "{}/{}_animation_data.json".format(scene_directory, scene_name)
+    cacheFolder = functionsCore.coreCmds.createCacheFolder(mesh.split("|")[-1].replace(":", "_"))
+    return functionsCore.sculptCache.getCachePath(cacheFolder, scene_name)
 
-    with open(json_file_path, 'w') as file:
-        json.dump(animationData, file, indent=4)
 
-    cmds.warning('Animation data saved: {}'.format(json_file_path))
-    return None
+def getAnimationManifestPath(mesh):
+    """Get the manifest path of the mesh in the cacheSculpt folder of the current scene.
 
+    Args:
+        mesh (str): base mesh of the blendshape
 
-def loadAnimation(blendshape):
-    """Load data from a JSON file.
+    Returns:
+        str: Path to the manifest file, its blocks are shared in cacheSculpt/blocks.
+    """
+    cache_file_path = getAnimationCachePath(mesh)
+    return os.path.splitext(cache_file_path)[0] + functionsCore.blockStore.MANIFEST_EXTENSION
+
+
+def findAnimationCache(mesh):
+    """Find the saved cache of the mesh, the manifest first then a binary cache written before manifests.
 
     Args:
-        file_path (str): Path to the JSON file.
+        mesh (str): base mesh of the blendshape
 
     Returns:
-        dict: Loaded data.
+        str: Path to the cache, None when the mesh has none.
     """
-    selectedMeshes = cmds.ls(selection=True)
-    scene_path = cmds.file(query=True, sceneName=True)
-    scene_directory = os.path.dirname(scene_path)
-    scene_name = os.path.splitext(os.path.basename(scene_path))[0]
-    json_file_path = "{}/{}_animation_data.json".format(scene_directory,scene_name)
-    loaded_data = load_data_from_json(json_file_path)
+    for file_path in (getAnimationManifestPath(mesh), getAnimationCachePath(mesh)):
+        if os.path.exists(file_path):
+            return file_path
+    return None
+
 
-    for key, value in loaded_data.items():
-        dictTarget = functionsCore.coreCmds.get_alias_weight_dict(blendshape)
-        print(dictTarget)
+@functionsCore.instrumentation.profiled()
+def snapshotAnimationSave(blendshape, epsilon=functionsCore.coreCmds.SPARSE_EPSILON, incremental=True, max_error=None, mesh=None):
+    """Snapshot the target deltas of the blendshape for a manifest save, must run on the main thread.
 
-        if not dictTarget:
-            target_index = 0
+    Args:
+        blendshape (str): blendshape node
+        epsilon (float): deltas with every axis at or below this value are not saved
+        incremental (bool): keep the cached blocks of targets whose content hash did not change
+        max_error (float): quantize and compress the deltas within this error in scene units, None keeps float32
+        mesh (str): base mesh of the blendshape, the selected one by default
+
+    Returns:
+        dict: Save job for writeAnimationSave and finishAnimationSave.
+    """
+    mesh = getMesh(mesh)
+    file_path = getAnimationManifestPath(mesh)
+    previousCache = None
+    previousHashes = {}
+    if incremental and os.path.exists(file_path):
+        try:
+            previousCache = functionsCore.blockStore.ManifestCache(file_path)
+        except ValueError:
+            previousCache = None
         else:
-            target_index = max(dictTarget.values())
+            previousHashes = dict((key, info.get('contentHash')) for key, info in previousCache.header['targets'].items())
+
+    animationData = getBlendshapeAnimationData(blendshape, epsilon, previousHashes, encode=False, mesh=mesh)
+    reusedTargets = [key for key, value in animationData.items() if 'positionsValues' not in value]
+    restMesh = None
+    if functionsCore.coreCmds.numpy is not None:
+        restMesh = (getBasePoints(blendshape, mesh), functionsCore.coreCmds.getMeshTriangles(mesh))
+    return {'blendshape': blendshape, 'mesh': mesh, 'filePath': file_path, 'epsilon': epsilon,
+            'animationData': animationData, 'previousCache': previousCache, 'reusedTargets': reusedTargets,
+            'maxError': max_error, 'restMesh': restMesh}
 
-        if not cmds.objExists(blendshape):
-            blendshape_node = cmds.blendShape(selectedMeshes[0], name=blendshape)
-            blendshape_node = blendshape_node[0]
+
+@functionsCore.instrumentation.profiled()
+def writeAnimationSave(job, progressCallback=None, isCancelled=None):
+    """Encode and write a snapshot to the shared block store, does not call Maya and can run on a worker thread.
+
+    Args:
+        job (dict): save job returned by snapshotAnimationSave
+        progressCallback (callable): called with (done, total) after each target
+        isCancelled (callable): polled between targets, cancels the save when it returns True
+
+    Returns:
+        str: Path to the written file.
+    """
+    return functionsCore.blockStore.writeManifest(job['filePath'], job['mesh'], job['animationData'],
+                                                  job['previousCache'], job['reusedTargets'], job['epsilon'],
+                                                  progressCallback, isCancelled, maxError=job.get('maxError'),
+                                                  compression='zlib' if job.get('maxError') is not None else None,
+                                                  restMesh=job.get('restMesh'))
+
+
+@functionsCore.instrumentation.profiled()
+def finishAnimationSave(job):
+    """Report the written cache in the script editor once it is saved, must run on the main thread.
+
+    The content hashes stored in the manifest are what the next save compares against, nothing is written on the node.
+
+    Args:
+        job (dict): save job written by writeAnimationSave
+
+    Returns:
+        list: Compression report of the saved targets, see sculptCache.getCompressionReport, None without max_error.
+    """
+    animationData = job['animationData']
+    message = 'Animation data saved: {} ({} targets written, {} unchanged skipped)'.format(
+        job['filePath'], len(animationData) - len(job['reusedTargets']), len(job['reusedTargets']))
+    report = None
+    if job.get('maxError') is not None:
+        report = functionsCore.sculptCache.getCompressionReport(functionsCore.blockStore.openCache(job['filePath']))
+        totals = functionsCore.sculptCache.getCompressionTotals(report)
+        message += ', {:.2f}x smaller, max error {:.3g}'.format(totals['ratio'], totals['maxError'])
+    cmds.warning(message)
+    return report
+
+
+@functionsCore.instrumentation.profiled()
+def saveAnimation(blendshape, epsilon=functionsCore.coreCmds.SPARSE_EPSILON, binary=False, incremental=True, max_error=None,
+                  mesh=None):
+    """Save the blendshape targets and their animation next to the scene.
+
+    Args:
+        blendshape (str): blendshape node
+        epsilon (float): deltas with every axis at or below this value are not saved
+        binary (bool): write the manifest in cacheSculpt/<mesh>, with its blocks in cacheSculpt/blocks, instead of the JSON file
+        incremental (bool): keep the cached blocks of targets whose content hash did not change, binary only
+        max_error (float): quantize and compress the deltas within this error in scene units, implies binary.
+            Unchanged targets kept by incremental saves keep the encoding they were saved with.
+        mesh (str): base mesh of the blendshape, the selected one by default
+
+    Returns:
+        str: Path to the written file.
+    """
+    if not binary and max_error is None:
+        animationData = getBlendshapeAnimationData(blendshape, epsilon, mesh=mesh)
+        file_path = functionsCore.sculptCache.writeAtomic(
+            getAnimationJsonPath(), lambda file: json.dump(animationData, file, separators=(',', ':')), mode='w')
+        cmds.warning('Animation data saved: {}'.format(file_path))
+        return file_path
+
+    job = snapshotAnimationSave(blendshape, epsilon, incremental, max_error, mesh)
+    writeAnimationSave(job)
+    finishAnimationSave(job)
+    return job['filePath']
+
+
+@functionsCore.instrumentation.profiled()
+def convertAnimationJsonToCache(mesh):
+    """Convert the JSON file of the current scene to the manifest of the mesh.
+
+    Args:
+        mesh (str): base mesh of the blendshape
+
+    Returns:
+        str: Path to the manifest file.
+    """
+    return functionsCore.blockStore.writeManifest(getAnimationManifestPath(mesh), mesh, load_data_from_json(getAnimationJsonPath()))
+
+
+def getBasePoints(blendshape, mesh):
+    """Get the rest positions of the mesh with the blendshape envelope at 0.
+
+    Args:
+        blendshape (str): blendshape node
+        mesh (str): base mesh of the blendshape
+
+    Returns:
+        buffer: flat x y z positions, one per vertex
+    """
+    envelope = cmds.getAttr("{}.envelope".format(blendshape))
+    cmds.setAttr("{}.envelope".format(blendshape), 0)
+    try:
+        return functionsCore.coreCmds.getVertexPositions(mesh)
+    finally:
+        cmds.setAttr("{}.envelope".format(blendshape), envelope)
+
+
+@functionsCore.instrumentation.profiled()
+def bakeAnimationPointCache(blendshape, start=None, end=None, processes=1, mesh=None):
+    """Bake the saved layers of the mesh to a per-frame point cache next to its manifest.
+
+    The layers are saved first when the mesh has no cache yet. The bake itself only reads the
+    cache and the rest positions, see pointCache.bakePointCache.
+
+    Args:
+        blendshape (str): blendshape node
+        start (float): first frame, the playback start by default
+        end (float): last frame, the playback end by default
+        processes (int): worker processes of the bake, 1 bakes inside Maya
+        mesh (str): base mesh of the blendshape, the selected one by default
+
+    Returns:
+        str: Path to the point cache file.
+    """
+    mesh = getMesh(mesh)
+    cache_file_path = findAnimationCache(mesh)
+    if cache_file_path is None:
+        cache_file_path = saveAnimation(blendshape, binary=True, mesh=mesh)
+
+    if start is None:
+        start = cmds.playbackOptions(query=True, minTime=True)
+    if end is None:
+        end = cmds.playbackOptions(query=True, maxTime=True)
+    frames = [start + offset for offset in range(int(end - start) + 1)]
+
+    file_path = os.path.splitext(cache_file_path)[0] + functionsCore.pointCache.POINT_CACHE_EXTENSION
+    functionsCore.pointCache.bakePointCache(cache_file_path, getBasePoints(blendshape, mesh), file_path,
+                                            frames, mesh=mesh, processes=processes)
+    cmds.warning('Point cache baked: {} ({} frames)'.format(file_path, len(frames)))
+    return file_path
+
+
+@functionsCore.instrumentation.profiled()
+def verifyPointCache(point_cache_path, mesh, frames=None):
+    """Compare a baked point cache with the mesh evaluated by Maya at the same frames.
+
+    Args:
+        point_cache_path (str): path of the point cache file
+        mesh (str): mesh driven by the blendshape
+        frames (list): frames to compare, every baked frame by default
+
+    Returns:
+        float: Largest absolute difference on any axis.
+    """
+    current_frame = cmds.currentTime(query=True)
+    max_error = 0.0
+    try:
+        with functionsCore.pointCache.PointCache(point_cache_path) as point_cache:
+            for frame in (point_cache.frames() if frames is None else frames):
+                cmds.currentTime(frame, update=True)
+                positions = functionsCore.coreCmds.numpy.asarray(functionsCore.coreCmds.getVertexPositions(mesh))
+                baked = point_cache.readFrame(frame).reshape(-1)
+                max_error = max(max_error, float(functionsCore.coreCmds.numpy.abs(positions - baked).max()))
+                baked = None
+    finally:
+        cmds.currentTime(current_frame, update=True)
+    return max_error
+
+
+@functionsCore.instrumentation.profiled()
+def getRetargetCorrespondence(sculptCache, blendshape, mesh, retarget=None):
+    """Get the correspondence map from the saved rest mesh to the mesh, when the layers need retargeting.
+
+    The map is built once per pair of topologies and kept in cacheSculpt/retarget.
+
+    Args:
+        sculptCache (SculptCache): open cache of the layers
+        blendshape (str): blendshape node, its envelope is set to 0 to read the rest points when it exists
+        mesh (str): mesh the layers are loaded on
+        retarget (bool): True always retargets, None only when the vertex count changed since the save, False never
+
+    Returns:
+        tuple: (vertices, weights) for retarget.transferDeltas, None when the layers load as saved.
+    """
+    if retarget is False:
+        return None
+    restMesh = sculptCache.header.get('restMesh')
+    vertex_count = cmds.polyEvaluate(mesh, vertex=True)
+    if restMesh is None:
+        if retarget:
+            raise ValueError("{} was saved without its rest mesh, save the layers again to retarget them".format(sculptCache.cachePath))
+        if sculptCache.vertexCount != vertex_count:
+            cmds.warning("{} was saved on {} vertices, {} has {}, save the layers again to retarget them".format(
+                sculptCache.cachePath, sculptCache.vertexCount, mesh, vertex_count))
+        return None
+    if retarget is None and restMesh['count'] == vertex_count:
+        return None
+
+    triangles = functionsCore.coreCmds.getMeshTriangles(mesh)
+    if cmds.objExists(blendshape):
+        points = getBasePoints(blendshape, mesh)
+    else:
+        points = functionsCore.coreCmds.getVertexPositions(mesh)
+    sourcePoints, sourceTriangles = sculptCache.readRestMesh()
+    return functionsCore.retarget.getCorrespondence(functionsCore.blockStore.getCacheRoot(sculptCache.cachePath),
+                                                    sourcePoints, sourceTriangles, restMesh['topologyHash'], points,
+                                                    functionsCore.retarget.getTopologyHash(vertex_count, triangles))
+
+
+def openLayerPager(blendshape):
+    """Open a pager of a lazily loaded blendshape from the settings stored on it, without registering or starting it.
+
+    Args:
+        blendshape (str): blendshape node
+
+    Returns:
+        LayerPager: pager with no layer paged in, None when the layers of the blendshape were loaded up front.
+    """
+    settings = functionsCore.layerPager.getPagerSettings(blendshape)
+    if settings is None or not os.path.exists(settings['cachePath']):
+        return None
+
+    sculptCache = functionsCore.blockStore.openCache(settings['cachePath'])
+    correspondence = getRetargetCorrespondence(sculptCache, blendshape, settings['mesh'], settings.get('retarget'))
+    aliases = functionsCore.coreCmds.get_alias_weight_dict(blendshape)
+    layers = dict((aliases[key.split(':')[-1]], key) for key in sculptCache.targets() if key.split(':')[-1] in aliases)
+    return functionsCore.layerPager.LayerPager(blendshape, sculptCache, layers, correspondence,
+                                               settings['window'], settings['memoryBudget'])
+
+
+def getLayerPager(blendshape):
+    """Get the pager of a lazily loaded blendshape, restored from the settings stored on it after the scene was reopened.
+
+    Args:
+        blendshape (str): blendshape node
+
+    Returns:
+        LayerPager: running pager, None when the layers of the blendshape were loaded up front.
+    """
+    pager = functionsCore.layerPager.getPager(blendshape)
+    if pager is not None:
+        return pager
+    pager = openLayerPager(blendshape)
+    if pager is None:
+        return None
+    functionsCore.layerPager.registerPager(pager)
+    pager.startMonitoring()
+    pager.update()
+    return pager
+
+
+@functionsCore.instrumentation.profiled()
+def loadAnimation(blendshape, binary=None, retarget=None, lazy=False, window=functionsCore.layerPager.WINDOW,
+                  memory_budget=functionsCore.layerPager.MEMORY_BUDGET, mesh=None):
+    """Load the saved targets and their animation on the mesh.
+
+    Args:
+        blendshape (str): blendshape node to create or add the targets to
+        binary (bool): read the manifest or binary cache, None uses it when it exists and falls back to the JSON file
+        retarget (bool): transfer the layers through the closest points of the saved rest mesh, needed when the
+            vertices changed since the save. None retargets when the vertex count differs, binary caches only.
+        lazy (bool): register every layer with an empty target and only page in the layers active around the
+            current time, see layerPager.LayerPager, binary caches only
+        window (float): frames around the current time whose active layers are always paged in, lazy only
+        memory_budget (int): bytes of targets kept paged in, lazy only
+        mesh (str): mesh to load the layers on, the selected one by default
+
+    Returns:
+        None
+    """
+    selectedMeshes = cmds.ls(selection=True) if mesh is None else None
+    mesh = getMesh(mesh, selectedMeshes)
+    cache_file_path = findAnimationCache(mesh)
+    if binary is None:
+        binary = cache_file_path is not None
+
+    correspondence = None
+    if binary:
+        sculptCache = functionsCore.blockStore.openCache(cache_file_path or getAnimationManifestPath(mesh))
+        if isinstance(sculptCache, functionsCore.blockStore.ManifestCache):
+            functionsCore.blockStore.touchManifest(cache_file_path)
+        correspondence = getRetargetCorrespondence(sculptCache, blendshape, mesh, retarget)
+        layers = ((key, sculptCache.targetInfo(key)) for key in sculptCache.targets())
+    elif retarget or lazy:
+        raise ValueError("only the layers saved to a manifest or binary cache can be {}".format("retargeted" if retarget else "loaded lazily"))
+    else:
+        sculptCache = None
+        layers = load_data_from_json(getAnimationJsonPath()).items()
+
+    if not cmds.objExists(blendshape):
+        blendshape_node = cmds.blendShape(mesh, name=blendshape)
+        blendshape_node = blendshape_node[0]
+    else:
+        blendshape_node = blendshape
+    target_index = functionsCore.blendshapeIndex.getTargetIndex(blendshape_node).nextIndex()
+
+    loadedLayers = []
+    targets = []
+    for key, value in layers:
+        if lazy:
+            indices, deltas = [], []
+        elif sculptCache is not None:
+            indices, deltas = sculptCache.readTarget(key)
         else:
-            blendshape_node = blendshape
+            indices, deltas = functionsCore.sculptCache.getSparseEntry(value)
+        if correspondence is not None and not lazy:
+            indices, deltas = functionsCore.retarget.transferDeltas(correspondence, indices, deltas, sculptCache.header['restMesh']['count'])
+        target_alias = key.split(':')[-1]
+        targets.append((target_index, target_alias, indices, deltas))
+        loadedLayers.append((key, target_index, target_alias, value))
         target_index = target_index+1
-        target_object = cmds.duplicate(selectedMeshes[0], name=key)[0]
-        vertexesList = cmds.ls(target_object+".vtx[*]", flatten=True)
-        functionsCore.coreCmds.addPositionValueToVertices(vertexesList, value['positionsValues'])
-        print(target_index)
-        cmds.blendShape(blendshape_node, edit=True, target=(selectedMeshes[0], target_index,target_object, 1.0))
-        cmds.duplicate(value['keyNode'], rr=True, n="{}_postAnim_f{}_target_0".format(selectedMeshes[0], value['originFrame']))
-        cmds.connectAttr("{}.output".format(key, value['originFrame']),"{}.{}".format(blendshape, target_object), f=True)
-        cmds.delete(target_object)
+
+    functionsCore.coreCmds.addTargetsFromDeltas(blendshape_node, targets)
+    if functionsCore.instrumentation.isEnabled():
+        functionsCore.instrumentation.annotate(vertices=cmds.polyEvaluate(mesh, vertex=True), targets=len(targets))
+
+    for key, target_index, target_alias, value in loadedLayers:
+        cmds.addAttr(blendshape_node, longName="index{}TargetEdit".format(target_index), attributeType="bool")
+        cmds.addAttr(blendshape_node, longName="index{}TargetFrame".format(target_index), attributeType="double", defaultValue=value['originFrame'])
+        curve_name = "{}_postAnim_f{}_target_0".format(mesh, value['originFrame'])
+        destination = "{}.{}".format(blendshape_node, target_alias)
+        if value.get('animCurve'):
+            functionsCore.coreCmds.createAnimationCurve(curve_name, value['animCurve'], destination)
+        else:
+            # files saved before the keyframes were stored only reference the curve node of the original scene
+            curve = cmds.duplicate(value['keyNode'], rr=True, n=curve_name)[0]
+            cmds.connectAttr("{}.output".format(curve), destination, f=True)
+    if selectedMeshes is not None:
         cmds.select(selectedMeshes)
-    return None
 
+    if lazy:
+        functionsCore.layerPager.setPagerSettings(blendshape_node, {
+            'cachePath': sculptCache.cachePath, 'mesh': mesh, 'retarget': retarget, 'window': window, 'memoryBudget': memory_budget})
+        layers = dict((target_index, key) for key, target_index, target_alias, value in loadedLayers)
+        pager = functionsCore.layerPager.LayerPager(blendshape_node, sculptCache, layers, correspondence, window, memory_budget)
+        functionsCore.layerPager.registerPager(pager)
+        pager.startMonitoring()
+        pager.update()
+    elif sculptCache is not None:
+        targets = indices = deltas = None
+        sculptCache.close()
+    return None
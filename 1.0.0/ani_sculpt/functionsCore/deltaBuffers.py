@@ -0,0 +1,121 @@
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SPARSE_EPSILON = 1e-5
+
+
+def arrayToBytes(values):
+    """get the raw bytes of an array.array, tostring before Python 3"""
+    if hasattr(values, 'tobytes'):
+        return values.tobytes()
+    return values.tostring()
+
+
+def arrayFromBytes(typecode, data):
+    """build an array.array from raw bytes, fromstring before Python 3"""
+    values = array(typecode)
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+    return values
+
+
+def toPointBuffer(values):
+    """convert flat x y z values to a contiguous float buffer
+
+    Args:
+        values (iterable): flat list of x y z values
+
+    Returns:
+        buffer (numpy.ndarray or array.array): float64 buffer, numpy when available
+    """
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.float64).reshape(-1)
+    return array('d', values)
+
+
+def flattenPointValues(values):
+    """flatten a list of pos x y z into a contiguous float buffer, buffers are returned as is
+
+    Args:
+        values (list or buffer): pos x y z, or flat x y z values
+
+    Returns:
+        buffer (numpy.ndarray or array.array): flat x y z values
+    """
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        return values.reshape(-1)
+    if isinstance(values, array):
+        return values
+    if values and isinstance(values[0], (list, tuple)):
+        return toPointBuffer([axis for position in values for axis in position])
+    return toPointBuffer(values)
+
+
+def pointBufferToList(buffer):
+    """convert a flat point buffer to a list of pos x y z
+
+    Args:
+        buffer (numpy.ndarray or array.array): flat x y z values
+
+    Returns:
+        vertexPosList (list): pos x y z
+    """
+    values = list(buffer)
+    return [values[i:i + 3] for i in range(0, len(values), 3)]
+
+
+def encodeSparseDeltas(deltas, epsilon=SPARSE_EPSILON):
+    """keep only the vertices that move more than epsilon on at least one axis
+
+    Args:
+        deltas (list or buffer): pos x y z offsets, or flat x y z values, one per vertex
+        epsilon (float): deltas with every axis at or below this value are dropped
+
+    Returns:
+        indices (list): sorted vertex indices that are kept
+        values (list): flat x y z offsets of the kept vertices
+    """
+    deltas = flattenPointValues(deltas)
+
+    if numpy is not None:
+        offsets = numpy.asarray(deltas, dtype=numpy.float64).reshape(-1, 3)
+        indices = numpy.flatnonzero(numpy.abs(offsets).max(axis=1) > epsilon)
+        return indices.tolist(), offsets[indices].reshape(-1).tolist()
+
+    indices = []
+    values = []
+    for index in range(len(deltas) // 3):
+        offset = deltas[index * 3:index * 3 + 3]
+        if max(abs(offset[0]), abs(offset[1]), abs(offset[2])) <= epsilon:
+            continue
+        indices.append(index)
+        values.extend(offset)
+    return indices, values
+
+
+def decodeSparseDeltas(vertex_count, indices, values):
+    """expand sparse vertex indices and offsets to a dense delta buffer
+
+    Args:
+        vertex_count (int): number of vertices of the mesh
+        indices (list): vertex indices
+        values (list): flat x y z offsets, three per index
+
+    Returns:
+        deltas (numpy.ndarray or array.array): flat x y z offset per vertex
+    """
+    if numpy is not None:
+        deltas = numpy.zeros((vertex_count, 3), dtype=numpy.float64)
+        deltas[numpy.asarray(indices, dtype=numpy.int64)] = numpy.asarray(values, dtype=numpy.float64).reshape(-1, 3)
+        return deltas.reshape(-1)
+
+    deltas = array('d', [0.0]) * (vertex_count * 3)
+    for i, index in enumerate(indices):
+        deltas[index * 3:index * 3 + 3] = array('d', values[i * 3:i * 3 + 3])
+    return deltas
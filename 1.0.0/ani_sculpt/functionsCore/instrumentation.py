@@ -0,0 +1,329 @@
+import atexit
+import collections
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+
+ENVIRONMENT_VARIABLE = "ANI_SCULPT_PROFILE"
+DUMP_ENVIRONMENT_VARIABLE = "ANI_SCULPT_PROFILE_DUMP"
+CHROME_TRACE_EXTENSION = ".trace.json"
+LOG_SIZE = 2000
+
+_timer = getattr(time, 'perf_counter', time.time)
+_log = collections.deque(maxlen=LOG_SIZE)
+_logLock = threading.Lock()
+_threadState = threading.local()
+_enabled = False
+
+try:
+    _exitDumpRegistered
+except NameError:
+    # kept when the module is reloaded so the exit dump is only registered once per session
+    _exitDumpRegistered = False
+
+
+def isEnabled():
+    return _enabled
+
+
+def setEnabled(enabled):
+    """turn the instrumentation on or off, Maya commands and MEL evals are counted while it is on
+
+    Args:
+        enabled (bool): record the profiled operations
+
+    Returns:
+        None
+    """
+    global _enabled
+    enabled = bool(enabled)
+    if enabled == _enabled:
+        return
+    _enabled = enabled
+    if enabled:
+        _patchMaya()
+    else:
+        _unpatchMaya()
+
+
+def _getStack():
+    stack = getattr(_threadState, 'stack', None)
+    if stack is None:
+        stack = _threadState.stack = []
+    return stack
+
+
+def _countCall(counter, name):
+    stack = getattr(_threadState, 'stack', None)
+    if not stack:
+        return
+    for record in stack:
+        record['counters'][counter] = record['counters'].get(counter, 0) + 1
+        record['commands'][name] = record['commands'].get(name, 0) + 1
+
+
+def _countedFunction(counter, name, function):
+    def countedFunction(*args, **kwargs):
+        if _enabled:
+            _countCall(counter, name)
+        return function(*args, **kwargs)
+    countedFunction.__name__ = getattr(function, '__name__', name)
+    countedFunction.__doc__ = getattr(function, '__doc__', None)
+    countedFunction.originalFunction = function
+    return countedFunction
+
+
+def _getMayaFunctions():
+    try:
+        import maya.cmds
+        import maya.mel
+    except ImportError:
+        return []
+    functions = [(maya.cmds, name, 'mayaCalls') for name in dir(maya.cmds) if not name.startswith('_')]
+    return functions + [(maya.mel, 'eval', 'melCalls')]
+
+
+def _patchMaya():
+    """wrap the maya.cmds commands and mel.eval with call counters, they only count inside operations
+
+    The wrappers stay valid when this module is reloaded, functions already wrapped are skipped.
+    """
+    for module, name, counter in _getMayaFunctions():
+        function = getattr(module, name)
+        if callable(function) and not hasattr(function, 'originalFunction'):
+            setattr(module, name, _countedFunction(counter, name if counter == 'mayaCalls' else 'mel.eval', function))
+
+
+def _unpatchMaya():
+    for module, name, counter in _getMayaFunctions():
+        function = getattr(module, name)
+        if hasattr(function, 'originalFunction'):
+            setattr(module, name, function.originalFunction)
+
+
+class operation(object):
+    """time a block as one profiled operation, nested operations are recorded with their depth
+
+        with functionsCore.instrumentation.operation("NodeWidget.saveLayers"):
+            ...
+
+    Does nothing while the instrumentation is disabled.
+    """
+
+    def __init__(self, name, **values):
+        self.name = name
+        self.values = values
+        self.record = None
+
+    def __enter__(self):
+        if not _enabled:
+            return self
+        stack = _getStack()
+        self.record = {'name': self.name, 'start': time.time(), 'seconds': 0.0, 'depth': len(stack),
+                       'thread': threading.current_thread().name, 'threadId': threading.current_thread().ident,
+                       'counters': {}, 'commands': {}, 'values': dict(self.values), 'error': None}
+        self.clockStart = _timer()
+        stack.append(self.record)
+        return self
+
+    def __exit__(self, errorType, error, traceback):
+        record = self.record
+        if record is None:
+            return False
+        self.record = None
+        record['seconds'] = _timer() - self.clockStart
+        if errorType is not None:
+            record['error'] = "{}: {}".format(errorType.__name__, error)
+        stack = _getStack()
+        if stack and stack[-1] is record:
+            stack.pop()
+        with _logLock:
+            _log.append(record)
+        return False
+
+
+def profiled(name=None):
+    """decorator recording every call of the function as an operation named <module>.<function> by default"""
+    def decorator(function):
+        operationName = name or "{}.{}".format(function.__module__.split('.')[-1], function.__name__)
+
+        @functools.wraps(function)
+        def profiledFunction(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with operation(operationName):
+                return function(*args, **kwargs)
+        return profiledFunction
+    return decorator
+
+
+def count(counter, value=1):
+    """add value to a counter of every open operation of this thread, e.g. bytesWritten"""
+    stack = getattr(_threadState, 'stack', None)
+    if not _enabled or not stack:
+        return
+    for record in stack:
+        record['counters'][counter] = record['counters'].get(counter, 0) + value
+
+
+def annotate(**values):
+    """set values like the vertex and target counts on every open operation of this thread"""
+    stack = getattr(_threadState, 'stack', None)
+    if not _enabled or not stack:
+        return
+    for record in stack:
+        record['values'].update(values)
+
+
+def countBytesWritten(filePath):
+    """count the size of a file written by the current operations"""
+    if _enabled and getattr(_threadState, 'stack', None):
+        count('bytesWritten', os.path.getsize(filePath))
+
+
+def getLog():
+    """get the finished operations, oldest first, the log keeps the last LOG_SIZE ones
+
+    Returns:
+        records (list): {name, start, seconds, depth, thread, threadId, counters, commands, values, error}
+    """
+    with _logLock:
+        return list(_log)
+
+
+def clearLog():
+    with _logLock:
+        _log.clear()
+
+
+def summarize(records=None):
+    """aggregate the operations by name
+
+    Args:
+        records (list): records returned by getLog, the current log by default
+
+    Returns:
+        summary (dict): {name: {calls, seconds, averageSeconds, maxSeconds, counters}}
+    """
+    summary = {}
+    for record in (getLog() if records is None else records):
+        entry = summary.setdefault(record['name'], {'calls': 0, 'seconds': 0.0, 'maxSeconds': 0.0, 'counters': {}})
+        entry['calls'] += 1
+        entry['seconds'] += record['seconds']
+        entry['maxSeconds'] = max(entry['maxSeconds'], record['seconds'])
+        for counter, value in record['counters'].items():
+            entry['counters'][counter] = entry['counters'].get(counter, 0) + value
+    for entry in summary.values():
+        entry['averageSeconds'] = entry['seconds'] / entry['calls']
+    return summary
+
+
+def formatSummary(summary):
+    lines = ["{:<48} {:>6} {:>10} {:>10} {:>8} {:>6} {:>12}".format(
+        "operation", "calls", "total s", "max s", "maya", "mel", "bytes")]
+    for name, entry in sorted(summary.items(), key=lambda item: -item[1]['seconds']):
+        counters = entry['counters']
+        lines.append("{:<48} {:>6} {:>10.3f} {:>10.3f} {:>8} {:>6} {:>12}".format(
+            name, entry['calls'], entry['seconds'], entry['maxSeconds'], counters.get('mayaCalls', 0),
+            counters.get('melCalls', 0), counters.get('bytesWritten', 0)))
+    return "\n".join(lines)
+
+
+def getChromeTrace(records=None):
+    """convert the operations to the Chrome trace event format, opened by chrome://tracing or Perfetto
+
+    Returns:
+        trace (dict): {traceEvents, displayTimeUnit}
+    """
+    events = []
+    processId = os.getpid()
+    for record in (getLog() if records is None else records):
+        arguments = dict(record['counters'])
+        arguments.update(record['values'])
+        if record['error']:
+            arguments['error'] = record['error']
+        events.append({'name': record['name'], 'cat': record['name'].split('.')[0], 'ph': 'X',
+                       'ts': record['start'] * 1e6, 'dur': record['seconds'] * 1e6,
+                       'pid': processId, 'tid': record['threadId'], 'args': arguments})
+    events.sort(key=lambda event: event['ts'])
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def getDefaultDumpPath():
+    return os.path.join(tempfile.gettempdir(), "ani_sculpt_profile_{}.json".format(os.getpid()))
+
+
+def dumpLog(filePath=None, chromeTrace=None):
+    """write the log next to a summary, as JSON or as a Chrome trace
+
+    Args:
+        filePath (str): file to write, getDefaultDumpPath by default
+        chromeTrace (bool): write a Chrome trace, None when filePath ends with CHROME_TRACE_EXTENSION
+
+    Returns:
+        filePath (str): path of the written file
+    """
+    filePath = filePath or getDefaultDumpPath()
+    if chromeTrace is None:
+        chromeTrace = filePath.endswith(CHROME_TRACE_EXTENSION)
+    records = getLog()
+    if chromeTrace:
+        data = getChromeTrace(records)
+    else:
+        data = {'pid': os.getpid(), 'created': time.time(), 'summary': summarize(records), 'operations': records}
+    with open(filePath, 'w') as dumpFile:
+        json.dump(data, dumpFile, indent=1, sort_keys=True)
+    return filePath
+
+
+def getSummaryPath(filePath):
+    """get the text summary written next to a dump, profile.json and profile.trace.json both give profile.summary.txt"""
+    for extension in (CHROME_TRACE_EXTENSION, ".json"):
+        if filePath.endswith(extension):
+            filePath = filePath[:-len(extension)]
+            break
+    return filePath + ".summary.txt"
+
+
+def dumpSummary(filePath, summary=None, stats=None):
+    """write formatSummary of the log next to a dump written by dumpLog
+
+    Args:
+        filePath (str): dump the summary belongs to
+        summary (dict): summary returned by summarize, the current log by default
+        stats (dict): {name: {statistic: value}} written after the operations, e.g. the refreshes of the dock
+
+    Returns:
+        summaryPath (str): path of the written text file
+    """
+    lines = [formatSummary(summarize() if summary is None else summary)]
+    for name, values in sorted((stats or {}).items()):
+        lines.append("")
+        lines.append(name)
+        for statistic, value in sorted(values.items()):
+            lines.append("    {:<44} {}".format(statistic, round(value, 3) if isinstance(value, float) else value))
+    summaryPath = getSummaryPath(filePath)
+    with open(summaryPath, 'w') as summaryFile:
+        summaryFile.write("\n".join(lines) + "\n")
+    return summaryPath
+
+
+def _dumpAtExit():
+    dumpPath = os.environ.get(DUMP_ENVIRONMENT_VARIABLE)
+    if _enabled and dumpPath:
+        dumpLog(dumpPath)
+
+
+def _initFromEnvironment():
+    global _exitDumpRegistered
+    if os.environ.get(ENVIRONMENT_VARIABLE, "").strip().lower() not in ("", "0", "false", "off", "no"):
+        setEnabled(True)
+    if os.environ.get(DUMP_ENVIRONMENT_VARIABLE) and not _exitDumpRegistered:
+        atexit.register(_dumpAtExit)
+        _exitDumpRegistered = True
+
+
+_initFromEnvironment()
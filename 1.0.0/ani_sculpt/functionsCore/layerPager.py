@@ -0,0 +1,271 @@
+import bisect
+import json
+import math
+
+import maya.cmds as cmds
+
+import functionsCore.coreCmds
+import functionsCore.deltaBuffers
+import functionsCore.instrumentation
+import functionsCore.retarget
+
+WINDOW = 10
+MEMORY_BUDGET = 512 * 1024 * 1024
+POINT_BYTES = 32
+WEIGHT_EPSILON = 1e-4
+SETTINGS_ATTRIBUTE = "aniSculptLazyLayers"
+
+try:
+    _pagers
+except NameError:
+    # kept when the module is reloaded, the running pagers still own their scriptJobs
+    _pagers = {}
+
+
+def getPagerSettings(blendshape):
+    """get the lazy loading settings stored on a blendshape, None when its layers were loaded up front
+
+    Returns:
+        settings (dict): cachePath, mesh, retarget, window and memoryBudget
+    """
+    if not cmds.objExists(blendshape) or not cmds.attributeQuery(SETTINGS_ATTRIBUTE, node=blendshape, exists=True):
+        return None
+    value = cmds.getAttr("{}.{}".format(blendshape, SETTINGS_ATTRIBUTE))
+    return json.loads(value) if value else None
+
+
+def setPagerSettings(blendshape, settings):
+    """store the lazy loading settings on the blendshape, so its pager is restored when the scene is reopened"""
+    if not cmds.attributeQuery(SETTINGS_ATTRIBUTE, node=blendshape, exists=True):
+        cmds.addAttr(blendshape, longName=SETTINGS_ATTRIBUTE, dataType="string")
+    cmds.setAttr("{}.{}".format(blendshape, SETTINGS_ATTRIBUTE), json.dumps(settings), type="string")
+
+
+def getPager(blendshape):
+    """get the running pager of a blendshape, pagers of deleted blendshapes are dropped"""
+    pager = _pagers.get(blendshape)
+    if pager is not None and not cmds.objExists(blendshape):
+        removePager(blendshape)
+        return None
+    return pager
+
+
+def registerPager(pager):
+    removePager(pager.blendshape)
+    _pagers[pager.blendshape] = pager
+    return pager
+
+
+def removePager(blendshape):
+    pager = _pagers.pop(blendshape, None)
+    if pager is not None:
+        pager.close()
+
+
+def clearPagers():
+    for blendshape in list(_pagers):
+        removePager(blendshape)
+
+
+class LayerPager(object):
+    """keep the targets of a lazily loaded blendshape resident only around the current time
+
+    Every layer is registered on the blendshape with an empty target. The layers whose weight curve
+    is non-zero within window frames of the current time are always paged in, then the other layers
+    active in the playback range, nearest first, while they fit in memoryBudget. Layers edited since
+    they were paged in are pinned and never paged out.
+    """
+
+    def __init__(self, blendshape, sculptCache, layers, correspondence=None, window=WINDOW, memoryBudget=MEMORY_BUDGET):
+        """
+        Args:
+            blendshape (str): blendshape node holding the registered targets
+            sculptCache (SculptCache): open cache of the layers, closed with the pager
+            layers (dict): {target_index: cache key}
+            correspondence (tuple): retarget.transferDeltas correspondence, None loads the deltas as saved
+            window (float): frames around the current time whose active layers are always resident
+            memoryBudget (int): bytes of resident targets, estimated as POINT_BYTES per stored vertex
+        """
+        self.blendshape = blendshape
+        self.sculptCache = sculptCache
+        self.layers = layers
+        self.correspondence = correspondence
+        self.window = window
+        self.memoryBudget = memoryBudget
+        self.resident = set()
+        self.pinned = set()
+        self.loadedHashes = {}
+        self.activeFrames = {}
+        self.sampledRange = None
+        self.scriptJobIDs = []
+        self.pageIns = 0
+        self.pageOuts = 0
+
+    def startMonitoring(self):
+        self.scriptJobIDs = [cmds.scriptJob(event=["timeChanged", self.update], killWithScene=True),
+                             cmds.scriptJob(event=["playbackRangeChanged", self.update], killWithScene=True)]
+
+    def stopMonitoring(self):
+        for scriptJobID in self.scriptJobIDs:
+            try:
+                cmds.scriptJob(kill=scriptJobID, force=True)
+            except Exception:
+                pass
+        self.scriptJobIDs = []
+
+    def close(self):
+        self.stopMonitoring()
+        if self.sculptCache is not None:
+            self.sculptCache.close()
+            self.sculptCache = None
+
+    def getLayerBytes(self, target_index):
+        return self.sculptCache.targetInfo(self.layers[target_index])['count'] * POINT_BYTES
+
+    def getResidentBytes(self):
+        return sum(self.getLayerBytes(target_index) for target_index in self.resident)
+
+    def isPagedOut(self, target_index):
+        return target_index in self.layers and target_index not in self.resident
+
+    def resample(self, start, end):
+        """find the frames of the playback range, extended by the window, where each layer weight is not zero"""
+        frames = list(range(int(math.floor(start - self.window)), int(math.ceil(end + self.window)) + 1))
+        weights = self.sculptCache.sampleWeights(frames)
+        self.activeFrames = {}
+        for target_index, key in self.layers.items():
+            if key not in weights:
+                # layers saved without their curve are always active
+                self.activeFrames[target_index] = None
+                continue
+            self.activeFrames[target_index] = [frame for frame, weight in zip(frames, weights[key]) if abs(weight) > WEIGHT_EPSILON]
+        self.sampledRange = (start, end)
+
+    def getDistance(self, target_index, frame):
+        """frames from frame to the nearest frame where the layer is active, inf when it never is"""
+        activeFrames = self.activeFrames.get(target_index)
+        if activeFrames is None:
+            return 0.0
+        position = bisect.bisect_left(activeFrames, frame)
+        distance = float('inf')
+        if position < len(activeFrames):
+            distance = activeFrames[position] - frame
+        if position > 0:
+            distance = min(distance, frame - activeFrames[position - 1])
+        return distance
+
+    def getWantedLayers(self, frame):
+        distances = sorted((self.getDistance(target_index, frame), target_index) for target_index in self.layers)
+        wanted = set(target_index for distance, target_index in distances if distance <= self.window)
+        budget = self.memoryBudget - sum(self.getLayerBytes(target_index) for target_index in wanted | self.pinned)
+        for distance, target_index in distances:
+            if target_index in wanted or distance == float('inf'):
+                continue
+            size = self.getLayerBytes(target_index)
+            if size > budget:
+                break
+            wanted.add(target_index)
+            budget -= size
+        return wanted | self.pinned
+
+    @functionsCore.instrumentation.profiled("layerPager.update")
+    def update(self, frame=None):
+        """page the layers in and out for the current time, or frame
+
+        Returns:
+            paged (tuple): (paged in, paged out) layer counts
+        """
+        if not cmds.objExists(self.blendshape):
+            return 0, 0
+        playbackRange = (cmds.playbackOptions(query=True, minTime=True), cmds.playbackOptions(query=True, maxTime=True))
+        if playbackRange != self.sampledRange:
+            self.resample(*playbackRange)
+        if frame is None:
+            frame = cmds.currentTime(query=True)
+
+        wanted = self.getWantedLayers(frame)
+        pageOut = sorted(self.resident - wanted)
+        pageIn = sorted(wanted - self.resident, key=lambda target_index: self.getDistance(target_index, frame))
+        if not pageOut and not pageIn:
+            return 0, 0
+
+        pagedIn = pagedOut = 0
+        # paging only swaps cached data, it must not show up in the undo queue
+        undoState = cmds.undoInfo(query=True, stateWithoutFlush=True)
+        cmds.undoInfo(stateWithoutFlush=False)
+        try:
+            for target_index in pageOut:
+                pagedOut += self.pageOut(target_index)
+            for target_index in pageIn:
+                self.pageIn(target_index)
+                pagedIn += 1
+        finally:
+            cmds.undoInfo(stateWithoutFlush=undoState)
+        functionsCore.instrumentation.annotate(frame=frame, resident=len(self.resident), pagedIn=pagedIn, pagedOut=pagedOut)
+        return pagedIn, pagedOut
+
+    def readTarget(self, target_index):
+        """read the deltas of a layer from the cache, retargeted when the pager has a correspondence
+
+        Returns:
+            indices (buffer): vertex indices
+            deltas (buffer): flat x y z offsets
+        """
+        indices, deltas = self.sculptCache.readTarget(self.layers[target_index])
+        if self.correspondence is not None:
+            indices, deltas = functionsCore.retarget.transferDeltas(self.correspondence, indices, deltas,
+                                                                     self.sculptCache.header['restMesh']['count'])
+        return indices, deltas
+
+    def readDenseDeltas(self, target_index, vertex_count):
+        indices, deltas = self.readTarget(target_index)
+        return functionsCore.deltaBuffers.decodeSparseDeltas(vertex_count, indices, deltas)
+
+    def getSavedContentHash(self, target_index):
+        """content hash of a paged out layer as saved in the cache, None once retargeted"""
+        if self.correspondence is not None:
+            return None
+        return self.sculptCache.targetInfo(self.layers[target_index]).get('contentHash')
+
+    def getContentHash(self, target_index):
+        """content hash of a layer for an incremental save
+
+        The saved hash is kept while the layer is paged out or paged in and unedited, the target
+        rebuilt from the float32 cache hashes differently and would be written again on every save.
+
+        Returns:
+            contentHash (str): saved hash of the layer, the hash of the target once it was edited
+        """
+        if self.isPagedOut(target_index):
+            return self.getSavedContentHash(target_index)
+        contentHash = functionsCore.coreCmds.getTargetContentHash(self.blendshape, target_index)
+        if contentHash is not None and contentHash == self.loadedHashes.get(target_index):
+            return self.getSavedContentHash(target_index) or contentHash
+        return contentHash
+
+    def pageIn(self, target_index):
+        indices, deltas = self.readTarget(target_index)
+        functionsCore.coreCmds.setTargetDeltas(self.blendshape, target_index, indices, deltas)
+        self.loadedHashes[target_index] = functionsCore.coreCmds.getTargetContentHash(self.blendshape, target_index)
+        self.resident.add(target_index)
+        self.pageIns += 1
+
+    def pageOut(self, target_index):
+        """empty a resident target, targets edited since they were paged in are pinned instead
+
+        Returns:
+            pagedOut (bool): False when the target was pinned
+        """
+        if functionsCore.coreCmds.getTargetContentHash(self.blendshape, target_index) != self.loadedHashes.get(target_index):
+            self.pinned.add(target_index)
+            return False
+        functionsCore.coreCmds.setTargetDeltas(self.blendshape, target_index, [], [])
+        self.resident.discard(target_index)
+        self.loadedHashes.pop(target_index, None)
+        self.pageOuts += 1
+        return True
+
+    def stats(self):
+        return {'layers': len(self.layers), 'resident': len(self.resident), 'pinned': len(self.pinned),
+                'residentBytes': self.getResidentBytes(), 'memoryBudget': self.memoryBudget,
+                'pageIns': self.pageIns, 'pageOuts': self.pageOuts}
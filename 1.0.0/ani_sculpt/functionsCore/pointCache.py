@@ -0,0 +1,339 @@
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import struct
+
+import functionsCore.animCurves
+import functionsCore.blockStore
+import functionsCore.instrumentation
+import functionsCore.sculptCache
+from functionsCore.deltaBuffers import numpy
+
+POINT_CACHE_MAGIC = b"ASPOINTS"
+POINT_CACHE_VERSION = 1
+POINT_CACHE_EXTENSION = ".aspoints"
+BATCH_MEMORY = 64 * 1024 * 1024
+
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def _align(offset):
+    alignment = functionsCore.sculptCache.CACHE_ALIGNMENT
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _requireNumpy():
+    if numpy is None:
+        raise RuntimeError("numpy is required to evaluate sculpt layers outside Maya")
+
+
+def getPointCachePath(cacheFolder, sceneName):
+    """get the baked point cache file of a scene inside a cacheSculpt/<mesh> folder
+
+    Args:
+        cacheFolder (str): folder returned by coreCmds.createCacheFolder
+        sceneName (str): scene name without extension
+
+    Returns:
+        pointCachePath (str): path of the point cache file
+    """
+    return os.path.join(cacheFolder, sceneName + POINT_CACHE_EXTENSION)
+
+
+def loadLayers(source):
+    """read the sparse deltas and weight curve of every saved layer
+
+    Args:
+        source (SculptCache or dict): binary cache or manifest, or {keyNode: layer data} as returned by
+            coreProcs.getBlendshapeAnimationData, sparse or dense
+
+    Returns:
+        layers (list): (name, curveData, indices, deltas) with int64 indices and float64 (n, 3) deltas,
+            layers saved without animCurve are skipped
+    """
+    _requireNumpy()
+    layers = []
+    if isinstance(source, functionsCore.sculptCache.SculptCache):
+        for name in source.targets():
+            curveData = source.targetInfo(name).get('animCurve')
+            if not curveData:
+                continue
+            indices, deltas = source.readTarget(name)
+            layers.append((name, curveData, numpy.array(indices, dtype=numpy.int64),
+                           numpy.array(deltas, dtype=numpy.float64).reshape(-1, 3)))
+        return layers
+
+    for name in sorted(source):
+        entry = source[name]
+        if not entry.get('animCurve'):
+            continue
+        indices, deltas = functionsCore.sculptCache.getSparseEntry(entry, 0.0)
+        layers.append((name, entry['animCurve'], numpy.asarray(indices, dtype=numpy.int64),
+                       numpy.asarray(deltas, dtype=numpy.float64).reshape(-1, 3)))
+    return layers
+
+
+def evaluateFrames(layers, basePoints, frames):
+    """evaluate the deformed points of a batch of frames, base + sum of weight * delta per layer
+
+    Args:
+        layers (list): layers returned by loadLayers
+        basePoints (buffer): flat x y z rest positions, one per vertex
+        frames (iterable): frames to evaluate
+
+    Returns:
+        points (numpy.ndarray): float64 array of shape (frames, vertices, 3)
+    """
+    _requireNumpy()
+    frames = numpy.asarray(list(frames), dtype=numpy.float64)
+    basePoints = numpy.asarray(basePoints, dtype=numpy.float64).reshape(-1, 3)
+    points = numpy.repeat(basePoints[numpy.newaxis], len(frames), axis=0)
+
+    for name, curveData, indices, deltas in layers:
+        if not len(indices):
+            continue
+        weights = numpy.asarray(functionsCore.animCurves.evaluateCurve(curveData, frames), dtype=numpy.float64)
+        active = numpy.flatnonzero(weights)
+        if not len(active):
+            continue
+        points[active[:, numpy.newaxis], indices] += weights[active, numpy.newaxis, numpy.newaxis] * deltas
+    return points
+
+
+def _getBatchSize(vertexCount, batchSize=None):
+    if batchSize:
+        return batchSize
+    return max(1, BATCH_MEMORY // max(1, vertexCount * 3 * 8))
+
+
+def _writeHeader(pointCachePath, mesh, basePoints, frames):
+    basePoints = numpy.asarray(basePoints, dtype=numpy.float32).reshape(-1)
+    vertexCount = len(basePoints) // 3
+    header = {'version': POINT_CACHE_VERSION, 'mesh': mesh, 'vertexCount': vertexCount,
+              'frames': [float(frame) for frame in frames], 'restOffset': 0,
+              'framesOffset': _align(basePoints.nbytes)}
+    headerBytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    dataOffset = _align(_PREAMBLE.size + len(headerBytes))
+
+    with open(pointCachePath, 'wb') as pointFile:
+        pointFile.write(_PREAMBLE.pack(POINT_CACHE_MAGIC, POINT_CACHE_VERSION, len(headerBytes)))
+        pointFile.write(headerBytes)
+        pointFile.seek(dataOffset)
+        pointFile.write(basePoints.tobytes())
+        pointFile.truncate(dataOffset + header['framesOffset'] + len(frames) * vertexCount * 12)
+    return header
+
+
+_workerState = {}
+
+
+def _initBakeWorker(sculptCachePath, pointCachePath):
+    sculptCache = functionsCore.blockStore.openCache(sculptCachePath)
+    try:
+        layers = loadLayers(sculptCache)
+    finally:
+        sculptCache.close()
+    with PointCache(pointCachePath) as pointCache:
+        basePoints = numpy.array(pointCache.restPoints())
+        frameOffset = pointCache.frameOffset
+        frameShape = (len(pointCache.frames()), pointCache.vertexCount, 3)
+    _workerState.update(layers=layers, basePoints=basePoints, pointCachePath=pointCachePath,
+                        frameOffset=frameOffset, frameShape=frameShape)
+
+
+def _bakeBatch(batch):
+    first, frames = batch
+    points = evaluateFrames(_workerState['layers'], _workerState['basePoints'], frames)
+    output = numpy.memmap(_workerState['pointCachePath'], dtype=numpy.float32, mode='r+',
+                          offset=_workerState['frameOffset'], shape=_workerState['frameShape'])
+    output[first:first + len(frames)] = points
+    output.flush()
+    del output
+    return len(frames)
+
+
+def bakePointCache(sculptCachePath, basePoints, pointCachePath, frames, mesh=None, processes=1,
+                   batchSize=None, progressCallback=None):
+    """bake the saved sculpt layers of a binary cache to a memory-mapped per-frame point cache
+
+    The file is a fixed preamble, a JSON header (mesh, vertexCount, frames, block offsets), the
+    float32 rest points, then one float32 x y z block per frame, so readers can map any frame in
+    place. Frames are evaluated in batches sized by BATCH_MEMORY, across a process pool when
+    processes is above 1, each worker writing its batches straight into the mapped file. Nothing
+    here calls Maya.
+
+    Args:
+        sculptCachePath (str): manifest or binary cache written by coreProcs.saveAnimation
+        basePoints (buffer): flat x y z rest positions, one per vertex
+        pointCachePath (str): path of the point cache file
+        frames (iterable): frames to bake
+        mesh (str): name of the mesh, defaults to the mesh of the sculpt cache
+        processes (int): worker processes, None uses every core, 1 bakes in this process
+        batchSize (int): frames per batch, derived from BATCH_MEMORY by default
+        progressCallback (callable): called with (done, total) frames after each batch
+
+    Returns:
+        pointCachePath (str): path of the point cache file
+    """
+    _requireNumpy()
+    frames = list(frames)
+    temporaryPath = pointCachePath + ".tmp"
+
+    try:
+        with functionsCore.blockStore.openCache(sculptCachePath) as sculptCache:
+            header = _writeHeader(temporaryPath, mesh or sculptCache.mesh, basePoints, frames)
+        size = _getBatchSize(header['vertexCount'], batchSize)
+        batches = [(first, frames[first:first + size]) for first in range(0, len(frames), size)]
+
+        done = 0
+        if processes == 1:
+            _initBakeWorker(sculptCachePath, temporaryPath)
+            try:
+                for batch in batches:
+                    done += _bakeBatch(batch)
+                    if progressCallback is not None:
+                        progressCallback(done, len(frames))
+            finally:
+                _workerState.clear()
+        else:
+            pool = multiprocessing.Pool(processes, _initBakeWorker, (sculptCachePath, temporaryPath))
+            try:
+                for count in pool.imap_unordered(_bakeBatch, batches):
+                    done += count
+                    if progressCallback is not None:
+                        progressCallback(done, len(frames))
+                pool.close()
+            except BaseException:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+    except BaseException:
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+        raise
+
+    functionsCore.sculptCache.replaceFile(temporaryPath, pointCachePath)
+    functionsCore.instrumentation.countBytesWritten(pointCachePath)
+    return pointCachePath
+
+
+class PointCache(object):
+    """memory-mapped reader of a baked point cache, frames are numpy views over the file"""
+
+    def __init__(self, pointCachePath):
+        _requireNumpy()
+        self.pointCachePath = pointCachePath
+        self._file = open(pointCachePath, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, headerSize = _PREAMBLE.unpack_from(self._map, 0)
+        if magic != POINT_CACHE_MAGIC:
+            self.close()
+            raise ValueError("{} is not an ani_sculpt point cache".format(pointCachePath))
+        if version > POINT_CACHE_VERSION:
+            self.close()
+            raise ValueError("{} uses point cache version {}, newer than {}".format(pointCachePath, version, POINT_CACHE_VERSION))
+
+        self.header = json.loads(self._map[_PREAMBLE.size:_PREAMBLE.size + headerSize].decode('utf-8'))
+        self._dataOffset = _align(_PREAMBLE.size + headerSize)
+        self._frameIndex = dict((frame, index) for index, frame in enumerate(self.header['frames']))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """close the mapping, arrays returned by the readers must be released first"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    @property
+    def mesh(self):
+        return self.header['mesh']
+
+    @property
+    def vertexCount(self):
+        return self.header['vertexCount']
+
+    @property
+    def frameOffset(self):
+        return self._dataOffset + self.header['framesOffset']
+
+    def frames(self):
+        return list(self.header['frames'])
+
+    def restPoints(self):
+        """get the float32 rest positions as a (vertices, 3) view"""
+        return numpy.frombuffer(self._map, dtype=numpy.float32, count=self.vertexCount * 3,
+                                offset=self._dataOffset + self.header['restOffset']).reshape(-1, 3)
+
+    def readFrames(self):
+        """get every baked frame as a (frames, vertices, 3) float32 view"""
+        frameCount = len(self.header['frames'])
+        return numpy.frombuffer(self._map, dtype=numpy.float32, count=frameCount * self.vertexCount * 3,
+                                offset=self.frameOffset).reshape(frameCount, self.vertexCount, 3)
+
+    def readFrame(self, frame):
+        """get the baked points of one frame as a (vertices, 3) float32 view"""
+        index = self._frameIndex[float(frame)]
+        frameSize = self.vertexCount * 3
+        return numpy.frombuffer(self._map, dtype=numpy.float32, count=frameSize,
+                                offset=self.frameOffset + index * frameSize * 4).reshape(-1, 3)
+
+
+def comparePointCache(pointCachePath, animationData, basePoints, frames=None):
+    """compare a baked point cache with a direct evaluation of saved layer data
+
+    Args:
+        pointCachePath (str): path of the point cache file
+        animationData (dict): {keyNode: layer data} as returned by coreProcs.getBlendshapeAnimationData
+        basePoints (buffer): flat x y z rest positions, one per vertex
+        frames (iterable): frames to compare, every baked frame by default
+
+    Returns:
+        maxError (float): largest absolute difference on any axis
+    """
+    layers = loadLayers(animationData)
+    maxError = 0.0
+    with PointCache(pointCachePath) as pointCache:
+        frames = pointCache.frames() if frames is None else list(frames)
+        expected = evaluateFrames(layers, basePoints, frames)
+        for index, frame in enumerate(frames):
+            maxError = max(maxError, float(numpy.abs(pointCache.readFrame(frame) - expected[index]).max()))
+        expected = None
+    return maxError
+
+
+def main(argv=None):
+    """bake a point cache from the command line, without Maya
+
+    python -m functionsCore.pointCache <scene>.asmanifest basePoints.npy <scene>.aspoints --start 1 --end 120
+    """
+    parser = argparse.ArgumentParser(description="Bake ani_sculpt layers to a per-frame point cache.")
+    parser.add_argument("sculptCache", help="sculpt manifest (.asmanifest) or binary cache (.ascache)")
+    parser.add_argument("basePoints", help="rest positions saved with numpy.save, one x y z row per vertex")
+    parser.add_argument("output", help="point cache to write (.aspoints)")
+    parser.add_argument("--start", type=float, required=True)
+    parser.add_argument("--end", type=float, required=True)
+    parser.add_argument("--step", type=float, default=1.0)
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, every core by default")
+    parser.add_argument("--batch-size", type=int, default=None, help="frames per batch")
+    arguments = parser.parse_args(argv)
+
+    _requireNumpy()
+    frames = numpy.arange(arguments.start, arguments.end + arguments.step * 0.5, arguments.step).tolist()
+    bakePointCache(arguments.sculptCache, numpy.load(arguments.basePoints), arguments.output, frames,
+                   processes=arguments.processes, batchSize=arguments.batch_size)
+    print("Baked {} frames to {}".format(len(frames), arguments.output))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
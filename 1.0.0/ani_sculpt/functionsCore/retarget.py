@@ -0,0 +1,366 @@
+import hashlib
+import json
+import os
+import struct
+
+import functionsCore.sculptCache
+from functionsCore.deltaBuffers import numpy, SPARSE_EPSILON
+
+MAP_MAGIC = b"ASRETMAP"
+MAP_VERSION = 1
+MAP_EXTENSION = ".asmap"
+RETARGET_FOLDER = "retarget"
+LEAF_SIZE = 16
+QUERY_CHUNK = 65536
+
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def _requireNumpy():
+    if numpy is None:
+        raise RuntimeError("numpy is required to retarget sculpt layers")
+
+
+def _align(offset):
+    alignment = functionsCore.sculptCache.CACHE_ALIGNMENT
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def getTopologyHash(vertexCount, triangles):
+    """hash the vertex count and triangle vertex indices of a mesh, its rest shape is not part of it
+
+    Args:
+        vertexCount (int): vertex count of the mesh
+        triangles (buffer): flat vertex indices, three per triangle
+
+    Returns:
+        topologyHash (str): sha1 hex digest
+    """
+    _requireNumpy()
+    digest = hashlib.sha1("{}:".format(vertexCount).encode('ascii'))
+    digest.update(numpy.ascontiguousarray(triangles, dtype=numpy.uint32).tobytes())
+    return digest.hexdigest()
+
+
+class KDTree(object):
+    """balanced kd-tree over 3d points, every query point is searched at once with numpy
+
+    The tree is stored as a complete binary heap, node i has the children 2i+1 and 2i+2 and every
+    leaf holds at most leafSize points, padded with inf so a leaf is compared in one operation.
+    """
+
+    def __init__(self, points, leafSize=LEAF_SIZE):
+        _requireNumpy()
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+        count = len(points)
+        if not count:
+            raise ValueError("a KDTree needs at least one point")
+        depth = 0
+        while count > leafSize << depth:
+            depth += 1
+        nodeCount = 2 ** (depth + 1) - 1
+        self.depth = depth
+        self.firstLeaf = 2 ** depth - 1
+        self.splitAxis = numpy.zeros(nodeCount, dtype=numpy.int64)
+        self.splitValue = numpy.full(nodeCount, numpy.inf)
+
+        order = numpy.arange(count)
+        segments = [(0, count)]
+        for level in range(depth):
+            nextSegments = []
+            for offset, (start, end) in enumerate(segments):
+                middle = (start + end) // 2
+                if end - start > 1:
+                    segment = order[start:end]
+                    values = points[segment]
+                    axis = int(numpy.argmax(values.max(axis=0) - values.min(axis=0)))
+                    order[start:end] = segment[numpy.argpartition(values[:, axis], middle - start)]
+                    self.splitAxis[2 ** level - 1 + offset] = axis
+                    self.splitValue[2 ** level - 1 + offset] = points[order[middle], axis]
+                nextSegments.extend(((start, middle), (middle, end)))
+            segments = nextSegments
+
+        starts = numpy.array([start for start, end in segments], dtype=numpy.int64)
+        sizes = numpy.array([end - start for start, end in segments], dtype=numpy.int64)
+        columns = numpy.arange(max(int(sizes.max()), 1))
+        valid = columns < sizes[:, None]
+        leafOrder = order[numpy.minimum(starts[:, None] + columns, count - 1)]
+        self.leafIndices = numpy.where(valid, leafOrder, -1)
+        self.leafPoints = points[leafOrder]
+        self.leafPoints[~valid] = numpy.inf
+
+        self.lower = numpy.full((nodeCount, 3), numpy.inf)
+        self.upper = numpy.full((nodeCount, 3), -numpy.inf)
+        self.lower[self.firstLeaf:] = numpy.where(valid[:, :, None], self.leafPoints, numpy.inf).min(axis=1)
+        self.upper[self.firstLeaf:] = numpy.where(valid[:, :, None], self.leafPoints, -numpy.inf).max(axis=1)
+        for level in reversed(range(depth)):
+            nodes = numpy.arange(2 ** level - 1, 2 ** (level + 1) - 1)
+            self.lower[nodes] = numpy.minimum(self.lower[2 * nodes + 1], self.lower[2 * nodes + 2])
+            self.upper[nodes] = numpy.maximum(self.upper[2 * nodes + 1], self.upper[2 * nodes + 2])
+
+    def _leafDistances(self, points, leaves):
+        difference = self.leafPoints[leaves] - points[:, None, :]
+        return numpy.einsum('ijk,ijk->ij', difference, difference)
+
+    def _boxDistances(self, points, nodes):
+        outside = numpy.maximum(self.lower[nodes] - points, 0.0) + numpy.maximum(points - self.upper[nodes], 0.0)
+        return numpy.einsum('ij,ij->i', outside, outside)
+
+    def _queryChunk(self, points):
+        rows = numpy.arange(len(points))
+        node = numpy.zeros(len(points), dtype=numpy.int64)
+        for level in range(self.depth):
+            node = 2 * node + 1 + (points[rows, self.splitAxis[node]] >= self.splitValue[node])
+        squared = self._leafDistances(points, node - self.firstLeaf)
+        column = squared.argmin(axis=1)
+        best = squared[rows, column]
+        bestIndex = self.leafIndices[node - self.firstLeaf, column]
+
+        # walk down again keeping only the (point, node) pairs whose box is closer than the best point found so far
+        pairPoints = rows
+        pairNodes = numpy.zeros(len(points), dtype=numpy.int64)
+        for level in range(self.depth):
+            pairPoints = numpy.repeat(pairPoints, 2)
+            pairNodes = (2 * pairNodes[:, None] + numpy.array([1, 2])).reshape(-1)
+            keep = self._boxDistances(points[pairPoints], pairNodes) < best[pairPoints]
+            pairPoints = pairPoints[keep]
+            pairNodes = pairNodes[keep]
+        keep = pairNodes != node[pairPoints]
+        pairPoints = pairPoints[keep]
+        pairLeaves = pairNodes[keep] - self.firstLeaf
+        if len(pairPoints):
+            squared = self._leafDistances(points[pairPoints], pairLeaves)
+            column = squared.argmin(axis=1)
+            pairBest = squared[numpy.arange(len(pairPoints)), column]
+            order = numpy.lexsort((pairBest, pairPoints))
+            unique, first = numpy.unique(pairPoints[order], return_index=True)
+            closest = order[first]
+            closer = pairBest[closest] < best[unique]
+            best[unique[closer]] = pairBest[closest[closer]]
+            bestIndex[unique[closer]] = self.leafIndices[pairLeaves[closest[closer]], column[closest[closer]]]
+        return best, bestIndex
+
+    def query(self, points):
+        """find the nearest tree point of every point
+
+        Args:
+            points (buffer): flat x y z query points
+
+        Returns:
+            distances (numpy.ndarray): float64 distance to the nearest point
+            indices (numpy.ndarray): int64 index of the nearest point in the tree points
+        """
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+        distances = numpy.empty(len(points), dtype=numpy.float64)
+        indices = numpy.empty(len(points), dtype=numpy.int64)
+        for start in range(0, len(points), QUERY_CHUNK):
+            distances[start:start + QUERY_CHUNK], indices[start:start + QUERY_CHUNK] = self._queryChunk(points[start:start + QUERY_CHUNK])
+        return numpy.sqrt(distances), indices
+
+
+def _closestBarycentric(points, a, b, c):
+    """barycentric weights of the closest point of each triangle, the regions of Ericson's
+    closest point on triangle test applied as masks, the last applied wins"""
+    def dot(first, second):
+        return numpy.einsum('...i,...i->...', first, second)
+
+    ab = b - a
+    ac = c - a
+    d1 = dot(ab, points - a)
+    d2 = dot(ac, points - a)
+    d3 = dot(ab, points - b)
+    d4 = dot(ac, points - b)
+    d5 = dot(ab, points - c)
+    d6 = dot(ac, points - c)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        v = vb / (va + vb + vc)
+        w = vc / (va + vb + vc)
+        weights = numpy.stack((1.0 - v - w, v, w), axis=-1)
+        w = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        edgeBC = numpy.stack((numpy.zeros_like(w), 1.0 - w, w), axis=-1)
+        w = d2 / (d2 - d6)
+        edgeAC = numpy.stack((1.0 - w, numpy.zeros_like(w), w), axis=-1)
+        v = d1 / (d1 - d3)
+        edgeAB = numpy.stack((1.0 - v, v, numpy.zeros_like(v)), axis=-1)
+
+    regions = (
+        ((va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0), edgeBC),
+        ((vb <= 0) & (d2 >= 0) & (d6 <= 0), edgeAC),
+        ((d6 >= 0) & (d5 <= d6), numpy.array([0.0, 0.0, 1.0])),
+        ((vc <= 0) & (d1 >= 0) & (d3 <= 0), edgeAB),
+        ((d3 >= 0) & (d4 <= d3), numpy.array([0.0, 1.0, 0.0])),
+        ((d1 <= 0) & (d2 <= 0), numpy.array([1.0, 0.0, 0.0])),
+    )
+    for mask, regionWeights in regions:
+        weights = numpy.where(mask[..., None], regionWeights, weights)
+    # degenerate triangles snap to their first vertex
+    return numpy.where(numpy.isfinite(weights).all(axis=-1)[..., None], weights, numpy.array([1.0, 0.0, 0.0]))
+
+
+def _getVertexTriangles(vertexCount, triangles):
+    """triangles around each vertex, padded with -1 to the highest valence"""
+    corners = triangles.reshape(-1)
+    order = numpy.argsort(corners, kind='mergesort')
+    counts = numpy.bincount(corners, minlength=vertexCount)
+    starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    sortedCorners = corners[order]
+    table = numpy.full((vertexCount, max(int(counts.max()) if len(counts) else 0, 1)), -1, dtype=numpy.int64)
+    table[sortedCorners, numpy.arange(len(corners)) - starts[sortedCorners]] = order // 3
+    return table
+
+
+def buildCorrespondence(sourcePoints, sourceTriangles, targetPoints):
+    """map every target vertex to the closest point of the source surface
+
+    The nearest source vertex comes from a KDTree, the closest point is then searched on the
+    triangles around it, its barycentric weights interpolate the source deltas.
+
+    Args:
+        sourcePoints (buffer): flat x y z rest points of the saved mesh
+        sourceTriangles (buffer): flat vertex indices of the saved mesh, three per triangle
+        targetPoints (buffer): flat x y z rest points of the mesh the layers are loaded on
+
+    Returns:
+        vertices (numpy.ndarray): (targetVertexCount, 3) uint32 source vertex indices
+        weights (numpy.ndarray): (targetVertexCount, 3) float32 barycentric weights
+    """
+    _requireNumpy()
+    sourcePoints = numpy.asarray(sourcePoints, dtype=numpy.float64).reshape(-1, 3)
+    sourceTriangles = numpy.asarray(sourceTriangles, dtype=numpy.int64).reshape(-1, 3)
+    targetPoints = numpy.asarray(targetPoints, dtype=numpy.float64).reshape(-1, 3)
+    distances, nearest = KDTree(sourcePoints).query(targetPoints)
+    vertexTriangles = _getVertexTriangles(len(sourcePoints), sourceTriangles)
+
+    vertices = numpy.repeat(nearest[:, None], 3, axis=1).astype(numpy.uint32)
+    weights = numpy.zeros((len(targetPoints), 3), dtype=numpy.float32)
+    weights[:, 0] = 1.0
+    chunk = max(1, QUERY_CHUNK // vertexTriangles.shape[1])
+    for start in range(0, len(targetPoints), chunk):
+        candidates = vertexTriangles[nearest[start:start + chunk]]
+        valid = candidates >= 0
+        corners = sourceTriangles[numpy.where(valid, candidates, 0)]
+        a, b, c = sourcePoints[corners[..., 0]], sourcePoints[corners[..., 1]], sourcePoints[corners[..., 2]]
+        points = targetPoints[start:start + chunk, None, :]
+        candidateWeights = _closestBarycentric(points, a, b, c)
+        closest = candidateWeights[..., 0:1] * a + candidateWeights[..., 1:2] * b + candidateWeights[..., 2:3] * c
+        squared = numpy.where(valid, ((closest - points) ** 2).sum(axis=-1), numpy.inf)
+        best = squared.argmin(axis=1)
+        rows = numpy.arange(len(best))
+        onSurface = valid[rows, best]
+        # vertices without triangles keep their nearest vertex
+        vertices[start:start + chunk][onSurface] = corners[rows, best][onSurface]
+        weights[start:start + chunk][onSurface] = candidateWeights[rows, best][onSurface]
+    return vertices, weights
+
+
+def transferDeltas(correspondence, indices, deltas, sourceVertexCount, epsilon=SPARSE_EPSILON):
+    """move sparse deltas of the saved mesh to the target mesh with one gather
+
+    Args:
+        correspondence (tuple): (vertices, weights) returned by buildCorrespondence
+        indices (buffer): uint32 source vertex indices
+        deltas (buffer): flat x y z offsets, three per index
+        sourceVertexCount (int): vertex count of the saved mesh
+        epsilon (float): target deltas with every axis at or below this value are dropped
+
+    Returns:
+        indices (numpy.ndarray): uint32 target vertex indices
+        deltas (numpy.ndarray): float32 flat x y z offsets
+    """
+    vertices, weights = correspondence
+    dense = numpy.zeros((sourceVertexCount, 3), dtype=numpy.float32)
+    dense[numpy.asarray(indices, dtype=numpy.int64)] = numpy.asarray(deltas, dtype=numpy.float32).reshape(-1, 3)
+    moved = numpy.einsum('nk,nkj->nj', weights, dense[vertices])
+    kept = numpy.flatnonzero(numpy.abs(moved).max(axis=1) > epsilon)
+    return kept.astype(numpy.uint32), moved[kept].reshape(-1)
+
+
+def getCorrespondencePath(cacheRoot, sourceTopologyHash, targetTopologyHash):
+    """get the correspondence map of two topologies inside a cacheSculpt folder"""
+    return os.path.join(cacheRoot, RETARGET_FOLDER,
+                        "{}_{}{}".format(sourceTopologyHash[:16], targetTopologyHash[:16], MAP_EXTENSION))
+
+
+def writeCorrespondence(mapPath, correspondence, sourceTopologyHash, targetTopologyHash):
+    """write a correspondence map, the preamble and JSON header of the sculpt cache are followed by
+    the vertex and weight blocks
+
+    Returns:
+        mapPath (str): path of the map file
+    """
+    vertices, weights = correspondence
+    verticesBytes = numpy.ascontiguousarray(vertices, dtype=numpy.uint32).tobytes()
+    weightsBytes = numpy.ascontiguousarray(weights, dtype=numpy.float32).tobytes()
+    header = {'sourceTopology': sourceTopologyHash, 'targetTopology': targetTopologyHash, 'count': len(vertices)}
+    headerBytes = json.dumps(header, sort_keys=True).encode('utf-8')
+    verticesOffset = _align(_PREAMBLE.size + len(headerBytes))
+    weightsOffset = _align(verticesOffset + len(verticesBytes))
+
+    def writeMap(mapFile):
+        mapFile.write(_PREAMBLE.pack(MAP_MAGIC, MAP_VERSION, len(headerBytes)))
+        mapFile.write(headerBytes)
+        mapFile.seek(verticesOffset)
+        mapFile.write(verticesBytes)
+        mapFile.seek(weightsOffset)
+        mapFile.write(weightsBytes)
+
+    folder = os.path.dirname(mapPath)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return functionsCore.sculptCache.writeAtomic(mapPath, writeMap)
+
+
+def readCorrespondence(mapPath):
+    """read a correspondence map
+
+    Returns:
+        header (dict): sourceTopology, targetTopology and count
+        correspondence (tuple): (vertices, weights) as returned by buildCorrespondence
+    """
+    with open(mapPath, 'rb') as mapFile:
+        data = mapFile.read()
+    magic, version, headerSize = _PREAMBLE.unpack_from(data, 0)
+    if magic != MAP_MAGIC or version > MAP_VERSION:
+        raise ValueError("{} is not a readable ani_sculpt correspondence map".format(mapPath))
+    header = json.loads(data[_PREAMBLE.size:_PREAMBLE.size + headerSize].decode('utf-8'))
+    count = header['count']
+    verticesOffset = _align(_PREAMBLE.size + headerSize)
+    weightsOffset = _align(verticesOffset + count * 12)
+    vertices = numpy.frombuffer(data, dtype=numpy.uint32, count=count * 3, offset=verticesOffset).reshape(-1, 3)
+    weights = numpy.frombuffer(data, dtype=numpy.float32, count=count * 3, offset=weightsOffset).reshape(-1, 3)
+    return header, (vertices, weights)
+
+
+def getCorrespondence(cacheRoot, sourcePoints, sourceTriangles, sourceTopologyHash, targetPoints, targetTopologyHash):
+    """get the correspondence map of two meshes, read from the cache root when it was already built
+
+    Args:
+        cacheRoot (str): cacheSculpt folder, the maps are kept in its retarget folder
+        sourcePoints (buffer): flat x y z rest points of the saved mesh
+        sourceTriangles (buffer): flat vertex indices of the saved mesh, three per triangle
+        sourceTopologyHash (str): getTopologyHash of the saved mesh
+        targetPoints (buffer): flat x y z rest points of the mesh the layers are loaded on
+        targetTopologyHash (str): getTopologyHash of the mesh the layers are loaded on
+
+    Returns:
+        correspondence (tuple): (vertices, weights) for transferDeltas
+    """
+    _requireNumpy()
+    mapPath = getCorrespondencePath(cacheRoot, sourceTopologyHash, targetTopologyHash)
+    targetCount = numpy.asarray(targetPoints).size // 3
+    if os.path.exists(mapPath):
+        try:
+            header, correspondence = readCorrespondence(mapPath)
+        except (ValueError, KeyError, struct.error):
+            header = None
+        if (header is not None and header['sourceTopology'] == sourceTopologyHash
+                and header['targetTopology'] == targetTopologyHash and header['count'] == targetCount):
+            return correspondence
+
+    correspondence = buildCorrespondence(sourcePoints, sourceTriangles, targetPoints)
+    writeCorrespondence(mapPath, correspondence, sourceTopologyHash, targetTopologyHash)
+    return correspondence
@@ -0,0 +1,393 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from array import array
+
+import functionsCore.animCurves
+import functionsCore.deltaBuffers
+import functionsCore.instrumentation
+from functionsCore.deltaBuffers import numpy
+
+CACHE_MAGIC = b"ASCULPT\0"
+CACHE_VERSION = 2
+CACHE_EXTENSION = ".ascache"
+CACHE_ALIGNMENT = 16
+COMPRESSION_LEVEL = 6
+
+_INT16_LIMIT = 32767
+STORAGE_KEYS = ('count', 'indicesOffset', 'deltasOffset', 'indicesSize', 'deltasSize',
+                'encoding', 'quantizeCenter', 'quantizeStep', 'compression', 'measuredError')
+
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def _align(offset):
+    return (offset + CACHE_ALIGNMENT - 1) // CACHE_ALIGNMENT * CACHE_ALIGNMENT
+
+
+def getCachePath(cacheFolder, sceneName):
+    """get the binary cache file of a scene inside a cacheSculpt/<mesh> folder
+
+    Args:
+        cacheFolder (str): folder returned by coreCmds.createCacheFolder
+        sceneName (str): scene name without extension
+
+    Returns:
+        cachePath (str): path of the cache file
+    """
+    return os.path.join(cacheFolder, sceneName + CACHE_EXTENSION)
+
+
+class CacheWriteCancelled(Exception):
+    """raised by blockStore.writeManifest when isCancelled returns True, the previous manifest is left untouched"""
+
+
+def getSparseEntry(entry, epsilon=functionsCore.deltaBuffers.SPARSE_EPSILON):
+    """get the sparse vertex indices and flat deltas of a saved layer, dense layers are converted
+
+    Args:
+        entry (dict): layer data as saved by coreProcs.getBlendshapeAnimationData
+        epsilon (float): deltas with every axis at or below this value are dropped from dense layers
+
+    Returns:
+        indices (list): sorted vertex indices
+        deltas (list): flat x y z offsets, three per index
+    """
+    if 'vertexIndices' in entry:
+        return entry['vertexIndices'], entry['positionsDeltas']
+    return functionsCore.deltaBuffers.encodeSparseDeltas(entry['positionsValues'], epsilon)
+
+
+def quantizeDeltas(deltas, maxError, quantization='int16'):
+    """quantize flat deltas within maxError, float32 is kept when the bound cannot be met
+
+    int16 stores round((delta - center) / step) per axis, center and step coming from the
+    bounding box of the target. The step is 2 * maxError, or the smallest step covering the
+    box in 65535 levels when that is coarser, in which case the target stays float32.
+
+    Args:
+        deltas (list or buffer): flat x y z offsets
+        maxError (float): largest error allowed on any axis, in scene units
+        quantization (str): int16 or float16, None keeps float32
+
+    Returns:
+        deltasBytes (bytes): encoded block
+        encoding (dict): encoding, quantizeCenter and quantizeStep for int16, to store in the header
+        measuredError (float): largest error of the decoded float32 deltas
+    """
+    values = numpy.asarray(deltas, dtype=numpy.float64).reshape(-1, 3)
+    if len(values) and quantization == 'float16':
+        encoded = values.astype(numpy.float16)
+        measuredError = float(numpy.abs(encoded.astype(numpy.float32) - values).max())
+        if measuredError <= maxError:
+            return encoded.tobytes(), {'encoding': 'float16'}, measuredError
+
+    elif len(values) and quantization == 'int16':
+        low = values.min(axis=0)
+        high = values.max(axis=0)
+        center = (low + high) * 0.5
+        step = numpy.maximum(2.0 * maxError, (high - low) / (2.0 * _INT16_LIMIT))
+        step[step == 0.0] = 1.0
+        if (step <= 2.0 * maxError).all():
+            quantized = numpy.clip(numpy.rint((values - center) / step), -_INT16_LIMIT, _INT16_LIMIT).astype(numpy.int16)
+            decoded = (quantized * step + center).astype(numpy.float32)
+            measuredError = float(numpy.abs(decoded - values).max())
+            if measuredError <= maxError:
+                return quantized.tobytes(), {'encoding': 'int16', 'quantizeCenter': center.tolist(),
+                                             'quantizeStep': step.tolist()}, measuredError
+
+    encoded = values.astype(numpy.float32)
+    measuredError = float(numpy.abs(encoded - values).max()) if len(values) else 0.0
+    return encoded.tobytes(), {'encoding': 'float32'}, measuredError
+
+
+def dequantizeDeltas(deltasBytes, count, target):
+    """decode a delta block written by quantizeDeltas to float32 flat x y z offsets in one vectorized pass"""
+    encoding = target.get('encoding', 'float32')
+    if encoding == 'float32':
+        return numpy.frombuffer(deltasBytes, dtype=numpy.float32, count=count * 3)
+    if encoding == 'float16':
+        return numpy.frombuffer(deltasBytes, dtype=numpy.float16, count=count * 3).astype(numpy.float32)
+    quantized = numpy.frombuffer(deltasBytes, dtype=numpy.int16, count=count * 3).reshape(-1, 3)
+    center = numpy.asarray(target['quantizeCenter'], dtype=numpy.float64)
+    step = numpy.asarray(target['quantizeStep'], dtype=numpy.float64)
+    return (quantized * step + center).astype(numpy.float32).reshape(-1)
+
+
+def encodeTarget(indices, deltas, maxError=None, quantization='int16', compression=None):
+    """encode the sparse data of one target to an index block and a delta block
+
+    Args:
+        indices (list): sorted vertex indices
+        deltas (list or buffer): flat x y z offsets, three per index
+        maxError (float): quantize the deltas within this error, see quantizeDeltas, None keeps float32
+        quantization (str): int16 or float16, used with maxError
+        compression (str): zlib to compress both blocks
+
+    Returns:
+        indicesBytes (bytes): index block
+        deltasBytes (bytes): delta block
+        encoding (dict): keys to store with the target, empty for plain uint32 and float32 blocks
+    """
+    if maxError is None and compression is None:
+        return (functionsCore.deltaBuffers.arrayToBytes(array('I', indices)),
+                functionsCore.deltaBuffers.arrayToBytes(array('f', deltas)), {})
+
+    if numpy is None:
+        raise RuntimeError("numpy is required to write quantized or compressed sculpt caches")
+    deltasBytes, encoding, measuredError = quantizeDeltas(deltas, maxError or 0.0, quantization if maxError is not None else None)
+    encoding['measuredError'] = measuredError
+
+    indices = numpy.asarray(indices, dtype=numpy.uint32)
+    if compression == 'zlib':
+        # sorted indices compress far better as gaps
+        indicesBytes = zlib.compress(numpy.diff(indices, prepend=numpy.uint32(0)).astype(numpy.uint32).tobytes(), COMPRESSION_LEVEL)
+        deltasBytes = zlib.compress(deltasBytes, COMPRESSION_LEVEL)
+        encoding['compression'] = 'zlib'
+    else:
+        indicesBytes = indices.tobytes()
+    return indicesBytes, deltasBytes, encoding
+
+
+def decodeTarget(target, indicesBytes, deltasBytes):
+    """decode the index and delta blocks of one target written by encodeTarget
+
+    Args:
+        target (dict): target header holding count and the encoding keys
+        indicesBytes (bytes): index block
+        deltasBytes (bytes): delta block
+
+    Returns:
+        indices (numpy.ndarray or array.array): uint32 vertex indices
+        deltas (numpy.ndarray or array.array): float32 flat x y z offsets
+    """
+    count = target['count']
+    if 'encoding' not in target:
+        if numpy is not None:
+            return (numpy.frombuffer(indicesBytes, dtype=numpy.uint32, count=count),
+                    numpy.frombuffer(deltasBytes, dtype=numpy.float32, count=count * 3))
+        indices = functionsCore.deltaBuffers.arrayFromBytes('I', indicesBytes[:count * array('I').itemsize])
+        deltas = functionsCore.deltaBuffers.arrayFromBytes('f', deltasBytes[:count * 3 * array('f').itemsize])
+        return indices, deltas
+
+    if numpy is None:
+        raise RuntimeError("numpy is required to read quantized or compressed sculpt caches")
+    if target.get('compression') == 'zlib':
+        indices = numpy.cumsum(numpy.frombuffer(zlib.decompress(indicesBytes), dtype=numpy.uint32), dtype=numpy.uint32)
+        deltasBytes = zlib.decompress(deltasBytes)
+    else:
+        indices = numpy.frombuffer(indicesBytes, dtype=numpy.uint32, count=count)
+    return indices, dequantizeDeltas(deltasBytes, count, target)
+
+
+def getEntryVertexCount(entry):
+    """get the vertex count of a saved layer, from its dense deltas when it was saved without vertexCount"""
+    if 'vertexCount' in entry:
+        return entry['vertexCount']
+    return len(functionsCore.deltaBuffers.flattenPointValues(entry.get('positionsValues', []))) // 3
+
+
+def encodeEntry(entry, epsilon=functionsCore.deltaBuffers.SPARSE_EPSILON, maxError=None, quantization='int16', compression=None):
+    """encode one saved layer to its blocks and the target header stored next to them
+
+    Args:
+        entry (dict): layer data as saved by coreProcs.getBlendshapeAnimationData
+        epsilon (float): deltas with every axis at or below this value are dropped from dense layers
+        maxError (float): quantize the deltas within this error, see encodeTarget
+        quantization (str): int16 or float16, used with maxError
+        compression (str): zlib to compress both blocks
+
+    Returns:
+        indicesBytes (bytes): index block
+        deltasBytes (bytes): delta block
+        target (dict): layer metadata with count, the block sizes and the encoding keys
+    """
+    indices, deltas = getSparseEntry(entry, epsilon)
+    indicesBytes, deltasBytes, encoding = encodeTarget(indices, deltas, maxError, quantization, compression)
+    target = dict((key, value) for key, value in entry.items()
+                  if key not in ('vertexIndices', 'positionsDeltas', 'positionsValues'))
+    target.update(encoding)
+    target['count'] = len(indices)
+    target['indicesSize'] = len(indicesBytes)
+    target['deltasSize'] = len(deltasBytes)
+    return indicesBytes, deltasBytes, target
+
+
+def replaceFile(sourcePath, destinationPath):
+    """rename sourcePath over destinationPath, os.replace is missing before Python 3.3"""
+    if hasattr(os, 'replace'):
+        os.replace(sourcePath, destinationPath)
+        return
+    if os.path.exists(destinationPath):
+        os.remove(destinationPath)
+    os.rename(sourcePath, destinationPath)
+
+
+def writeAtomic(filePath, writeCallback, mode='wb'):
+    """write a file through a temporary file renamed over filePath once complete
+
+    Args:
+        filePath (str): path of the file
+        writeCallback (callable): called with the open temporary file
+        mode (str): open mode of the temporary file
+
+    Returns:
+        filePath (str): path of the file
+    """
+    temporaryPath = filePath + ".tmp"
+    try:
+        with open(temporaryPath, mode) as temporaryFile:
+            writeCallback(temporaryFile)
+    except BaseException:
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+        raise
+    replaceFile(temporaryPath, filePath)
+    functionsCore.instrumentation.countBytesWritten(filePath)
+    return filePath
+
+
+class SculptCache(object):
+    """memory-mapped reader of a binary sculpt cache, only the requested target blocks are read"""
+
+    def __init__(self, cachePath):
+        self.cachePath = cachePath
+        self._file = open(cachePath, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, headerSize = _PREAMBLE.unpack_from(self._map, 0)
+        if magic != CACHE_MAGIC:
+            self.close()
+            raise ValueError("{} is not an ani_sculpt cache".format(cachePath))
+        if version > CACHE_VERSION:
+            self.close()
+            raise ValueError("{} uses cache version {}, newer than {}".format(cachePath, version, CACHE_VERSION))
+
+        self.header = json.loads(self._map[_PREAMBLE.size:_PREAMBLE.size + headerSize].decode('utf-8'))
+        self._dataOffset = _align(_PREAMBLE.size + headerSize)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """close the mapping, numpy views returned by readTarget must be released first"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    @property
+    def mesh(self):
+        return self.header['mesh']
+
+    @property
+    def vertexCount(self):
+        return self.header['vertexCount']
+
+    def targets(self):
+        return sorted(self.header['targets'])
+
+    def targetInfo(self, name):
+        return self.header['targets'][name]
+
+    def readTarget(self, name):
+        """read the sparse data of one target, numpy arrays are views over the mapped file
+
+        Args:
+            name (str): key of the target
+
+        Returns:
+            indices (numpy.ndarray or array.array): uint32 vertex indices
+            deltas (numpy.ndarray or array.array): float32 flat x y z offsets
+        """
+        target = self.header['targets'][name]
+        count = target['count']
+        indicesStart = self._dataOffset + target['indicesOffset']
+        deltasStart = self._dataOffset + target['deltasOffset']
+
+        if 'encoding' in target:
+            indicesBytes, deltasBytes = self.readTargetBytes(name)
+            return decodeTarget(target, indicesBytes, deltasBytes)
+
+        if numpy is not None:
+            indices = numpy.frombuffer(self._map, dtype=numpy.uint32, count=count, offset=indicesStart)
+            deltas = numpy.frombuffer(self._map, dtype=numpy.float32, count=count * 3, offset=deltasStart)
+            return indices, deltas
+
+        indices = functionsCore.deltaBuffers.arrayFromBytes('I', self._map[indicesStart:indicesStart + count * array('I').itemsize])
+        deltas = functionsCore.deltaBuffers.arrayFromBytes('f', self._map[deltasStart:deltasStart + count * 3 * array('f').itemsize])
+        return indices, deltas
+
+    def readTargetBytes(self, name):
+        """read the raw index and delta blocks of one target, used to decode quantized or compressed targets"""
+        target = self.header['targets'][name]
+        indicesStart = self._dataOffset + target['indicesOffset']
+        deltasStart = self._dataOffset + target['deltasOffset']
+        return (self._map[indicesStart:indicesStart + target.get('indicesSize', target['count'] * 4)],
+                self._map[deltasStart:deltasStart + target.get('deltasSize', target['count'] * 12)])
+
+    def readRestMesh(self):
+        """read the rest points and triangles of the saved mesh, used to retarget the layers,
+        binary caches are written without them
+
+        Returns:
+            restMesh (tuple): (points, triangles) numpy arrays of shape (n, 3), None when the cache has no rest mesh
+        """
+        return None
+
+    def sampleWeights(self, frames):
+        """sample the saved weight curve of every target at the given frames, without Maya
+
+        Args:
+            frames (iterable): frames to sample
+
+        Returns:
+            weights (dict): {target: weights at each frame}, targets saved without animCurve are skipped
+        """
+        return functionsCore.animCurves.sampleAnimationCurves(self.header['targets'], frames)
+
+
+def getCompressionReport(cache):
+    """measure the size of every target of a cache against plain uint32 indices and float32 deltas
+
+    Args:
+        cache (str or SculptCache): path of the cache file, or an open cache
+
+    Returns:
+        report (list): one dict per target with target, count, encoding, compression,
+            rawSize, storedSize, ratio and maxError, the error measured when it was written
+    """
+    report = []
+    sculptCache = cache if hasattr(cache, 'targetInfo') else SculptCache(cache)
+    try:
+        for name in sculptCache.targets():
+            target = sculptCache.targetInfo(name)
+            rawSize = target['count'] * 16
+            storedSize = target.get('indicesSize', target['count'] * 4) + target.get('deltasSize', target['count'] * 12)
+            report.append({'target': name, 'count': target['count'],
+                           'encoding': target.get('encoding', 'float32'), 'compression': target.get('compression'),
+                           'rawSize': rawSize, 'storedSize': storedSize,
+                           'ratio': float(rawSize) / storedSize if storedSize else 1.0,
+                           'maxError': target.get('measuredError', 0.0)})
+    finally:
+        if sculptCache is not cache:
+            sculptCache.close()
+    return report
+
+
+def getCompressionTotals(report):
+    """sum a report of getCompressionReport
+
+    Returns:
+        totals (dict): count, rawSize, storedSize, ratio and maxError of every target
+    """
+    rawSize = sum(row['rawSize'] for row in report)
+    storedSize = sum(row['storedSize'] for row in report)
+    return {'count': sum(row['count'] for row in report), 'rawSize': rawSize, 'storedSize': storedSize,
+            'ratio': float(rawSize) / storedSize if storedSize else 1.0,
+            'maxError': max([row['maxError'] for row in report] or [0.0])}
@@ -1,13 +1,22 @@
+import time
 import maya.cmds as cmds
 import maya.OpenMayaUI as omui
 from PySide2 import QtWidgets, QtCore, QtGui
 import maya.mel as mel
 import shiboken2
 import CONSTANTS
+import functionsCore.instrumentation
 import functionsCore.coreProcs
 import functionsCore.coreCmds
+import functionsCore.sculptCache
+import functionsCore.blendshapeIndex
+import functionsCore.layerPager
+reload(functionsCore.instrumentation)
 reload(functionsCore.coreProcs)
 reload(functionsCore.coreCmds)
+reload(functionsCore.sculptCache)
+reload(functionsCore.blendshapeIndex)
+reload(functionsCore.layerPager)
 
 
 def getMayaMainWindow():
@@ -37,6 +46,270 @@ class MayaEventFilter(QtCore.QObject):
         self.selectionChanged.emit(selectedMeshes)
 
 
+class FrameChangedPump(QtCore.QObject):
+    """coalesce timeChanged events into at most one refresh per interval, held back while playing or scrubbing"""
+
+    def __init__(self, callback, interval=100, parent=None):
+        super(FrameChangedPump, self).__init__(parent)
+        self.callback = callback
+        self.scriptJobID = None
+        self.playbackSlider = None
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.pump)
+        self.resetStats()
+
+    def startMonitoring(self):
+        self.playbackSlider = mel.eval("$tmpVar = $gPlayBackSlider")
+        self.scriptJobID = cmds.scriptJob(event=["timeChanged", self.onTimeChanged])
+
+    def stopMonitoring(self):
+        self.timer.stop()
+        try:
+            if self.scriptJobID is not None:
+                cmds.scriptJob(kill=self.scriptJobID, force=True)
+                self.scriptJobID = None
+        except:
+            pass
+
+    def onTimeChanged(self):
+        self.timeChangedCount += 1
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def isTimeChanging(self):
+        if cmds.play(query=True, state=True):
+            return True
+        return bool(self.playbackSlider and cmds.timeControl(self.playbackSlider, query=True, pressed=True))
+
+    def pump(self):
+        if self.isTimeChanging():
+            return
+        self.timer.stop()
+        start = time.time()
+        self.callback()
+        self.refreshTime += time.time() - start
+        self.refreshCount += 1
+
+    def resetStats(self):
+        self.statsStart = time.time()
+        self.timeChangedCount = 0
+        self.refreshCount = 0
+        self.refreshTime = 0.0
+
+    def stats(self):
+        elapsed = max(time.time() - self.statsStart, 1e-6)
+        return {'timeChangedPerSecond': self.timeChangedCount / elapsed,
+                'timeChanged': self.timeChangedCount,
+                'refreshes': self.refreshCount,
+                'coalesced': self.timeChangedCount - self.refreshCount,
+                'refreshMs': self.refreshTime * 1000.0,
+                'averageRefreshMs': self.refreshTime * 1000.0 / max(self.refreshCount, 1)}
+
+
+class SaveLayersThread(QtCore.QThread):
+    progressChanged = QtCore.Signal(int, int)
+
+    def __init__(self, jobs, parent=None):
+        super(SaveLayersThread, self).__init__(parent)
+        self.jobs = jobs
+        self.completedJobs = []
+        self.cancelled = False
+        self.error = None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def isCancelled(self):
+        return self.cancelled
+
+    def run(self):
+        total = sum(len(job['animationData']) for job in self.jobs)
+        offset = 0
+        for job in self.jobs:
+            onProgress = lambda done, count, offset=offset: self.progressChanged.emit(offset + done, total)
+            try:
+                functionsCore.coreProcs.writeAnimationSave(job, onProgress, self.isCancelled)
+            except functionsCore.sculptCache.CacheWriteCancelled:
+                return
+            except Exception as error:
+                # reported from onSaveLayersFinished, warnings must be raised on the main thread
+                self.error = "{}: {}".format(job['filePath'], error)
+                return
+            self.completedJobs.append(job)
+            offset += len(job['animationData'])
+
+
+class LayerListModel(QtCore.QAbstractListModel):
+    """sculpt layers of the selected blendShapes, updated by diffing against the target index"""
+
+    BlendshapeRole = QtCore.Qt.UserRole + 1
+    TargetIndexRole = QtCore.Qt.UserRole + 2
+    FrameRole = QtCore.Qt.UserRole + 3
+
+    def __init__(self, parent=None):
+        super(LayerListModel, self).__init__(parent)
+        self.layers = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.layers)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        blendshape, targetIndex, name, frame = self.layers[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return name
+        if role == self.BlendshapeRole:
+            return blendshape
+        if role == self.TargetIndexRole:
+            return targetIndex
+        if role == self.FrameRole:
+            return frame
+        return None
+
+    def setLayers(self, layers):
+        """apply the difference with the current rows as row removals, insertions and data changes
+
+        Args:
+            layers (list): (blendshape, target_index, name, frame) tuples, rows kept in a different order reset the model
+        """
+        newKeys = set((layer[0], layer[1]) for layer in layers)
+        oldKeys = set((layer[0], layer[1]) for layer in self.layers)
+        keptOld = [(layer[0], layer[1]) for layer in self.layers if (layer[0], layer[1]) in newKeys]
+        keptNew = [(layer[0], layer[1]) for layer in layers if (layer[0], layer[1]) in oldKeys]
+        if keptOld != keptNew:
+            self.beginResetModel()
+            self.layers = list(layers)
+            self.endResetModel()
+            return
+
+        row = len(self.layers) - 1
+        while row >= 0:
+            if (self.layers[row][0], self.layers[row][1]) in newKeys:
+                row -= 1
+                continue
+            last = row
+            while row >= 0 and (self.layers[row][0], self.layers[row][1]) not in newKeys:
+                row -= 1
+            self.beginRemoveRows(QtCore.QModelIndex(), row + 1, last)
+            del self.layers[row + 1:last + 1]
+            self.endRemoveRows()
+
+        row = 0
+        for layer in layers:
+            key = (layer[0], layer[1])
+            if row < len(self.layers) and (self.layers[row][0], self.layers[row][1]) == key:
+                if self.layers[row] != layer:
+                    self.layers[row] = layer
+                    self.dataChanged.emit(self.index(row), self.index(row))
+            else:
+                self.beginInsertRows(QtCore.QModelIndex(), row, row)
+                self.layers.insert(row, layer)
+                self.endInsertRows()
+            row += 1
+
+    def removeLayer(self, blendshape, name):
+        for row, layer in enumerate(self.layers):
+            if layer[0] == blendshape and layer[2] == name:
+                self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+                del self.layers[row]
+                self.endRemoveRows()
+                return True
+        return False
+
+
+class LayerFilterProxyModel(QtCore.QSortFilterProxyModel):
+    """filter layers by frame when the filter is a number like 12 or f12, by name otherwise"""
+
+    def __init__(self, parent=None):
+        super(LayerFilterProxyModel, self).__init__(parent)
+        self.filterText = ""
+
+    def setFilterText(self, text):
+        self.filterText = text.strip().lower()
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, sourceRow, sourceParent):
+        if not self.filterText:
+            return True
+        index = self.sourceModel().index(sourceRow, 0, sourceParent)
+        frameText = self.filterText[1:] if self.filterText.startswith("f") else self.filterText
+        try:
+            frame = float(frameText)
+        except ValueError:
+            return self.filterText in index.data().lower()
+        layerFrame = index.data(LayerListModel.FrameRole)
+        return layerFrame is not None and int(layerFrame) == int(frame)
+
+
+class TimelineMarkerOverlay(QtWidgets.QWidget):
+    """draw the sculpt frames as ticks over Maya's time slider"""
+
+    def __init__(self, parent=None):
+        super(TimelineMarkerOverlay, self).__init__(parent)
+        self.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+        self.setAttribute(QtCore.Qt.WA_NoSystemBackground)
+        self.frames = []
+        self.startFrame = 0.0
+        self.endFrame = 1.0
+        self.scriptJobID = None
+        if parent is not None:
+            parent.installEventFilter(self)
+            self.setGeometry(parent.rect())
+
+    @classmethod
+    def attachToTimeSlider(cls):
+        playbackSlider = mel.eval("$tmpVar = $gPlayBackSlider")
+        ptr = omui.MQtUtil.findControl(playbackSlider)
+        if ptr is None:
+            return None
+        overlay = cls(shiboken2.wrapInstance(int(ptr), QtWidgets.QWidget))
+        overlay.updateRange()
+        overlay.scriptJobID = cmds.scriptJob(event=["playbackRangeChanged", overlay.updateRange])
+        overlay.show()
+        return overlay
+
+    def stopMonitoring(self):
+        try:
+            if self.scriptJobID is not None:
+                cmds.scriptJob(kill=self.scriptJobID, force=True)
+                self.scriptJobID = None
+        except:
+            pass
+
+    def eventFilter(self, watched, event):
+        if watched is self.parent() and event.type() == QtCore.QEvent.Resize:
+            self.setGeometry(watched.rect())
+        return False
+
+    def updateRange(self):
+        self.startFrame = cmds.playbackOptions(query=True, minTime=True)
+        self.endFrame = cmds.playbackOptions(query=True, maxTime=True)
+        self.update()
+
+    def setFrames(self, frames):
+        if frames != self.frames:
+            self.frames = frames
+            self.update()
+
+    def paintEvent(self, event):
+        if not self.frames:
+            return
+        painter = QtGui.QPainter(self)
+        painter.setPen(QtGui.QPen(QtGui.QColor(255, 140, 0), 2))
+        frameCount = self.endFrame - self.startFrame + 1.0
+        height = self.height()
+        for frame in self.frames:
+            if frame < self.startFrame or frame > self.endFrame:
+                continue
+            x = int((frame - self.startFrame + 0.5) / frameCount * self.width())
+            painter.drawLine(x, height // 2, x, height)
+        painter.end()
+
+
 class BlendshapeItemDelegate(QtWidgets.QStyledItemDelegate):
 
     def __init__(self, parent=None):
@@ -92,15 +365,36 @@ class NodeWidget(QtWidgets.QWidget):
         super(NodeWidget, self).__init__(parent)
 
         self.eventFilter = MayaEventFilter(self)
+        self.blendshapeLookup = functionsCore.blendshapeIndex.BlendshapeLookupCache()
         self.sliderWidgets = {}
+        self.saveThread = None
+        self.framePump = FrameChangedPump(self.frameChangedCallback, parent=self)
+        self.pendingPreview = None
+        self.previewTimer = QtCore.QTimer(self)
+        self.previewTimer.setSingleShot(True)
+        self.previewTimer.setInterval(33)
+        self.previewTimer.timeout.connect(self.applySliderPreview)
         layout = QtWidgets.QVBoxLayout()
 
-        self.layersListWidget = QtWidgets.QListWidget(self)
-        self.layersListWidget.setItemDelegate(BlendshapeItemDelegate(self))
-        self.layersListWidget.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
-        self.layersListWidget.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
-        self.layersListWidget.customContextMenuRequested.connect(self.showContextMenu)
-        layout.addWidget(self.layersListWidget)
+        self.layerFilterLineEdit = QtWidgets.QLineEdit()
+        self.layerFilterLineEdit.setPlaceholderText("Filter by name or frame")
+        layout.addWidget(self.layerFilterLineEdit)
+
+        self.layersModel = LayerListModel(self)
+        self.layersProxyModel = LayerFilterProxyModel(self)
+        self.layersProxyModel.setSourceModel(self.layersModel)
+        self.layerFilterLineEdit.textChanged.connect(self.layersProxyModel.setFilterText)
+
+        self.layersListView = QtWidgets.QListView(self)
+        self.layersListView.setModel(self.layersProxyModel)
+        self.layersListView.setItemDelegate(BlendshapeItemDelegate(self))
+        self.layersListView.setUniformItemSizes(True)
+        self.layersListView.setLayoutMode(QtWidgets.QListView.Batched)
+        self.layersListView.setBatchSize(100)
+        self.layersListView.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.layersListView.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
+        self.layersListView.customContextMenuRequested.connect(self.showContextMenu)
+        layout.addWidget(self.layersListView)
 
         recordLayout = QtWidgets.QHBoxLayout()
 
@@ -146,6 +440,20 @@ class NodeWidget(QtWidgets.QWidget):
         self.openGraphEditorButton.clicked.connect(self.openGraphEditor)
         buttonLayout.addWidget(self.openGraphEditorButton)
 
+        self.previousSculptButton = QtWidgets.QPushButton("<")
+        self.previousSculptButton.setFixedWidth(30)
+        self.previousSculptButton.setFixedHeight(30)
+        self.previousSculptButton.setToolTip("Previous sculpt frame (Alt+,)")
+        self.previousSculptButton.clicked.connect(self.jumpToPreviousSculpt)
+        buttonLayout.addWidget(self.previousSculptButton)
+
+        self.nextSculptButton = QtWidgets.QPushButton(">")
+        self.nextSculptButton.setFixedWidth(30)
+        self.nextSculptButton.setFixedHeight(30)
+        self.nextSculptButton.setToolTip("Next sculpt frame (Alt+.)")
+        self.nextSculptButton.clicked.connect(self.jumpToNextSculpt)
+        buttonLayout.addWidget(self.nextSculptButton)
+
         recordLayout.addLayout(buttonLayout)
 
         layout.addLayout(recordLayout)
@@ -163,58 +471,209 @@ class NodeWidget(QtWidgets.QWidget):
         spacerItem2 = QtWidgets.QSpacerItem(0, 14)
         layout.addItem(spacerItem2)
 
+        saveLayout = QtWidgets.QHBoxLayout()
+
         self.saveLayersButton = QtWidgets.QPushButton("Save Layers")
         self.saveLayersButton.clicked.connect(self.saveLayers)
-        layout.addWidget(self.saveLayersButton)
+        saveLayout.addWidget(self.saveLayersButton)
+
+        self.maxErrorSpinBox = QtWidgets.QDoubleSpinBox()
+        self.maxErrorSpinBox.setDecimals(5)
+        self.maxErrorSpinBox.setRange(0.0, 1.0)
+        self.maxErrorSpinBox.setSingleStep(0.0001)
+        self.maxErrorSpinBox.setSpecialValueText("Lossless")
+        self.maxErrorSpinBox.setToolTip("Max error of the compressed deltas, in scene units")
+        saveLayout.addWidget(self.maxErrorSpinBox)
+
+        layout.addLayout(saveLayout)
+
+        saveProgressLayout = QtWidgets.QHBoxLayout()
+
+        self.saveProgressBar = QtWidgets.QProgressBar()
+        self.saveProgressBar.setVisible(False)
+        saveProgressLayout.addWidget(self.saveProgressBar)
+
+        self.cancelSaveButton = QtWidgets.QPushButton("Cancel")
+        self.cancelSaveButton.setVisible(False)
+        self.cancelSaveButton.clicked.connect(self.cancelSaveLayers)
+        saveProgressLayout.addWidget(self.cancelSaveButton)
+
+        layout.addLayout(saveProgressLayout)
+
+        loadLayout = QtWidgets.QHBoxLayout()
 
         self.loadLayersButton = QtWidgets.QPushButton("Load Layers")
         self.loadLayersButton.clicked.connect(self.loadLayers)
-        layout.addWidget(self.loadLayersButton)
+        loadLayout.addWidget(self.loadLayersButton)
+
+        self.retargetCheckBox = QtWidgets.QCheckBox("Retarget")
+        self.retargetCheckBox.setToolTip("Transfer the layers by closest point, for a mesh whose vertices changed since the save.\n"
+                                         "Layers saved on a different vertex count are always retargeted.")
+        loadLayout.addWidget(self.retargetCheckBox)
+
+        self.lazyCheckBox = QtWidgets.QCheckBox("Lazy")
+        self.lazyCheckBox.setToolTip("Only keep the layers active around the current time in memory, paged as the time changes")
+        loadLayout.addWidget(self.lazyCheckBox)
+
+        self.memoryBudgetSpinBox = QtWidgets.QSpinBox()
+        self.memoryBudgetSpinBox.setRange(16, 65536)
+        self.memoryBudgetSpinBox.setSingleStep(64)
+        self.memoryBudgetSpinBox.setSuffix(" MB")
+        self.memoryBudgetSpinBox.setValue(functionsCore.layerPager.MEMORY_BUDGET // (1024 * 1024))
+        self.memoryBudgetSpinBox.setToolTip("Memory of the lazily loaded layers paged in ahead of the current time")
+        self.memoryBudgetSpinBox.setEnabled(False)
+        self.lazyCheckBox.toggled.connect(self.memoryBudgetSpinBox.setEnabled)
+        loadLayout.addWidget(self.memoryBudgetSpinBox)
+
+        layout.addLayout(loadLayout)
+
+        profileLayout = QtWidgets.QHBoxLayout()
+
+        self.profileCheckBox = QtWidgets.QCheckBox("Profile")
+        self.profileCheckBox.setChecked(functionsCore.instrumentation.isEnabled())
+        self.profileCheckBox.setToolTip("Record the time, Maya calls and bytes written of each operation")
+        self.profileCheckBox.toggled.connect(functionsCore.instrumentation.setEnabled)
+        profileLayout.addWidget(self.profileCheckBox)
+
+        self.dumpProfileButton = QtWidgets.QPushButton("Dump Profile")
+        self.dumpProfileButton.setToolTip("Write the recorded operations as JSON, or as a Chrome trace with a .trace.json file")
+        self.dumpProfileButton.clicked.connect(self.dumpProfile)
+        profileLayout.addWidget(self.dumpProfileButton)
+
+        layout.addLayout(profileLayout)
 
         spacerItem3 = QtWidgets.QSpacerItem(0, 26)
         layout.addItem(spacerItem3)
 
         self.setLayout(layout)
-        self.layersListWidget.itemSelectionChanged.connect(self.handleLayerSelectionChanged)
+
+        self.timelineOverlay = None
+        previousSculptShortcut = QtWidgets.QShortcut(QtGui.QKeySequence("Alt+,"), self)
+        previousSculptShortcut.setContext(QtCore.Qt.WidgetWithChildrenShortcut)
+        previousSculptShortcut.activated.connect(self.jumpToPreviousSculpt)
+        nextSculptShortcut = QtWidgets.QShortcut(QtGui.QKeySequence("Alt+."), self)
+        nextSculptShortcut.setContext(QtCore.Qt.WidgetWithChildrenShortcut)
+        nextSculptShortcut.activated.connect(self.jumpToNextSculpt)
+        self.layersListView.selectionModel().selectionChanged.connect(self.handleLayerSelectionChanged)
+
+
+    def selectedLayers(self):
+        rows = sorted(self.layersListView.selectionModel().selectedRows(), key=lambda index: index.row())
+        return [index.data() for index in rows]
 
 
     def editTargetShape(self):
-        selectedItems = self.layersListWidget.selectedItems()
-        selection = cmds.ls(sl=True)
-        for node in cmds.listHistory(selection[0]):
-            if cmds.nodeType(node) == "blendShape":
-                blendshape_node = node
-        if selectedItems:
-            selectedLayer = selectedItems[0].text()
-            self.selectedLayerLabel.setText(selectedLayer)
-            functionsCore.coreProcs.editSelectedTarget(blendshape_node, selectedLayer)
+        with functionsCore.instrumentation.operation("NodeWidget.editTargetShape"):
+            selectedLayers = self.selectedLayers()
+            selection = cmds.ls(sl=True)
+            blendshape_node = self.blendshapeLookup.getBlendshape(selection[0])
+            if selectedLayers:
+                selectedLayer = selectedLayers[0]
+                self.selectedLayerLabel.setText(selectedLayer)
+                functionsCore.coreProcs.editSelectedTarget(blendshape_node, selectedLayer)
 
 
     def showContextMenu(self, pos):
         menu = QtWidgets.QMenu(self)
+        key_layers_action = menu.addAction("Key Selected Layers")
+        add_layers_at_keys_action = menu.addAction("Add Layers At Controller Keys")
         delete_layer_action = menu.addAction("Delete Layer")
-        action = menu.exec_(self.layersListWidget.viewport().mapToGlobal(pos))
+        action = menu.exec_(self.layersListView.viewport().mapToGlobal(pos))
+        if action == key_layers_action:
+            self.keySelectedLayers()
+        if action == add_layers_at_keys_action:
+            self.addLayersAtKeys()
         if action == delete_layer_action:
-            selected_items = self.layersListWidget.selectedItems()
-            if selected_items:
-                for item in selected_items:
-                    self.deleteSelectedLayers(item)
+            for selectedLayer in self.selectedLayers():
+                self.deleteSelectedLayers(selectedLayer)
+
+
+    def keySelectedLayers(self):
+        with functionsCore.instrumentation.operation("NodeWidget.keySelectedLayers"):
+            selection = cmds.ls(sl=True)
+            if not selection:
+                return
+            blendshape_node = self.blendshapeLookup.getBlendshape(selection[0])
+            functionsCore.coreCmds.keyTargetWeights(blendshape_node, self.selectedLayers())
 
 
     def saveLayers(self):
-        selection = cmds.ls(sl=True)
-        for node in cmds.listHistory(selection[0]):
-            if cmds.nodeType(node) == "blendShape":
-                blendshape_node = node
-                functionsCore.coreProcs.saveAnimation(blendshape_node)
+        with functionsCore.instrumentation.operation("NodeWidget.saveLayers"):
+            if self.saveThread is not None and self.saveThread.isRunning():
+                return
+            selection = cmds.ls(sl=True)
+            maxError = self.maxErrorSpinBox.value() or None
+            jobs = []
+            for blendshape_node in self.blendshapeLookup.getBlendshapes(selection[0]):
+                jobs.append(functionsCore.coreProcs.snapshotAnimationSave(blendshape_node, max_error=maxError))
+            if not jobs:
+                return
+
+            self.saveThread = SaveLayersThread(jobs, self)
+            self.saveThread.progressChanged.connect(self.onSaveLayersProgress)
+            self.saveThread.finished.connect(self.onSaveLayersFinished)
+            self.saveLayersButton.setEnabled(False)
+            self.saveProgressBar.setValue(0)
+            self.saveProgressBar.setVisible(True)
+            self.cancelSaveButton.setVisible(True)
+            self.saveThread.start()
+
+
+    def cancelSaveLayers(self):
+        if self.saveThread is not None:
+            self.saveThread.cancel()
+
+
+    def onSaveLayersProgress(self, done, total):
+        self.saveProgressBar.setMaximum(max(total, 1))
+        self.saveProgressBar.setValue(done)
+
+
+    def onSaveLayersFinished(self):
+        with functionsCore.instrumentation.operation("NodeWidget.onSaveLayersFinished"):
+            saveThread = self.saveThread
+            self.saveThread = None
+            try:
+                for job in saveThread.completedJobs:
+                    try:
+                        functionsCore.coreProcs.finishAnimationSave(job)
+                    except Exception as error:
+                        cmds.warning("Save Layers could not finish {}: {}".format(job['filePath'], error))
+                for job in saveThread.jobs:
+                    if job['previousCache'] is not None:
+                        job['previousCache'].close()
+                if saveThread.error is not None:
+                    cmds.warning("Save Layers failed, {} of {} blendshapes saved: {}".format(
+                        len(saveThread.completedJobs), len(saveThread.jobs), saveThread.error))
+                elif saveThread.cancelled:
+                    cmds.warning("Save Layers cancelled, {} of {} blendshapes saved".format(len(saveThread.completedJobs), len(saveThread.jobs)))
+            finally:
+                self.saveLayersButton.setEnabled(True)
+                self.saveProgressBar.setVisible(False)
+                self.cancelSaveButton.setVisible(False)
+                saveThread.deleteLater()
 
 
     def loadLayers(self):
-        selectedMeshes = cmds.ls(selection=True)
-        if selectedMeshes:
-            for mesh in selectedMeshes:
-                    mesh = "{}_postAnim".format(mesh)
-                    functionsCore.coreProcs.loadAnimation(mesh)
+        with functionsCore.instrumentation.operation("NodeWidget.loadLayers"):
+            selectedMeshes = cmds.ls(selection=True)
+            if selectedMeshes:
+                for mesh in selectedMeshes:
+                        mesh = "{}_postAnim".format(mesh)
+                        functionsCore.coreProcs.loadAnimation(mesh, retarget=self.retargetCheckBox.isChecked() or None,
+                                                              lazy=self.lazyCheckBox.isChecked(),
+                                                              memory_budget=self.memoryBudgetSpinBox.value() * 1024 * 1024)
+
+
+    def dumpProfile(self):
+        file_path, selected_filter = QtWidgets.QFileDialog.getSaveFileName(self, "Dump Profile", functionsCore.instrumentation.getDefaultDumpPath(),
+                                                             "JSON (*.json);;Chrome trace (*.trace.json)")
+        if not file_path:
+            return
+        chrome_trace = selected_filter.startswith("Chrome") or file_path.endswith(functionsCore.instrumentation.CHROME_TRACE_EXTENSION)
+        functionsCore.instrumentation.dumpLog(file_path, chrome_trace)
+        summary_path = functionsCore.instrumentation.dumpSummary(file_path, stats={'FrameChangedPump': self.framePump.stats()})
+        cmds.warning("Profile dumped: {} (summary: {})".format(file_path, summary_path))
 
 
     def openGraphEditor(self):
@@ -226,10 +685,9 @@ class NodeWidget(QtWidgets.QWidget):
 
 
     def handleLayerSelectionChanged(self):
-        selectedItems = self.layersListWidget.selectedItems()
-        if selectedItems:
-            selectedLayer = selectedItems[0].text()
-            self.createSliderWidget(selectedLayer)
+        selectedLayers = self.selectedLayers()
+        if selectedLayers:
+            self.createSliderWidget(selectedLayers[0])
 
 
     def clearSliderWidgets(self):
@@ -240,15 +698,54 @@ class NodeWidget(QtWidgets.QWidget):
 
 
     def updateBlendshapeSelection(self, selectedMeshes):
-        self.layersListWidget.clear()
         self.clearSliderWidgets()
-        selection = cmds.ls(sl=True)
-        if cmds.nodeType(selection[0]) == "transform":
-            for obj in selection:
-                for node in cmds.listHistory(obj):
-                    if cmds.nodeType(node) == "blendShape":
-                        for target in cmds.listAttr("{}.weight".format(node), multi=True):
-                            self.layersListWidget.addItem(target)
+        self.refreshLayers()
+
+
+    def refreshLayers(self):
+        with functionsCore.instrumentation.operation("NodeWidget.refreshLayers"):
+            layers = []
+            sculptFrames = set()
+            selection = cmds.ls(sl=True)
+            if selection and cmds.nodeType(selection[0]) == "transform":
+                for obj in selection:
+                    for node in self.blendshapeLookup.getBlendshapes(obj):
+                        # restart the paging of lazily loaded layers once their scene is reopened
+                        functionsCore.coreProcs.getLayerPager(node)
+                        targetIndex = functionsCore.blendshapeIndex.getTargetIndex(node)
+                        frames = targetIndex.frames()
+                        sculptFrames.update(targetIndex.sortedFrames())
+                        for index, target in sorted(targetIndex.aliasDict(reverse=True).items()):
+                            layers.append((node, index, target, frames.get(index)))
+            self.layersModel.setLayers(layers)
+            if self.timelineOverlay is not None:
+                self.timelineOverlay.setFrames(sorted(sculptFrames))
+
+
+    def jumpToSculpt(self, forward):
+        with functionsCore.instrumentation.operation("NodeWidget.jumpToSculpt"):
+            selection = cmds.ls(sl=True)
+            if not selection:
+                return
+            blendshape_node = self.blendshapeLookup.getBlendshape(selection[0])
+            if blendshape_node is None:
+                return
+            targetIndex = functionsCore.blendshapeIndex.getTargetIndex(blendshape_node)
+            currentFrame = cmds.currentTime(query=True)
+            if forward:
+                frame = targetIndex.nextFrame(currentFrame)
+            else:
+                frame = targetIndex.previousFrame(currentFrame)
+            if frame is not None:
+                cmds.currentTime(frame)
+
+
+    def jumpToPreviousSculpt(self):
+        self.jumpToSculpt(False)
+
+
+    def jumpToNextSculpt(self):
+        self.jumpToSculpt(True)
 
 
     def setSliderValue(self, blendshape_node):
@@ -259,59 +756,85 @@ class NodeWidget(QtWidgets.QWidget):
 
 
     def frameChangedCallback(self):
-        selectedItems = self.layersListWidget.selectedItems()
-        if selectedItems:
-            selectedLayer = selectedItems[0].text()
-            selection = cmds.ls(sl=True)
-            if cmds.nodeType(selection[0]) == "transform":
-                for obj in selection:
-                    for node in cmds.listHistory(obj):
-                        if cmds.nodeType(node) == "blendShape":
+        with functionsCore.instrumentation.operation("NodeWidget.frameChangedCallback"):
+            selectedLayers = self.selectedLayers()
+            if selectedLayers:
+                selectedLayer = selectedLayers[0]
+                selection = cmds.ls(sl=True)
+                if cmds.nodeType(selection[0]) == "transform":
+                    for obj in selection:
+                        for node in self.blendshapeLookup.getBlendshapes(obj):
                             blendShape = node
-                weight = cmds.getAttr("{}.{}".format(blendShape, selectedLayer)) * 100.0
-                slider = self.sliderWidgets.get(blendShape)
-                if slider is not None:
-                    slider.setValue(int(weight))
+                    weight = cmds.getAttr("{}.{}".format(blendShape, selectedLayer)) * 100.0
+                    slider = self.sliderWidgets.get(blendShape)
+                    if slider is not None and not slider.isSliderDown():
+                        slider.blockSignals(True)
+                        slider.setValue(int(weight))
+                        slider.blockSignals(False)
 
 
     def onSliderValueChanged(self, blendshape_node, value):
         weight = value / 100.0
-        selectedLayer = self.layersListWidget.selectedItems()
-        selectedLayer = selectedLayer[0].text()
-        cmds.setAttr("{}.{}".format(blendshape_node, selectedLayer), weight)
-        mel.eval('setKeyframe "{}.{}";'.format(blendshape_node,selectedLayer))
+        selectedLayer = self.selectedLayers()[0]
+        slider = self.sliderWidgets.get(blendshape_node)
+        if slider is not None and slider.isSliderDown():
+            self.pendingPreview = (blendshape_node, selectedLayer, weight)
+            if not self.previewTimer.isActive():
+                self.previewTimer.start()
+            return
+        functionsCore.coreCmds.keyTargetWeights(blendshape_node, [selectedLayer], weight)
 
 
-    def deleteSelectedLayers(self, item):
-        selection = cmds.ls(sl=True)
-        for node in cmds.listHistory(selection[0]):
-            if cmds.nodeType(node) == "blendShape":
-                blendshape_node = node
-        indexDict = functionsCore.coreCmds.get_alias_weight_dict(blendshape_node)
-        selected_index = indexDict[item.text()]
-        functionsCore.coreProcs.delete_blendshape_target(blendshape_node, selected_index)
-        self.layersListWidget.takeItem(self.layersListWidget.row(item))
-        self.layerRemoved.emit(item.text())
+    def applySliderPreview(self):
+        if self.pendingPreview is None:
+            return
+        blendshape_node, selectedLayer, weight = self.pendingPreview
+        self.pendingPreview = None
+        undoState = cmds.undoInfo(query=True, stateWithoutFlush=True)
+        cmds.undoInfo(stateWithoutFlush=False)
+        try:
+            cmds.setAttr("{}.{}".format(blendshape_node, selectedLayer), weight)
+        finally:
+            cmds.undoInfo(stateWithoutFlush=undoState)
+
+
+    def onSliderReleased(self, blendshape_node):
+        self.previewTimer.stop()
+        self.pendingPreview = None
+        selectedLayers = self.selectedLayers()
+        slider = self.sliderWidgets.get(blendshape_node)
+        if selectedLayers and slider is not None:
+            functionsCore.coreCmds.keyTargetWeights(blendshape_node, [selectedLayers[0]], slider.value() / 100.0)
+
+
+    def deleteSelectedLayers(self, selectedLayer):
+        with functionsCore.instrumentation.operation("NodeWidget.deleteSelectedLayers"):
+            selection = cmds.ls(sl=True)
+            blendshape_node = self.blendshapeLookup.getBlendshape(selection[0])
+            selected_index = functionsCore.blendshapeIndex.getTargetIndex(blendshape_node).getIndex(selectedLayer)
+            functionsCore.coreProcs.delete_blendshape_target(blendshape_node, selected_index)
+            self.layersModel.removeLayer(blendshape_node, selectedLayer)
+            self.layerRemoved.emit(selectedLayer)
 
 
     def createSliderWidget(self, selectedLayer):
         selection = cmds.ls(sl=True)
-        for node in cmds.listHistory(selection[0]):
-            if cmds.nodeType(node) == "blendShape":
-                blendshape_node = node
-        selectedItems = self.layersListWidget.selectedItems()
-        if selectedItems:
+        blendshape_node = self.blendshapeLookup.getBlendshape(selection[0])
+        if self.selectedLayers():
             weight_attr = "{}.{}".format(blendshape_node, selectedLayer)
             weight = cmds.getAttr(weight_attr) * 100.0
             if blendshape_node in self.sliderWidgets:
                 slider = self.sliderWidgets[blendshape_node]
+                slider.blockSignals(True)
                 slider.setSliderPosition(int(weight))
+                slider.blockSignals(False)
             else:
                 slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
                 slider.setMinimum(0)
                 slider.setMaximum(100)
                 slider.setSliderPosition(int(weight))
                 slider.valueChanged.connect(lambda value, bs_node=blendshape_node: self.onSliderValueChanged(bs_node, value))
+                slider.sliderReleased.connect(lambda bs_node=blendshape_node: self.onSliderReleased(bs_node))
                 slider.setObjectName(blendshape_node)
                 self.sliderWidgets[blendshape_node] = slider
                 self.sliderLayout.addWidget(slider)
@@ -325,32 +848,49 @@ class NodeWidget(QtWidgets.QWidget):
 
 
     def addLayer(self):
-        selectedMeshes = cmds.ls(selection=True)
-        selectedItems = self.layersListWidget.selectedItems()
-        if selectedItems:
-            selectedLayer = selectedItems[0].text()
-        if selectedMeshes:
-            for mesh in selectedMeshes:
-                isRecording = self.isRecordCheckBoxChecked()
-                if isRecording:
-                    mesh = "{}_postAnim".format(mesh)
-                    blendshape_node = functionsCore.coreProcs.createBlendshapeWithTarget(mesh)
-                    selectedItems = self.layersListWidget.selectedItems()
-                    if selectedItems:
-                        mel.eval('setAttr "{}.{}";'.format(blendshape_node,selectedLayer), 1.0)
+        with functionsCore.instrumentation.operation("NodeWidget.addLayer"):
+            selectedMeshes = cmds.ls(selection=True)
+            selectedLayers = self.selectedLayers()
+            if selectedLayers:
+                selectedLayer = selectedLayers[0]
+            if selectedMeshes:
+                for mesh in selectedMeshes:
+                    isRecording = self.isRecordCheckBoxChecked()
+                    if isRecording:
+                        mesh = "{}_postAnim".format(mesh)
+                        blendshape_node = functionsCore.coreProcs.createBlendshapeWithTarget(mesh)
+                        if self.selectedLayers():
+                            mel.eval('setAttr "{}.{}";'.format(blendshape_node,selectedLayer), 1.0)
+                self.refreshLayers()
+
+
+    def addLayersAtKeys(self):
+        with functionsCore.instrumentation.operation("NodeWidget.addLayersAtKeys"):
+            selectedMeshes = cmds.ls(selection=True)
+            if len(selectedMeshes) < 2:
+                cmds.warning("Please select the mesh, then the animated controllers.")
+                return
+            frames = functionsCore.coreProcs.getKeyedFrames(selectedMeshes[1:])
+            cmds.select(selectedMeshes[0])
+            mesh = "{}_postAnim".format(selectedMeshes[0])
+            functionsCore.coreProcs.createBlendshapeTargetsAtFrames(mesh, frames)
+            cmds.select(selectedMeshes)
+            self.refreshLayers()
 
 
 def showLayerEditor():
     mainWindow = getMayaMainWindow()
     mainWindow.findChildren(QtWidgets.QDockWidget, "Ani-Sculpt")
     blendshapeEditor = NodeWidget(parent=mainWindow)
-    cmds.scriptJob(event=["timeChanged", blendshapeEditor.frameChangedCallback])
+    blendshapeEditor.framePump.startMonitoring()
     dockWidget = QtWidgets.QDockWidget("Ani-Sculpt", mainWindow)
     dockWidget.setObjectName("Ani-Sculpt")
     dockWidget.setWidget(blendshapeEditor)
     mainWindow.addDockWidget(QtCore.Qt.LeftDockWidgetArea, dockWidget)
     eventFilter = blendshapeEditor.eventFilter
     eventFilter.startMonitoring()
+    blendshapeEditor.blendshapeLookup.startMonitoring()
+    blendshapeEditor.timelineOverlay = TimelineMarkerOverlay.attachToTimeSlider()
     eventFilter.selectionChanged.connect(blendshapeEditor.updateBlendshapeSelection)
     dockWidget.show()
 
@@ -0,0 +1,35 @@
+"""The tests run headless on the Maya stand-in of the benchmarks, from the ani_sculpt folder:
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import mayaStandIn
+
+mayaStandIn.install()
+
+MESH = "bodyMesh"
+BLENDSHAPE = MESH + "_blendShape"
+
+
+@pytest.fixture
+def scenePath(tmp_path):
+    return mayaStandIn.getScenePath(str(tmp_path))
+
+
+@pytest.fixture
+def meshScene(scenePath):
+    return mayaStandIn.buildMeshScene(scenePath, 50)
+
+
+@pytest.fixture
+def blendshapeScene(scenePath):
+    import functionsCore.blendshapeIndex
+    functionsCore.blendshapeIndex.clearTargetIndexes()
+    yield mayaStandIn.buildBlendshapeScene(scenePath, 200, 4, sculptedFraction=0.1)
+    functionsCore.blendshapeIndex.clearTargetIndexes()
@@ -0,0 +1,130 @@
+import pytest
+
+import functionsCore.animCurves as animCurves
+import functionsCore.coreCmds as coreCmds
+import functionsCore.deltaBuffers as deltaBuffers
+
+from conftest import BLENDSHAPE
+
+FRAMES_PER_SECOND = 24.0
+FRAMES = [frame * 0.25 for frame in range(-120, 161)]
+
+requiresNumpy = pytest.mark.skipif(deltaBuffers.numpy is None, reason="numpy is not installed")
+
+
+def _makeCurve(times, values, slopes, weighted=False, outTangentTypes=None, preInfinity='constant',
+               postInfinity='constant', tangentLength=1.0):
+    """build curve data with fixed tangents of the given slope in value per frame, x in seconds like keyTangent"""
+    tangentX = [tangentLength / FRAMES_PER_SECOND] * len(times)
+    return {'curveType': 'animCurveTU', 'framesPerSecond': FRAMES_PER_SECOND, 'weighted': weighted,
+            'preInfinity': preInfinity, 'postInfinity': postInfinity,
+            'times': list(times), 'values': list(values),
+            'inTangentTypes': ['fixed'] * len(times), 'outTangentTypes': outTangentTypes or ['fixed'] * len(times),
+            'inX': list(tangentX), 'inY': [slope * tangentLength for slope in slopes],
+            'outX': list(tangentX), 'outY': [slope * tangentLength for slope in slopes],
+            'tangentLocks': [True] * len(times)}
+
+
+def _makeRamp(**options):
+    """two keys from (0, 0) to (10, 10) with tangents along the ramp, the curve is the line value = frame"""
+    return _makeCurve([0.0, 10.0], [0.0, 10.0], [1.0, 1.0], **options)
+
+
+CURVES = {
+    'flat': _makeCurve([0.0, 8.0, 20.0], [0.0, 1.0, -0.5], [0.0, 0.0, 0.0]),
+    'sloped': _makeCurve([0.0, 8.0, 20.0], [0.0, 1.0, -0.5], [0.3, -0.2, 0.1]),
+    'weighted': _makeCurve([0.0, 8.0, 20.0], [0.0, 1.0, -0.5], [0.3, -0.2, 0.1], weighted=True, tangentLength=6.0),
+    'step': _makeCurve([0.0, 8.0, 20.0], [0.0, 1.0, -0.5], [0.0, 0.0, 0.0], outTangentTypes=['step', 'fixed', 'fixed']),
+    'stepnext': _makeCurve([0.0, 8.0, 20.0], [0.0, 1.0, -0.5], [0.0, 0.0, 0.0],
+                           outTangentTypes=['fixed', 'stepnext', 'fixed']),
+    'cycle': _makeCurve([0.0, 8.0, 20.0], [0.0, 1.0, -0.5], [0.3, -0.2, 0.1], preInfinity='cycle', postInfinity='cycle'),
+    'cycleRelative': _makeCurve([0.0, 8.0, 20.0], [0.0, 1.0, -0.5], [0.3, -0.2, 0.1],
+                                preInfinity='cycleRelative', postInfinity='cycleRelative'),
+    'oscillate': _makeCurve([0.0, 8.0, 20.0], [0.0, 1.0, -0.5], [0.3, -0.2, 0.1],
+                            preInfinity='oscillate', postInfinity='oscillate'),
+    'linear': _makeCurve([0.0, 8.0, 20.0], [0.0, 1.0, -0.5], [0.3, -0.2, 0.1], preInfinity='linear', postInfinity='linear'),
+}
+
+
+@requiresNumpy
+@pytest.mark.parametrize('name', sorted(CURVES))
+def test_numpyMatchesScalarEvaluation(name):
+    curveData = CURVES[name]
+    scalar = [animCurves.evaluateCurveAt(curveData, frame) for frame in FRAMES]
+    assert list(animCurves.evaluateCurve(curveData, FRAMES)) == pytest.approx(scalar, abs=1e-9)
+
+
+@pytest.mark.parametrize('weighted', [False, True])
+def test_rampFollowsItsTangents(weighted):
+    # weighted tangents a third of the span long sit on the same line as the non weighted ones
+    curveData = _makeRamp(weighted=weighted, tangentLength=10.0 if weighted else 1.0)
+    for frame in (0.0, 2.5, 5.0, 7.5, 10.0):
+        assert animCurves.evaluateCurveAt(curveData, frame) == pytest.approx(frame, abs=1e-6)
+
+
+def test_weightedTangentLengthChangesTheCurve():
+    short = CURVES['sloped']
+    weighted = CURVES['weighted']
+    assert animCurves.evaluateCurveAt(weighted, 4.0) != pytest.approx(animCurves.evaluateCurveAt(short, 4.0), abs=1e-3)
+    for frame in (0.0, 8.0, 20.0):
+        assert animCurves.evaluateCurveAt(weighted, frame) == pytest.approx(animCurves.evaluateCurveAt(short, frame))
+
+
+def test_stepHoldsTheKeyValue():
+    curveData = CURVES['step']
+    assert animCurves.evaluateCurveAt(curveData, 0.0) == 0.0
+    assert animCurves.evaluateCurveAt(curveData, 7.9) == 0.0
+    assert animCurves.evaluateCurveAt(curveData, 8.0) == 1.0
+
+
+def test_stepNextJumpsToTheNextValue():
+    curveData = CURVES['stepnext']
+    assert animCurves.evaluateCurveAt(curveData, 8.0) == 1.0
+    assert animCurves.evaluateCurveAt(curveData, 8.1) == -0.5
+    assert animCurves.evaluateCurveAt(curveData, 19.9) == -0.5
+
+
+@pytest.mark.parametrize('infinity, before, after', [
+    ('constant', 0.0, 10.0),
+    ('linear', -3.0, 13.0),
+    ('cycle', 7.0, 3.0),
+    ('cycleRelative', -3.0, 13.0),
+    ('oscillate', 3.0, 7.0),
+])
+def test_infinity(infinity, before, after):
+    curveData = _makeRamp(preInfinity=infinity, postInfinity=infinity)
+    assert animCurves.evaluateCurveAt(curveData, -3.0) == pytest.approx(before)
+    assert animCurves.evaluateCurveAt(curveData, 13.0) == pytest.approx(after)
+    assert list(animCurves.evaluateCurve(curveData, [-3.0, 13.0])) == pytest.approx([before, after])
+
+
+def test_sampleAnimationCurvesSkipsLayersWithoutCurve():
+    animationData = {'ramp': {'animCurve': _makeRamp()}, 'static': {'animCurve': None}, 'legacy': {}}
+    weights = animCurves.sampleAnimationCurves(animationData, [2.0, 4.0])
+    assert list(weights) == ['ramp']
+    assert list(weights['ramp']) == pytest.approx([2.0, 4.0])
+
+
+def test_getFramesPerSecond():
+    assert animCurves.getFramesPerSecond('film') == 24.0
+    assert animCurves.getFramesPerSecond('ntsc') == 30.0
+    assert animCurves.getFramesPerSecond('23.976fps') == 23.976
+
+
+def test_savedCurveRebuildsTheSameKeys(blendshapeScene):
+    curveData = coreCmds.getAnimationCurveData("{}_weight_0".format(BLENDSHAPE))
+    rebuilt = coreCmds.createAnimationCurve("rebuiltWeight", curveData)
+    assert coreCmds.getAnimationCurveData(rebuilt) == curveData
+
+
+def test_fixedStepAndInfinityRoundTrip(blendshapeScene):
+    curveData = _makeCurve([0.0, 8.0, 20.0], [0.0, 1.0, -0.5], [0.3, -0.2, 0.1], weighted=True,
+                           outTangentTypes=['fixed', 'step', 'fixed'], preInfinity='oscillate', postInfinity='linear')
+    # Maya recomputes the tangents of non fixed sides, the stand-in leaves them at their defaults
+    curveData['outX'][1] = 1.0
+    curveData['outY'][1] = 0.0
+    destination = "{}.weight[0]".format(BLENDSHAPE)
+    animCurve = coreCmds.createAnimationCurve("rebuiltWeight", curveData, destination)
+    assert coreCmds.getAnimationCurveData(animCurve) == curveData
+    assert blendshapeScene.connections["{}.weight[0]".format(BLENDSHAPE)] == animCurve + ".output"
+    assert animCurves.evaluateCurveAt(curveData, 12.0) == 1.0
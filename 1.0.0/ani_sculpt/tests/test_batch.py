@@ -0,0 +1,109 @@
+import json
+import os
+
+import functionsCore.batch as batch
+import functionsCore.blockStore as blockStore
+
+from conftest import MESH
+
+
+def _writeScene(folder, name, withLayers=True):
+    """an empty scene file with, unless withLayers is False, the JSON layers convert reads next to it"""
+    scenePath = os.path.join(folder, name + ".ma")
+    with open(scenePath, 'w') as sceneFile:
+        sceneFile.write("//Maya ASCII scene\n")
+    if withLayers:
+        _writeLayers(scenePath)
+    return scenePath
+
+
+def _writeLayers(scenePath):
+    animationData = {'pCube1_weight_0': {'vertexCount': 8, 'vertexIndices': [1, 5],
+                                         'positionsDeltas': [0.5, 0.0, 0.0, 0.0, -1.0, 0.25]}}
+    with open(batch.getAnimationJsonPath(scenePath), 'w') as jsonFile:
+        json.dump(animationData, jsonFile)
+
+
+def _runConvert(scenes, statePath, *arguments):
+    return batch.main(['convert'] + scenes + ['--mesh', MESH, '--state', statePath, '--processes', '1'] + list(arguments))
+
+
+def _getEntries(statePath, scenes):
+    state = batch.readState(statePath)
+    return [state['jobs'][batch.getJobId('convert', scene, [MESH])] for scene in scenes]
+
+
+def test_batchRecordsJobStateAndReport(tmp_path, capsys):
+    folder = str(tmp_path)
+    scenes = [_writeScene(folder, "shot010"), _writeScene(folder, "shot020"), _writeScene(folder, "shot030", withLayers=False)]
+    statePath = os.path.join(folder, "batch", "state.json")
+    reportPath = os.path.join(folder, "report.json")
+
+    assert _runConvert(scenes, statePath, '--report', reportPath) == 1
+
+    done, other, failed = _getEntries(statePath, scenes)
+    for entry in (done, other):
+        assert entry['status'] == batch.DONE
+        assert entry['attempts'] == 1
+        assert entry['error'] is None
+        assert os.path.exists(entry['result'][0])
+        with blockStore.openCache(entry['result'][0]) as manifestCache:
+            assert list(manifestCache.readTarget('pCube1_weight_0')[0]) == [1, 5]
+    assert failed['status'] == batch.FAILED
+    assert failed['attempts'] == 1
+    assert "shot030_animation_data.json" in failed['error']
+    with open(failed['log']) as logFile:
+        assert "Traceback" in logFile.read()
+
+    with open(reportPath) as reportFile:
+        report = json.load(reportFile)
+    assert (report['jobs'], report[batch.DONE], report[batch.FAILED], report[batch.PENDING]) == (3, 2, 1, 0)
+    assert report['outputs'] == 2
+    assert [failure['scene'] for failure in report['failures']] == [scenes[2]]
+    assert "3 jobs: 2 done, 1 failed, 0 pending, 2 files written" in capsys.readouterr().out
+
+
+def test_batchResumesAndSkipsFailedJobs(tmp_path):
+    folder = str(tmp_path)
+    scenes = [_writeScene(folder, "shot010"), _writeScene(folder, "shot020", withLayers=False)]
+    statePath = os.path.join(folder, "state.json")
+    assert _runConvert(scenes, statePath) == 1
+
+    # the missing layers are written, but failed jobs stay failed with --skip-failed
+    _writeLayers(scenes[1])
+    assert _runConvert(scenes, statePath, '--skip-failed') == 1
+    done, failed = _getEntries(statePath, scenes)
+    assert (done['status'], done['attempts']) == (batch.DONE, 1)
+    assert (failed['status'], failed['attempts']) == (batch.FAILED, 1)
+
+    # a plain run retries the failed job only
+    assert _runConvert(scenes, statePath) == 0
+    done, retried = _getEntries(statePath, scenes)
+    assert (done['status'], done['attempts']) == (batch.DONE, 1)
+    assert (retried['status'], retried['attempts']) == (batch.DONE, 2)
+    assert retried['error'] is None
+
+
+def test_summarizeCountsPendingJobs():
+    state = {'jobs': {
+        'a': {'id': 'a', 'scene': 'a.ma', 'status': batch.DONE, 'seconds': 1.5, 'result': ['a.asmanifest', 'b.asmanifest']},
+        'b': {'id': 'b', 'scene': 'b.ma', 'status': batch.PENDING},
+        'c': {'id': 'c', 'scene': 'c.ma', 'status': batch.FAILED, 'seconds': 0.5, 'error': 'ValueError: boom', 'log': 'c.log'},
+    }}
+    summary = batch.summarize(state, ['a', 'b'])
+    assert (summary['jobs'], summary[batch.DONE], summary[batch.PENDING], summary[batch.FAILED]) == (2, 1, 1, 0)
+    assert summary['outputs'] == 2
+    assert summary['seconds'] == 1.5
+
+    lines = batch.formatSummary(batch.summarize(state)).splitlines()
+    assert lines[0] == "3 jobs: 1 done, 1 failed, 1 pending, 2 files written, 2.00s of job time"
+    assert lines[1] == "  failed c.ma: ValueError: boom (log c.log)"
+
+
+def test_jobIdsAreStablePerSceneAndMeshes(tmp_path):
+    scenePath = os.path.join(str(tmp_path), "shot010.ma")
+    jobId = batch.getJobId('bake', scenePath, [MESH])
+    assert jobId.startswith("bake_shot010_")
+    assert batch.getJobId('bake', scenePath, [MESH]) == jobId
+    assert batch.getJobId('bake', scenePath) != jobId
+    assert batch.getJobId('save', scenePath, [MESH]) != jobId
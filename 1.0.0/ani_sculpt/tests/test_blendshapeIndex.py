@@ -0,0 +1,92 @@
+import maya.cmds as cmds
+import maya.OpenMaya as OpenMaya
+
+import functionsCore.blendshapeIndex as blendshapeIndex
+import functionsCore.coreProcs as coreProcs
+
+from conftest import BLENDSHAPE, MESH
+
+FIRST_ALIAS = "{}_f1_target_0".format(BLENDSHAPE)
+
+
+def _getNode(name):
+    node = OpenMaya.MObject()
+    node.name = name
+    return node
+
+
+class _Plug(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def partialName(self, *args):
+        return self.name
+
+    def node(self):
+        return _getNode(self.name.split(".")[0])
+
+
+def test_renameTargetUpdatesIndex(blendshapeScene):
+    targetIndex = blendshapeIndex.getTargetIndex(BLENDSHAPE)
+    assert targetIndex.getIndex(FIRST_ALIAS) == 0
+    coreProcs.renameTarget(FIRST_ALIAS, "smile", mesh=MESH)
+    assert targetIndex.getName(0) == "smile"
+    assert targetIndex.getIndex(FIRST_ALIAS) is None
+
+
+def test_unreportedRenameIsFoundOnLookup(blendshapeScene):
+    targetIndex = blendshapeIndex.getTargetIndex(BLENDSHAPE)
+    targetIndex.aliasDict()
+    cmds.aliasAttr("smile", "{}.{}".format(BLENDSHAPE, FIRST_ALIAS))
+    assert targetIndex.getIndex("smile") == 0
+
+
+def test_attributeRenamedInvalidates(blendshapeScene):
+    targetIndex = blendshapeIndex.getTargetIndex(BLENDSHAPE)
+    targetIndex.aliasDict()
+    targetIndex.frames()
+    cmds.aliasAttr("smile", "{}.{}".format(BLENDSHAPE, FIRST_ALIAS))
+    targetIndex._onAttributeChanged(OpenMaya.MNodeMessage.kAttributeRenamed, _Plug("smile"), None)
+    assert targetIndex.getName(0) == "smile"
+
+
+def test_lookupCacheHitsAndMisses(blendshapeScene):
+    lookup = blendshapeIndex.BlendshapeLookupCache()
+    assert lookup.getBlendshape(MESH) == BLENDSHAPE
+    assert lookup.getBlendshape(MESH) == BLENDSHAPE
+    assert lookup.stats() == {'hits': 1, 'misses': 1, 'entries': 1}
+
+    blendshapeScene.resetCalls()
+    lookup.getBlendshapes(MESH)
+    assert sum(blendshapeScene.calls.values()) == 0
+
+
+def test_lookupCacheInvalidatesOnBlendshapeRename(blendshapeScene):
+    lookup = blendshapeIndex.BlendshapeLookupCache()
+    lookup.getBlendshape(MESH)
+    cmds.rename(BLENDSHAPE, "faceShapes")
+    lookup._onNodeRenamed(_getNode("faceShapes"), BLENDSHAPE)
+    assert lookup.stats()['entries'] == 0
+    assert lookup.getBlendshape(MESH) == "faceShapes"
+    assert lookup.misses == 2
+
+
+def test_lookupCacheKeepsEntriesOnUnrelatedRename(blendshapeScene):
+    lookup = blendshapeIndex.BlendshapeLookupCache()
+    lookup.getBlendshape(MESH)
+    curve = "{}_weight_0".format(BLENDSHAPE)
+    cmds.rename(curve, "smile_weight")
+    lookup._onNodeRenamed(_getNode("smile_weight"), curve)
+    assert lookup.stats()['entries'] == 1
+
+
+def test_lookupCacheInvalidatesOnMeshConnection(blendshapeScene):
+    lookup = blendshapeIndex.BlendshapeLookupCache()
+    lookup.getBlendshape(MESH)
+    curve = "{}_weight_0".format(BLENDSHAPE)
+    lookup._onConnectionChanged(_Plug(curve + ".output"), _Plug(curve + ".input"), True)
+    assert lookup.stats()['entries'] == 1
+    shape = cmds.listRelatives(MESH, shapes=True)[0]
+    lookup._onConnectionChanged(_Plug(curve + ".output"), _Plug(shape + ".inMesh"), True)
+    assert lookup.stats()['entries'] == 0
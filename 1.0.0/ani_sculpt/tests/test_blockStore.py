@@ -0,0 +1,131 @@
+import mmap
+import os
+import struct
+
+import pytest
+
+import functionsCore.blockStore as blockStore
+
+
+def _writeTestBlock(cacheRoot, count=2, pending=None):
+    indicesBytes = struct.pack("<{}I".format(count), *range(count))
+    deltasBytes = struct.pack("<{}f".format(count * 3), *([0.5] * count * 3))
+    return blockStore.writeBlock(cacheRoot, indicesBytes, deltasBytes, {'count': count}, pending)
+
+
+def test_readBlockRoundTrip(tmp_path):
+    cacheRoot = str(tmp_path)
+    blockHash, size = _writeTestBlock(cacheRoot, count=3)
+    assert size == os.path.getsize(blockStore.getBlockPath(cacheRoot, blockHash))
+    blockHeader, indicesBytes, deltasBytes = blockStore.readBlock(cacheRoot, blockHash)
+    assert blockHeader['count'] == 3
+    assert struct.unpack("<3I", indicesBytes) == (0, 1, 2)
+    assert struct.unpack("<9f", deltasBytes) == (0.5,) * 9
+
+
+def test_pendingBlockSurvivesGarbageCollection(tmp_path):
+    cacheRoot = str(tmp_path)
+    pending = blockStore._PendingBlocks(cacheRoot)
+    blockHash, size = _writeTestBlock(cacheRoot, pending=pending)
+    blockPath = blockStore.getBlockPath(cacheRoot, blockHash)
+
+    assert blockStore.collectGarbage(cacheRoot) == 0
+    assert os.path.exists(blockPath)
+
+    pending.release()
+    assert blockStore.collectGarbage(cacheRoot) == size
+    assert not os.path.exists(blockPath)
+
+
+def test_pendingBlockSurvivesManifestRemoval(tmp_path):
+    cacheRoot = str(tmp_path)
+    manifestPath = blockStore.getManifestPath(os.path.join(cacheRoot, "bodyMesh"), "scene")
+    os.makedirs(os.path.dirname(manifestPath))
+    animationData = {'layer': {'originFrame': 1.0, 'vertexIndices': [0, 1],
+                               'positionsDeltas': [0.5] * 6}}
+    blockStore.writeManifest(manifestPath, "bodyMesh", animationData, sizeLimit=None)
+    blockHash = blockStore._readManifest(manifestPath)['targets']['layer']['block']
+
+    # another save found the block already stored and is about to reference it
+    pending = blockStore._PendingBlocks(cacheRoot)
+    assert _writeTestBlock(cacheRoot, pending=pending)[0] == blockHash
+    blockStore.removeManifest(manifestPath)
+    assert os.path.exists(blockStore.getBlockPath(cacheRoot, blockHash))
+    pending.release()
+
+
+def test_stalePendingListIsIgnored(tmp_path):
+    cacheRoot = str(tmp_path)
+    pending = blockStore._PendingBlocks(cacheRoot)
+    blockHash, size = _writeTestBlock(cacheRoot, pending=pending)
+    staleTime = os.path.getmtime(pending.pendingPath) - blockStore.STALE_PENDING_AGE - 1
+    os.utime(pending.pendingPath, (staleTime, staleTime))
+
+    assert blockStore.collectGarbage(cacheRoot) == size
+    assert not os.path.exists(pending.pendingPath)
+
+
+def _writeTestManifest(cacheRoot, **options):
+    manifestPath = blockStore.getManifestPath(os.path.join(cacheRoot, "bodyMesh"), "scene")
+    if not os.path.exists(os.path.dirname(manifestPath)):
+        os.makedirs(os.path.dirname(manifestPath))
+    animationData = {'layer': {'originFrame': 1.0, 'vertexIndices': [2, 5],
+                               'positionsDeltas': [0.5, -1.0, 0.25, 0.0, 0.0, 2.0]}}
+    return blockStore.writeManifest(manifestPath, "bodyMesh", animationData, sizeLimit=None, **options)
+
+
+def test_manifestCacheReadTarget(tmp_path):
+    with blockStore.openCache(_writeTestManifest(str(tmp_path))) as manifestCache:
+        indices, deltas = manifestCache.readTarget('layer')
+        assert list(indices) == [2, 5]
+        assert list(deltas) == [0.5, -1.0, 0.25, 0.0, 0.0, 2.0]
+
+
+@pytest.mark.skipif(blockStore.numpy is None, reason="numpy is not installed")
+def test_manifestCacheMapsFloatBlocks(tmp_path):
+    with blockStore.openCache(_writeTestManifest(str(tmp_path))) as manifestCache:
+        indices, deltas = manifestCache.readTarget('layer')
+    assert isinstance(deltas.base.obj, mmap.mmap)
+    assert isinstance(indices.base.obj, mmap.mmap)
+
+
+@pytest.mark.skipif(blockStore.numpy is None, reason="numpy is not installed")
+def test_manifestCacheReadsCompressedBlocks(tmp_path):
+    with blockStore.openCache(_writeTestManifest(str(tmp_path), maxError=0.001, compression='zlib')) as manifestCache:
+        indices, deltas = manifestCache.readTarget('layer')
+    assert list(indices) == [2, 5]
+    assert list(deltas) == pytest.approx([0.5, -1.0, 0.25, 0.0, 0.0, 2.0], abs=0.001)
+
+
+def test_emptyTargetRoundTrip(tmp_path):
+    cacheRoot = str(tmp_path)
+    manifestPath = blockStore.getManifestPath(os.path.join(cacheRoot, "bodyMesh"), "scene")
+    os.makedirs(os.path.dirname(manifestPath))
+    animationData = {'empty': {'originFrame': 1.0, 'vertexIndices': [], 'positionsDeltas': []},
+                     'layer': {'originFrame': 3.0, 'vertexIndices': [2], 'positionsDeltas': [0.5, 0.0, 0.0]}}
+    blockStore.writeManifest(manifestPath, "bodyMesh", animationData, sizeLimit=None)
+
+    with blockStore.openCache(manifestPath) as manifestCache:
+        blockHash = manifestCache.targetInfo('empty')['block']
+        blockMap, blockHeader, indicesOffset, deltasOffset = blockStore.mapBlock(cacheRoot, blockHash)
+        assert len(blockMap) == deltasOffset
+        blockMap.close()
+        indices, deltas = manifestCache.readTarget('empty')
+        assert list(indices) == []
+        assert list(deltas) == []
+
+
+def test_shortEmptyBlockIsReadable(tmp_path):
+    cacheRoot = str(tmp_path)
+    blockHash, size = blockStore.writeBlock(cacheRoot, b"", b"", {'count': 0})
+    blockPath = blockStore.getBlockPath(cacheRoot, blockHash)
+    # blocks written before the offsets were padded stop right after their header
+    with open(blockPath, 'r+b') as blockFile:
+        magic, version, headerSize = blockStore._PREAMBLE.unpack(blockFile.read(blockStore._PREAMBLE.size))
+        blockFile.truncate(blockStore._PREAMBLE.size + headerSize)
+    manifestCache = blockStore.ManifestCache.__new__(blockStore.ManifestCache)
+    manifestCache.cacheRoot = cacheRoot
+    manifestCache.header = {'targets': {'empty': {'block': blockHash}}}
+    indices, deltas = manifestCache.readTarget('empty')
+    assert list(indices) == []
+    assert list(deltas) == []
@@ -0,0 +1,37 @@
+import maya.cmds as cmds
+
+import functionsCore.coreCmds as coreCmds
+import functionsCore.coreProcs as coreProcs
+
+from conftest import BLENDSHAPE, MESH
+
+
+def test_getVertexPositionsMatchesPerVertex(meshScene):
+    positions = list(coreCmds.getVertexPositions(MESH))
+    perVertex = coreCmds.getVertexPositionsPerVertex(MESH)
+    assert len(positions) == len(perVertex) * 3
+    assert positions == [axis for position in perVertex for axis in position]
+
+
+def test_getVertexPositionsIsOneQuery(meshScene):
+    meshScene.resetCalls()
+    coreCmds.getVertexPositions(MESH)
+    assert sum(meshScene.calls.values()) == 1
+
+
+def test_emptyTargetHasZeroDeltas(blendshapeScene, monkeypatch):
+    coreCmds.setTargetDeltas(BLENDSHAPE, 0, [], [])
+    assert list(coreCmds.getTargetDeltas(BLENDSHAPE, 0, 200)) == [0.0] * 600
+
+    def evaluate(*args):
+        raise AssertionError("empty targets must not be evaluated")
+    monkeypatch.setattr(coreProcs, 'getTargetDeltasByEvaluation', evaluate)
+    animationData = coreProcs.getBlendshapeAnimationData(BLENDSHAPE, mesh=MESH)
+    assert [] in [list(entry['vertexIndices']) for entry in animationData.values()]
+
+
+def test_connectedTargetIsEvaluated(blendshapeScene):
+    coreCmds.setTargetDeltas(BLENDSHAPE, 0, [], [])
+    targetItem = "{}.inputTarget[0].inputTargetGroup[0].inputTargetItem[{}]".format(BLENDSHAPE, coreCmds.TARGET_ITEM_INDEX)
+    cmds.connectAttr(MESH + "Shape.worldMesh[0]", targetItem + ".inputGeomTarget")
+    assert coreCmds.getTargetDeltas(BLENDSHAPE, 0, 200) is None
@@ -0,0 +1,76 @@
+import maya.cmds as cmds
+import pytest
+
+import functionsCore.coreProcs as coreProcs
+import functionsCore.deltaBuffers as deltaBuffers
+import functionsCore.sculptCache as sculptCache
+
+from conftest import BLENDSHAPE, MESH
+
+
+@pytest.mark.skipif(deltaBuffers.numpy is None, reason="numpy is not installed")
+def test_compressedSaveReportsInTheWarning(blendshapeScene, capsys):
+    job = coreProcs.snapshotAnimationSave(BLENDSHAPE, max_error=0.001, mesh=MESH)
+    coreProcs.writeAnimationSave(job)
+    report = coreProcs.finishAnimationSave(job)
+    assert len(report) == 4
+    totals = sculptCache.getCompressionTotals(report)
+    assert totals['maxError'] <= 0.001
+    assert "{:.2f}x smaller".format(totals['ratio']) in blendshapeScene.warnings[-1]
+    assert capsys.readouterr().out == ""
+
+
+def test_saveWithoutMaxErrorHasNoReport(blendshapeScene):
+    job = coreProcs.snapshotAnimationSave(BLENDSHAPE, mesh=MESH)
+    coreProcs.writeAnimationSave(job)
+    assert coreProcs.finishAnimationSave(job) is None
+    assert blendshapeScene.warnings[-1].startswith("Animation data saved")
+
+
+def _recordSelectionReads(monkeypatch):
+    reads = []
+    ls = cmds.ls
+
+    def recordingLs(*args, **kwargs):
+        if kwargs.get('selection'):
+            reads.append(kwargs)
+        return ls(*args, **kwargs)
+    monkeypatch.setattr(cmds, 'ls', recordingLs)
+    return reads
+
+
+def test_loadOnGivenMeshLeavesTheSelectionAlone(blendshapeScene, monkeypatch):
+    coreProcs.saveAnimation(BLENDSHAPE, binary=True, mesh=MESH)
+    cmds.select(["persp"])
+    reads = _recordSelectionReads(monkeypatch)
+    coreProcs.loadAnimation("loadedShapes", binary=True, mesh=MESH)
+    assert reads == []
+    assert blendshapeScene.selection == ["persp"]
+
+
+def test_loadOnSelectedMeshReadsTheSelectionOnce(blendshapeScene, monkeypatch):
+    coreProcs.saveAnimation(BLENDSHAPE, binary=True, mesh=MESH)
+    cmds.select([MESH])
+    reads = _recordSelectionReads(monkeypatch)
+    coreProcs.loadAnimation("loadedShapes", binary=True)
+    assert len(reads) == 1
+    assert blendshapeScene.selection == [MESH]
+
+
+def test_renameTargetReadsTheSelectionOnlyWithoutMesh(blendshapeScene, monkeypatch):
+    alias = "{}_f1_target_0".format(BLENDSHAPE)
+    reads = _recordSelectionReads(monkeypatch)
+    coreProcs.renameTarget(alias, "smile", mesh=MESH)
+    assert reads == []
+
+    cmds.select([MESH])
+    coreProcs.renameTarget("smile", "frown")
+    assert len(reads) == 1
+    assert blendshapeScene.selection == [MESH]
+    assert cmds.attributeQuery("frown", node=BLENDSHAPE, exists=True)
+
+
+def test_createLayersWithoutMeshOrSelectionWarns(blendshapeScene):
+    cmds.select([])
+    assert coreProcs.createBlendshapeTargetsAtFrames(BLENDSHAPE, [10.0]) == []
+    assert blendshapeScene.warnings[-1] == "Please select the base object for the blendShape."
@@ -0,0 +1,32 @@
+import pytest
+
+import functionsCore.deltaBuffers as deltaBuffers
+
+
+@pytest.fixture(params=['numpy', 'array'])
+def bufferBackend(request, monkeypatch):
+    if request.param == 'numpy':
+        if deltaBuffers.numpy is None:
+            pytest.skip("numpy is not installed")
+    else:
+        monkeypatch.setattr(deltaBuffers, 'numpy', None)
+    return request.param
+
+
+def test_encodeSparseDeltasKeepsMovedVertices(bufferBackend):
+    deltas = [[0.0, 0.0, 0.0], [0.5, 0.0, 0.0], [0.0, 0.0, 1e-6], [0.0, -2.0, 0.25]]
+    indices, values = deltaBuffers.encodeSparseDeltas(deltas)
+    assert list(indices) == [1, 3]
+    assert list(values) == [0.5, 0.0, 0.0, 0.0, -2.0, 0.25]
+
+
+def test_sparseDeltasRoundTrip(bufferBackend):
+    deltas = [0.0] * 30
+    deltas[6:9] = [1.0, 2.0, 3.0]
+    deltas[27:30] = [-0.5, 0.0, 0.125]
+    indices, values = deltaBuffers.encodeSparseDeltas(deltas)
+    assert list(deltaBuffers.decodeSparseDeltas(10, indices, values)) == deltas
+
+
+def test_decodeSparseDeltasEmpty(bufferBackend):
+    assert list(deltaBuffers.decodeSparseDeltas(4, [], [])) == [0.0] * 12
@@ -0,0 +1,44 @@
+import atexit
+import os
+
+import functionsCore.instrumentation as instrumentation
+
+
+def test_exitDumpRegisteredOncePerSession(monkeypatch, tmp_path):
+    registered = []
+    monkeypatch.setattr(atexit, 'register', registered.append)
+    monkeypatch.setenv(instrumentation.DUMP_ENVIRONMENT_VARIABLE, str(tmp_path / "profile.json"))
+    monkeypatch.setattr(instrumentation, '_exitDumpRegistered', False)
+    try:
+        reload(instrumentation)
+        reload(instrumentation)
+        assert len(registered) == 1
+    finally:
+        monkeypatch.delenv(instrumentation.DUMP_ENVIRONMENT_VARIABLE)
+        instrumentation.setEnabled(False)
+
+
+def test_dumpSummaryIsWrittenNextToTheDump(tmp_path):
+    instrumentation.clearLog()
+    instrumentation.setEnabled(True)
+    try:
+        with instrumentation.operation("test.operation"):
+            pass
+        tracePath = instrumentation.dumpLog(str(tmp_path / "profile.trace.json"))
+        summaryPath = instrumentation.dumpSummary(tracePath)
+    finally:
+        instrumentation.setEnabled(False)
+        instrumentation.clearLog()
+    assert summaryPath == str(tmp_path / "profile.summary.txt")
+    with open(summaryPath) as summaryFile:
+        assert "test.operation" in summaryFile.read()
+    assert os.path.exists(tracePath)
+
+
+def test_dumpSummaryWritesStats(tmp_path):
+    summaryPath = instrumentation.dumpSummary(str(tmp_path / "profile.json"), summary={},
+                                              stats={'FrameChangedPump': {'refreshes': 3, 'averageRefreshMs': 1.23456}})
+    with open(summaryPath) as summaryFile:
+        text = summaryFile.read()
+    assert "FrameChangedPump" in text
+    assert "refreshes" in text and "1.235" in text
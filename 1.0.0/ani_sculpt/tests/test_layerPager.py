@@ -0,0 +1,70 @@
+import maya.cmds as cmds
+import pytest
+
+import functionsCore.blendshapeIndex as blendshapeIndex
+import functionsCore.blockStore
+import functionsCore.coreCmds as coreCmds
+import functionsCore.coreProcs as coreProcs
+import functionsCore.layerPager as layerPager
+
+from benchmarks import mayaStandIn
+from conftest import BLENDSHAPE, MESH
+
+
+@pytest.fixture
+def lazyScene(scenePath):
+    blendshapeIndex.clearTargetIndexes()
+    layerPager.clearPagers()
+    mayaStandIn.buildBlendshapeScene(scenePath, 200, 4, sculptedFraction=0.1)
+    coreProcs.saveAnimation(BLENDSHAPE, binary=True, mesh=MESH)
+    blendshapeIndex.clearTargetIndexes()
+    scene = mayaStandIn.buildMeshScene(scenePath, 200)
+    coreProcs.loadAnimation(BLENDSHAPE, binary=True, lazy=True, mesh=MESH)
+    yield scene
+    layerPager.clearPagers()
+    blendshapeIndex.clearTargetIndexes()
+
+
+def test_updateRestoresTheUndoState(lazyScene):
+    pager = layerPager.getPager(BLENDSHAPE)
+    pager.window = 0
+    pager.memoryBudget = 0
+    for undoState in (False, True):
+        cmds.undoInfo(stateWithoutFlush=undoState)
+        pager.update(frame=-1000)
+        pager.update(frame=1)
+        assert cmds.undoInfo(query=True, stateWithoutFlush=True) is undoState
+
+
+def test_saveDoesNotStartAPager(lazyScene):
+    layerPager.clearPagers()
+    scriptJobs = lazyScene.scriptJobs
+    animationData = coreProcs.getBlendshapeAnimationData(BLENDSHAPE, mesh=MESH)
+    assert layerPager.getPager(BLENDSHAPE) is None
+    assert lazyScene.scriptJobs == scriptJobs
+    # the empty layers of the reopened scene are read back from the cache
+    assert all(entry['vertexIndices'] for entry in animationData.values())
+
+
+def test_pagedInLayersKeepTheirSavedHash(lazyScene):
+    pager = layerPager.getPager(BLENDSHAPE)
+    pager.update(frame=1)
+    assert pager.resident
+    savedHashes = sorted(info['contentHash'] for info in pager.sculptCache.header['targets'].values())
+
+    # the layers are keyed by the curves of the load once saved again, their hashes stay the saved ones
+    coreProcs.saveAnimation(BLENDSHAPE, binary=True, mesh=MESH)
+    manifest = functionsCore.blockStore.ManifestCache(coreProcs.getAnimationManifestPath(MESH))
+    previousHashes = dict((key, info['contentHash']) for key, info in manifest.header['targets'].items())
+    assert sorted(previousHashes.values()) == savedHashes
+    animationData = coreProcs.getBlendshapeAnimationData(BLENDSHAPE, previousHashes=previousHashes, mesh=MESH)
+    assert all('vertexIndices' not in entry for entry in animationData.values())
+
+    edited = sorted(pager.resident)[0]
+    item = "{}.inputTarget[0].inputTargetGroup[{}].inputTargetItem[{}]".format(BLENDSHAPE, edited, coreCmds.TARGET_ITEM_INDEX)
+    cmds.setAttr(item + ".inputPointsTarget", [(1.0, 2.0, 3.0, 1.0)])
+    cmds.setAttr(item + ".inputComponentsTarget", ["vtx[0]"])
+    animationData = coreProcs.getBlendshapeAnimationData(BLENDSHAPE, previousHashes=previousHashes, mesh=MESH)
+    extracted = [entry for entry in animationData.values() if 'vertexIndices' in entry]
+    assert len(extracted) == 1
+    assert list(extracted[0]['vertexIndices']) == [0]
@@ -0,0 +1,64 @@
+import pytest
+
+import functionsCore.blockStore as blockStore
+import functionsCore.coreProcs as coreProcs
+import functionsCore.deltaBuffers as deltaBuffers
+import functionsCore.pointCache as pointCache
+
+from benchmarks import mayaStandIn
+from conftest import BLENDSHAPE, MESH
+
+numpy = deltaBuffers.numpy
+pytestmark = pytest.mark.skipif(numpy is None, reason="numpy is not installed")
+
+VERTICES = 20
+SHIFT = 50.0
+
+
+@pytest.fixture
+def twoLayerScene(scenePath):
+    import functionsCore.blendshapeIndex
+    functionsCore.blendshapeIndex.clearTargetIndexes()
+    scene = mayaStandIn.buildBlendshapeScene(scenePath, VERTICES, 2, sculptedFraction=0.5)
+    # keep the weight curves of the two layers apart, layer 0 peaks at frame 1, layer 1 at frame 53
+    curve = scene.nodes["{}_weight_1".format(BLENDSHAPE)]
+    curve['times'] = [time + SHIFT for time in curve['times']]
+    yield scene
+    functionsCore.blendshapeIndex.clearTargetIndexes()
+
+
+def test_bakedFramesMatchTheLayers(twoLayerScene, tmp_path):
+    manifestPath = coreProcs.saveAnimation(BLENDSHAPE, binary=True, mesh=MESH)
+    basePoints = coreProcs.getBasePoints(BLENDSHAPE, MESH)
+    animationData = coreProcs.getBlendshapeAnimationData(BLENDSHAPE, encode=False, mesh=MESH)
+    deltas = dict((entry['originFrame'], numpy.asarray(entry['positionsValues']).reshape(-1, 3))
+                  for entry in animationData.values())
+    rest = numpy.asarray(basePoints, dtype=numpy.float64).reshape(-1, 3)
+
+    pointCachePath = str(tmp_path / "bodyMesh.aspoints")
+    frames = [1.0, 30.0, 1.0 + 2 + SHIFT]
+    pointCache.bakePointCache(manifestPath, basePoints, pointCachePath, frames, batchSize=2)
+
+    with pointCache.PointCache(pointCachePath) as baked:
+        assert baked.mesh == MESH
+        assert baked.vertexCount == VERTICES
+        assert baked.frames() == frames
+        assert numpy.allclose(baked.restPoints(), rest, atol=1e-5)
+        assert numpy.allclose(baked.readFrame(1.0), rest + deltas[1], atol=1e-5)
+        assert numpy.allclose(baked.readFrame(30.0), rest, atol=1e-5)
+        assert numpy.allclose(baked.readFrame(frames[2]), rest + deltas[3], atol=1e-5)
+        assert baked.readFrames().shape == (3, VERTICES, 3)
+
+    assert pointCache.comparePointCache(pointCachePath, animationData, basePoints) < 1e-5
+
+
+def test_bakeFromTheManifestMatchesTheEvaluation(twoLayerScene, tmp_path):
+    manifestPath = coreProcs.saveAnimation(BLENDSHAPE, binary=True, mesh=MESH)
+    basePoints = coreProcs.getBasePoints(BLENDSHAPE, MESH)
+    frames = [float(frame) for frame in range(-5, 60, 4)]
+    pointCachePath = pointCache.bakePointCache(manifestPath, basePoints, str(tmp_path / "bodyMesh.aspoints"), frames)
+
+    with blockStore.openCache(manifestPath) as sculptCache:
+        expected = pointCache.evaluateFrames(pointCache.loadLayers(sculptCache), basePoints, frames)
+    with pointCache.PointCache(pointCachePath) as baked:
+        assert numpy.allclose(baked.readFrames(), expected, atol=1e-5)
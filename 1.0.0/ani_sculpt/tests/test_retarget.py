@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+import functionsCore.deltaBuffers as deltaBuffers
+import functionsCore.retarget as retarget
+
+numpy = deltaBuffers.numpy
+
+pytestmark = pytest.mark.skipif(numpy is None, reason="numpy is not installed")
+
+
+def _makeGrid(size=12, seed=0):
+    """flat x y z points and triangles of a size by size grid with a slightly noisy height"""
+    random = numpy.random.RandomState(seed)
+    x, z = numpy.meshgrid(numpy.arange(size, dtype=numpy.float64), numpy.arange(size, dtype=numpy.float64))
+    points = numpy.stack((x.reshape(-1), random.uniform(-0.1, 0.1, size * size), z.reshape(-1)), axis=1)
+    triangles = []
+    for row in range(size - 1):
+        for column in range(size - 1):
+            corner = row * size + column
+            triangles.extend((corner, corner + 1, corner + size, corner + 1, corner + size + 1, corner + size))
+    return points.reshape(-1), numpy.array(triangles, dtype=numpy.uint32)
+
+
+@pytest.mark.parametrize('leafSize', [1, 4, retarget.LEAF_SIZE])
+def test_kdTreeMatchesBruteForce(leafSize):
+    random = numpy.random.RandomState(1)
+    points = random.uniform(-1.0, 1.0, (500, 3))
+    queries = numpy.concatenate((random.uniform(-1.5, 1.5, (300, 3)), points[::25]))
+
+    distances, indices = retarget.KDTree(points, leafSize=leafSize).query(queries)
+
+    bruteForce = numpy.sqrt(((queries[:, None, :] - points[None, :, :]) ** 2).sum(axis=-1))
+    assert distances == pytest.approx(bruteForce.min(axis=1))
+    assert (indices == bruteForce.argmin(axis=1)).all()
+
+
+def test_kdTreeWithOnePoint():
+    distances, indices = retarget.KDTree([1.0, 2.0, 3.0]).query([1.0, 2.0, 4.0, 1.0, 2.0, 3.0])
+    assert list(indices) == [0, 0]
+    assert list(distances) == pytest.approx([1.0, 0.0])
+
+
+def test_identicalMeshMapsToIdentity():
+    points, triangles = _makeGrid()
+    vertices, weights = retarget.buildCorrespondence(points, triangles, points)
+    vertexCount = len(points) // 3
+    ownWeight = (weights * (vertices == numpy.arange(vertexCount)[:, None])).sum(axis=1)
+    assert ownWeight == pytest.approx(numpy.ones(vertexCount), abs=1e-5)
+
+    indices = numpy.array([3, 40, 77], dtype=numpy.uint32)
+    deltas = numpy.array([0.5, 0.0, -0.25, 1.0, 2.0, 3.0, 0.0, 0.0, 0.125], dtype=numpy.float32)
+    movedIndices, movedDeltas = retarget.transferDeltas((vertices, weights), indices, deltas, vertexCount)
+    assert list(movedIndices) == list(indices)
+    assert list(movedDeltas) == pytest.approx(list(deltas), abs=1e-5)
+
+
+def test_pointsBetweenVerticesInterpolate():
+    points, triangles = _makeGrid(size=2)
+    # the middle of the shared edge of the two triangles of a quad
+    target = (points.reshape(-1, 3)[1] + points.reshape(-1, 3)[2]) * 0.5
+    vertices, weights = retarget.buildCorrespondence(points, triangles, target)
+    assert sorted(vertices[0][weights[0] > 1e-6]) == [1, 2]
+    assert sorted(weights[0][weights[0] > 1e-6]) == pytest.approx([0.5, 0.5], abs=1e-5)
+
+
+def test_getCorrespondenceReusesTheStoredMap(tmp_path, monkeypatch):
+    points, triangles = _makeGrid()
+    topologyHash = retarget.getTopologyHash(len(points) // 3, triangles)
+    cacheRoot = str(tmp_path)
+    built = retarget.getCorrespondence(cacheRoot, points, triangles, topologyHash, points, topologyHash)
+    assert os.path.exists(retarget.getCorrespondencePath(cacheRoot, topologyHash, topologyHash))
+
+    def build(*args):
+        raise AssertionError("the stored map must be reused")
+    monkeypatch.setattr(retarget, 'buildCorrespondence', build)
+    vertices, weights = retarget.getCorrespondence(cacheRoot, points, triangles, topologyHash, points, topologyHash)
+    assert (vertices == built[0]).all()
+    assert (weights == built[1]).all()
+
+
+def test_getCorrespondenceRebuildsForAnotherTopology(tmp_path, monkeypatch):
+    points, triangles = _makeGrid()
+    targetPoints, targetTriangles = _makeGrid(size=10, seed=2)
+    sourceHash = retarget.getTopologyHash(len(points) // 3, triangles)
+    targetHash = retarget.getTopologyHash(len(targetPoints) // 3, targetTriangles)
+    assert sourceHash != targetHash
+    cacheRoot = str(tmp_path)
+    retarget.getCorrespondence(cacheRoot, points, triangles, sourceHash, points, sourceHash)
+
+    builds = []
+    buildCorrespondence = retarget.buildCorrespondence
+
+    def build(*args):
+        builds.append(args)
+        return buildCorrespondence(*args)
+    monkeypatch.setattr(retarget, 'buildCorrespondence', build)
+    vertices, weights = retarget.getCorrespondence(cacheRoot, points, triangles, sourceHash, targetPoints, targetHash)
+    assert len(builds) == 1
+    assert len(vertices) == len(targetPoints) // 3
+
+    # a map whose header names another topology under the same file name is rebuilt, not trusted
+    mapPath = retarget.getCorrespondencePath(cacheRoot, sourceHash, targetHash)
+    otherHash = targetHash[:16] + "0" * (len(targetHash) - 16)
+    retarget.writeCorrespondence(mapPath, (vertices, weights), sourceHash, otherHash)
+    retarget.getCorrespondence(cacheRoot, points, triangles, sourceHash, targetPoints, targetHash)
+    assert len(builds) == 2
+    header, correspondence = retarget.readCorrespondence(mapPath)
+    assert header['targetTopology'] == targetHash
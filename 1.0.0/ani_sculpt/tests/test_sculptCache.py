@@ -0,0 +1,63 @@
+import pytest
+
+import functionsCore.deltaBuffers as deltaBuffers
+import functionsCore.sculptCache as sculptCache
+
+INDICES = [0, 3, 4, 17]
+DELTAS = [0.5, -0.25, 0.0, 1.0, 2.0, 3.0, -4.0, 0.125, 0.75, 0.001, -0.002, 0.003]
+
+requiresNumpy = pytest.mark.skipif(deltaBuffers.numpy is None, reason="numpy is not installed")
+
+
+def _roundTrip(indices, deltas, **options):
+    indicesBytes, deltasBytes, encoding = sculptCache.encodeTarget(indices, deltas, **options)
+    target = dict(encoding, count=len(indices))
+    return sculptCache.decodeTarget(target, indicesBytes, deltasBytes)
+
+
+@pytest.mark.parametrize('withNumpy', [True, False])
+def test_losslessTargetRoundTrip(withNumpy, monkeypatch):
+    if withNumpy and deltaBuffers.numpy is None:
+        pytest.skip("numpy is not installed")
+    if not withNumpy:
+        monkeypatch.setattr(sculptCache, 'numpy', None)
+    indices, deltas = _roundTrip(INDICES, DELTAS)
+    assert list(indices) == INDICES
+    assert list(deltas) == pytest.approx(DELTAS, abs=1e-7)
+
+
+def test_emptyTargetRoundTrip():
+    indices, deltas = _roundTrip([], [])
+    assert list(indices) == []
+    assert list(deltas) == []
+
+
+@requiresNumpy
+@pytest.mark.parametrize('quantization', ['int16', 'float16'])
+def test_quantizedTargetStaysWithinMaxError(quantization):
+    maxError = 0.01
+    indicesBytes, deltasBytes, encoding = sculptCache.encodeTarget(INDICES, DELTAS, maxError, quantization)
+    assert encoding['measuredError'] <= maxError
+    indices, deltas = sculptCache.decodeTarget(dict(encoding, count=len(INDICES)), indicesBytes, deltasBytes)
+    assert list(indices) == INDICES
+    assert list(deltas) == pytest.approx(DELTAS, abs=maxError)
+
+
+@requiresNumpy
+def test_compressedTargetRoundTrip():
+    indices, deltas = _roundTrip(INDICES, DELTAS, compression='zlib')
+    assert list(indices) == INDICES
+    assert list(deltas) == pytest.approx(DELTAS, abs=1e-7)
+
+
+@requiresNumpy
+def test_quantizedCompressedTargetRoundTrip():
+    indices, deltas = _roundTrip(INDICES, DELTAS, maxError=0.01, compression='zlib')
+    assert list(indices) == INDICES
+    assert list(deltas) == pytest.approx(DELTAS, abs=0.01)
+
+
+def test_quantizedTargetNeedsNumpy(monkeypatch):
+    monkeypatch.setattr(sculptCache, 'numpy', None)
+    with pytest.raises(RuntimeError):
+        sculptCache.encodeTarget(INDICES, DELTAS, maxError=0.01)